@@ -0,0 +1,260 @@
+"""
+Admission control for /identify-lyrics.
+
+Each identification loads several GB of models and keeps the CPU busy for a
+minute or more, so a worker only takes on what it can finish:
+
+  * uploads are limited to MAX_UPLOAD_MB while the body streams in
+    (UploadLimitMiddleware), before the multipart parser spools them to disk;
+  * format and duration are read from the file headers (audio_probe) and
+    overlong or non-audio files are refused before any decoding. Headers
+    that do not match the extension are checked with ffprobe instead;
+  * at most MAX_ACTIVE_JOBS identifications run per worker and up to
+    MAX_QUEUED_JOBS wait in a FIFO queue. Beyond that the client gets a 429
+    with Retry-After and its would-be queue position instead of a job that
+    could get the worker OOM-killed.
+
+Inside a job, heavy stages are further limited by cpu_scheduler's slots.
+"""
+import os
+import json
+import math
+import time
+import asyncio
+import threading
+from typing import BinaryIO, Dict
+
+from audio_probe import probe_audio, probe_decoded
+
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "50"))
+MAX_UPLOAD_BYTES = int(MAX_UPLOAD_MB * 1024 * 1024)
+MAX_AUDIO_DURATION_SEC = float(os.getenv("MAX_AUDIO_DURATION_SEC", "900"))
+MAX_ACTIVE_JOBS = int(os.getenv("MAX_ACTIVE_JOBS", "1"))
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "4"))
+# Job duration assumed for Retry-After until real jobs have been timed
+INITIAL_JOB_SEC = float(os.getenv("INITIAL_JOB_SEC", "60"))
+
+EXTENSION_FORMATS = {".mp3": "mp3", ".wav": "wav", ".flac": "flac", ".m4a": "mp4"}
+COPY_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """The upload is over MAX_UPLOAD_MB."""
+
+
+class AudioRejected(ValueError):
+    """The upload is not a supported audio file, or it is too long to process."""
+
+
+class QueueFull(RuntimeError):
+    def __init__(self, position: int, retry_after: int):
+        super().__init__(f"Server busy: queue is full (position {position}), retry in {retry_after}s")
+        self.position = position
+        self.retry_after = retry_after
+
+
+def save_upload(src: BinaryIO, path: str, max_bytes: int = MAX_UPLOAD_BYTES) -> int:
+    """Copy an upload to `path`, stopping as soon as it goes over `max_bytes`."""
+    written = 0
+    with open(path, "wb") as dst:
+        while True:
+            chunk = src.read(COPY_CHUNK)
+            if not chunk:
+                return written
+            written += len(chunk)
+            if written > max_bytes:
+                raise UploadTooLarge(f"File is larger than {MAX_UPLOAD_MB:g}MB")
+            dst.write(chunk)
+
+
+def check_audio(path: str, filename: str) -> Dict:
+    """
+    Probe the saved upload and refuse it unless it is audio short enough to
+    process. When its headers do not match the extension (AAC saved as .mp3,
+    a tag the header probes do not know), ffprobe decides; without ffprobe
+    only the upload size limit applies.
+    """
+    info = probe_audio(path)
+    expected = EXTENSION_FORMATS.get(os.path.splitext(filename.lower())[1])
+    if info is None or info["format"] != expected:
+        try:
+            info = probe_decoded(path)
+        except OSError:
+            info = info or {"format": "unknown", "duration_sec": None, "sample_rate": None,
+                            "channels": None, "size_bytes": os.path.getsize(path)}
+        if info is None:
+            raise AudioRejected(f"File is not a valid {os.path.splitext(filename)[1].lstrip('.').upper()} audio file")
+    duration = info["duration_sec"]
+    if duration is not None and duration > MAX_AUDIO_DURATION_SEC:
+        raise AudioRejected(f"Audio is {duration / 60:.1f} minutes long; the limit is {MAX_AUDIO_DURATION_SEC / 60:g} minutes")
+    return info
+
+
+class Ticket:
+    """One admitted job: wait for a run slot, then release when done."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.admitted = time.monotonic()
+        self.started = None
+
+    async def wait_turn(self) -> float:
+        """Wait in the queue for a run slot. Returns the seconds spent queued."""
+        await self.controller._semaphore().acquire()
+        self.started = time.monotonic()
+        return self.started - self.admitted
+
+    def release(self) -> None:
+        self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_active: int = MAX_ACTIVE_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_active = max(1, max_active)
+        self.max_queued = max(0, max_queued)
+        self.admitted = 0  # running + queued
+        self.avg_job_sec = INITIAL_JOB_SEC
+        self.completed = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "too_large": 0, "bad_audio": 0}
+        self.total_wait_sec = 0.0
+        self._sem = None
+        self._lock = threading.Lock()
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the serving event loop
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_active)
+        return self._sem
+
+    def estimated_wait(self, position: int) -> int:
+        """Seconds until the job at queue `position` (1 = next) starts running."""
+        return math.ceil(self.avg_job_sec * math.ceil(position / self.max_active))
+
+    def _check_capacity(self) -> None:
+        if self.admitted >= self.max_active + self.max_queued:
+            self.rejected["queue_full"] += 1
+            position = self.admitted - self.max_active + 1
+            raise QueueFull(position, self.estimated_wait(position))
+
+    def check_capacity(self) -> None:
+        """Raise QueueFull if a job arriving now would not be admitted."""
+        with self._lock:
+            self._check_capacity()
+
+    def admit(self) -> Ticket:
+        """Admit a job into the queue, or raise QueueFull."""
+        with self._lock:
+            self._check_capacity()
+            self.admitted += 1
+            return Ticket(self)
+
+    def reject(self, reason: str) -> None:
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def _release(self, ticket: Ticket) -> None:
+        with self._lock:
+            self.admitted -= 1
+            if ticket.started is None:
+                return
+            self.completed += 1
+            self.total_wait_sec += ticket.started - ticket.admitted
+            # Moving average so Retry-After follows the current job mix
+            self.avg_job_sec = 0.8 * self.avg_job_sec + 0.2 * (time.monotonic() - ticket.started)
+        self._semaphore().release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            running = min(self.admitted, self.max_active)
+            queued = self.admitted - running
+            return {
+                "running": running,
+                "queued": queued,
+                "max_active": self.max_active,
+                "max_queued": self.max_queued,
+                "avg_job_sec": round(self.avg_job_sec, 1),
+                "avg_queue_wait_sec": round(self.total_wait_sec / self.completed, 2) if self.completed else None,
+                "estimated_wait_sec": self.estimated_wait(queued + 1) if queued + running >= self.max_active else 0,
+                "completed": self.completed,
+                "rejected": dict(self.rejected),
+                "max_upload_mb": MAX_UPLOAD_MB,
+                "max_duration_sec": MAX_AUDIO_DURATION_SEC,
+            }
+
+
+def queue_full_detail(e: QueueFull) -> Dict:
+    return {"message": str(e), "queue_position": e.position, "retry_after_sec": e.retry_after}
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware in front of the upload endpoint. It answers 429 before
+    the body is read when the admission queue is already full, and 413 as
+    soon as the body goes over `max_bytes`, judged from Content-Length when
+    present and otherwise by counting the body as it streams in.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, paths=("/identify-lyrics",),
+                 controller: AdmissionController = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = set(paths)
+        self.controller = controller
+
+    async def _respond(self, send, status: int, detail, headers=()) -> None:
+        body = json.dumps({"detail": detail}).encode()
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())] + list(headers)
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _reject(self, send) -> None:
+        if self.controller:
+            self.controller.reject("too_large")
+        await self._respond(send, 413, f"File is larger than {self.max_bytes / 1024 / 1024:g}MB")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        if self.controller:
+            try:
+                self.controller.check_capacity()
+            except QueueFull as e:
+                await self._respond(send, 429, queue_full_detail(e), [(b"retry-after", str(e.retry_after).encode())])
+                return
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge(f"Request body is larger than {self.max_bytes} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # The body parser turns our exception into its own error response; ours replaces it
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded and not response_started:
+            await self._reject(send)
+
+
+admission = AdmissionController()
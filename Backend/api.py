@@ -1,28 +1,39 @@
 # uvicorn api:app --reload --host 0.0.0.0 --port 8000 --reload
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Optional
 import logging
 import os
 import tempfile
 import shutil
 import asyncio
-from pathlib import Path
+import threading
+import time
 from dotenv import load_dotenv
 
+# Divide the cores between TensorFlow, torch and BLAS before any of them is imported
+from cpu_scheduler import configure_process, cpu_stats
+configure_process()
+
 # Import your existing modules
-from vocal_isolation import isolate_vocals
-from speech_to_text import extract_text
-from search_songs import search_genius_by_lyrics_scrape, extract_key_phrases, search_multiple_strategies
-from rag_retrieval import rag_search_with_similarity
-from llm_cleaner import clean_lyrics_with_llama3
+from vocal_isolation import get_separator
+from stt_backends import extract_text, backend_stats, STT_BACKEND, STT_HEDGE, STT_HEDGE_PRIMARY, STT_HEDGE_SECONDARY
+from speech_to_text_whisper import transcribe_chunks, iter_chunks, load_whisper_model, transcribe_chunk, loaded_models, FAST_MODEL, ACCURATE_MODEL
+from rag_retrieval import rag_search_with_similarity, prefetch_lyrics, encode, find_links, link_query, find_spotify_link, loaded_embedding_model
+from llm_cleaner import llm_stats
 from lyrics_search import search_by_lyrics
+from pipeline import Stage, PipelineError
+from lyrics_pipeline import (identification_pipeline, transcript_from_chunks, top_similarity, confidence_level,
+                             SPECULATIVE_SEARCH, SPECULATIVE_CONFIDENCE, STT_CASCADE, TRANSCRIPT_PRUNING)
+from admission import (admission, save_upload, check_audio, queue_full_detail, UploadLimitMiddleware,
+                       UploadTooLarge, AudioRejected, QueueFull, MAX_UPLOAD_MB, MAX_AUDIO_DURATION_SEC)
+from metrics import stage_timer, register_gauge, process_memory, render as render_metrics, REQUESTS
+from tracing import start_trace, finish_trace, span, set_attributes, get_trace, recent_traces, debug_allowed
+from request_budget import start_budget, end_budget, budget_exhausted, BudgetExhausted
 import string
-import requests
-import re
 import gc
 
 # Set up logging
@@ -36,17 +47,34 @@ load_dotenv()  # Load .env file
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "")
 origins = [origin.strip() for origin in allowed_origins.split(",") if origin.strip()]
 
+# Answer 413/429 while the upload is still streaming in, before it is spooled to disk.
+# Added before CORS so CORS wraps it and those answers carry the CORS headers too
+# (the last middleware added is the outermost)
+app.add_middleware(UploadLimitMiddleware, controller=admission)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Retry-After"],
 )
 
 # Optional: Reduce TensorFlow logging noise
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+# Streaming STT: search while chunks are still being transcribed and stop
+# transcribing as soon as a candidate reaches STREAM_STOP_SIMILARITY
+STT_STREAMING = os.getenv("STT_STREAMING", "false").lower() in ("1", "true", "yes")
+STREAM_STOP_SIMILARITY = float(os.getenv("STREAM_STOP_SIMILARITY", "75"))
+STREAM_MIN_WORDS = int(os.getenv("STREAM_MIN_WORDS", "8"))
+
+# Load and warm the models on a background thread at startup instead of on the
+# first request. Heavy libraries are imported lazily, so the app starts serving
+# /health immediately and /ready reports when warm-up has finished.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+WARMUP_SPLEETER = os.getenv("WARMUP_SPLEETER", "true").lower() in ("1", "true", "yes")
+
 # Define response models
 class ProcessingStatus(BaseModel):
     stage: str
@@ -69,215 +97,361 @@ class LyricsIdentificationResponse(BaseModel):
     matches: List[SongMatch]
     processing_stages: List[ProcessingStatus]
     confidence_level: str
+    # Set when the request deadline or outbound-call budget ran out and the
+    # matches are the best found so far rather than the result of every strategy
+    partial: bool = False
+    partial_reason: Optional[str] = None
+    # Spans (and the profile, if requested) are at GET /debug/traces/{trace_id}
+    trace_id: Optional[str] = None
+
+class SongLinks(BaseModel):
+    youtube_url: Optional[str] = None
+    spotify_url: Optional[str] = None
 
 class ErrorResponse(BaseModel):
     error: str
     details: Optional[str] = None
 
-# Utility functions from main.py
-def remove_llm_headers(text: str) -> str:
-    """Remove LLM-added phrases like 'Here are the cleaned-up lyrics:'"""
-    lines = text.strip().splitlines()
-    return '\n'.join(
-        line for line in lines
-        if not re.match(r'^\s*(here\s+(are|is)|these|the following)\b.*?:?', line.strip(), re.IGNORECASE)
-    ).strip()
-
-def comprehensive_search_strategy(raw_lyrics, cleaned_lyrics):
-    """Enhanced search strategy that tries multiple approaches systematically"""
-    all_candidates = []
-    search_attempts = []
-    
-    # Parse lines for different strategies
-    raw_lines = [line.strip() for line in raw_lyrics.split('\n') if line.strip() and len(line.strip()) > 10]
-    cleaned_lines = [line.strip() for line in cleaned_lyrics.split('\n') if line.strip() and len(line.strip()) > 10]
-    
-    # Strategy 1: Key phrases from cleaned lyrics
-    key_phrases = extract_key_phrases(cleaned_lyrics, 5)
-    
-    for phrase in key_phrases:
-        if len(phrase.strip()) < 15:
-            continue
-            
-        search_attempts.append(f"Key phrase: {phrase}")
-        results = search_by_lyrics(phrase, max_results=8)
-        if results:
-            all_candidates.extend(results)
-    
-    # Strategy 2: Multi-strategy search
-    multi_results = search_multiple_strategies(cleaned_lyrics, max_results_per_strategy=3)
-    if multi_results:
-        for result in multi_results:
-            formatted_result = {
-                'title': result.get('title', 'Unknown'),
-                'artist': 'Unknown',
-                'genius_url': result.get('url', ''),
-                'search_method': 'multi_strategy'
-            }
-            all_candidates.append(formatted_result)
-    
-    # Strategy 3: Best individual lines from cleaned lyrics
-    scored_lines = []
-    for line in cleaned_lines:
-        score = len(line)
-        distinctive_words = ['sick', 'stomach', 'calling', 'cab', 'touching', 'chest', 'destiny']
-        for word in distinctive_words:
-            if word.lower() in line.lower():
-                score += 15
-        
-        if '?' in line:
-            score += 10
-        if any(word in line.lower() for word in ['how', 'why', 'what', 'feel', 'heart']):
-            score += 8
-            
-        scored_lines.append((score, line))
-    
-    scored_lines.sort(reverse=True, key=lambda x: x[0])
-    
-    for score, line in scored_lines[:3]:
-        search_attempts.append(f"Cleaned line: {line}")
-        results = search_by_lyrics(line, max_results=5)
-        if results:
-            all_candidates.extend(results)
-    
-    # Strategy 4: Raw transcription lines
-    if len(all_candidates) < 5:
-        for line in raw_lines[:3]:
-            line_clean = line.translate(str.maketrans('', '', string.punctuation))
-            search_attempts.append(f"Raw line: {line}")
-            results = search_by_lyrics(line_clean, max_results=5)
-            if results:
-                all_candidates.extend(results)
-    
-    # Remove duplicates
+def pruning_status(report):
+    """ProcessingStatus for a pruning report, None if nothing was dropped"""
+    if not report or report["segments_before"] == report["segments_after"]:
+        return None
+    return ProcessingStatus(
+        stage="transcript_pruning",
+        message=(f"Dropped {report['segments_before'] - report['segments_after']} unreliable segments "
+                 f"(~{report['tokens_saved']} tokens saved)"),
+        progress=45
+    )
+
+def streaming_transcribe_and_search(vocal_path, model_name):
+    """
+    Transcribe chunk by chunk, searching on each new chunk and re-ranking the
+    accumulated candidates against the text so far. Transcription stops as soon
+    as the top candidate reaches STREAM_STOP_SIMILARITY.
+
+    Returns (chunks, ranked_results, early_stopped)
+    """
+    chunks = []
+    candidates = []
     seen_urls = set()
-    unique_candidates = []
-    for candidate in all_candidates:
-        url = candidate.get('genius_url') or candidate.get('url', '')
-        if url and url not in seen_urls:
-            seen_urls.add(url)
-            unique_candidates.append(candidate)
-    
-    return unique_candidates
-
-def determine_confidence_level(similarity_score):
-    """Determine confidence level based on similarity score"""
-    if similarity_score > 80:
-        return "High confidence match!"
-    elif similarity_score > 60:
-        return "Good match found"
-    elif similarity_score > 40:
-        return "Possible match - verify manually"
+    ranked = []
+    pending_text = []
+
+    for chunk in iter_chunks(vocal_path, model_name):
+        chunks.append(chunk)
+        if budget_exhausted():
+            logger.info(f"Request budget exhausted after {len(chunks)} chunks, stopping transcription")
+            break
+        text = chunk.get("text", "").strip()
+        if not text:
+            continue
+        pending_text.append(text)
+        # Wait for enough words to make a distinctive query
+        if len(" ".join(pending_text).split()) < STREAM_MIN_WORDS:
+            continue
+
+        query = " ".join(pending_text).translate(str.maketrans('', '', string.punctuation))
+        pending_text = []
+
+        new_candidates = []
+        for candidate in search_by_lyrics(query[:120], max_results=5):
+            url = candidate.get('genius_url') or candidate.get('url', '')
+            if url and url not in seen_urls:
+                seen_urls.add(url)
+                new_candidates.append(candidate)
+        if not new_candidates:
+            continue
+        prefetch_lyrics(new_candidates)
+        candidates.extend(new_candidates)
+
+        try:
+            ranked = rag_search_with_similarity(
+                query=transcript_from_chunks(chunks)[0],
+                search_results=candidates,
+                use_full_lyrics_comparison=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to rank streaming results: {e}")
+            continue
+
+        if top_similarity(ranked) >= STREAM_STOP_SIMILARITY:
+            logger.info(f"Confident match after {len(chunks)} chunks, stopping transcription")
+            return chunks, ranked, True
+
+    return chunks, ranked, False
+
+def transcribe_audio(vocal_path):
+    """
+    Transcription stage for the configured STT mode.
+    Returns (raw_transcription, chunks, pruning report, streamed results, early_stopped)
+    """
+    chunks = pruning = None
+    stream_results, early_stopped = [], False
+    if STT_STREAMING:
+        # Includes the searches run between chunks
+        chunks, stream_results, early_stopped = streaming_transcribe_and_search(
+            vocal_path, FAST_MODEL if STT_CASCADE else ACCURATE_MODEL
+        )
+        raw_transcription, pruning = transcript_from_chunks(chunks)
+    elif STT_CASCADE or TRANSCRIPT_PRUNING:
+        chunks = transcribe_chunks(vocal_path, FAST_MODEL if STT_CASCADE else ACCURATE_MODEL)
+        raw_transcription, pruning = transcript_from_chunks(chunks)
     else:
-        return "Low confidence - consider manual verification"
+        raw_transcription = extract_text(vocal_path).strip()
+    if not raw_transcription:
+        raise ValueError("No lyrics were transcribed.")
+    return raw_transcription, chunks, pruning, stream_results, early_stopped
+
+# A confident match found mid-transcription skips cleaning and the full search
+identify_pipeline = identification_pipeline(Stage(
+    "transcribe", transcribe_audio, inputs=("vocal_path",),
+    outputs={"raw_transcription": str, "chunks": (list, type(None)), "pruning": (dict, type(None)),
+             "stream_results": list, "early_stopped": bool},
+    timer="stt_streaming" if STT_STREAMING else "stt",
+    shortcut_if=lambda outputs: outputs["early_stopped"],
+    shortcut={"results": "stream_results", "cleaned_lyrics": "raw_transcription"},
+))
+
+# Progress reported when each pipeline stage starts
+STAGE_STATUS = {
+    "isolate": ("vocal_isolation", "Isolating vocals from audio...", 20),
+    "transcribe": ("speech_to_text", "Extracting lyrics using speech-to-text...", 40),
+    "clean": ("lyrics_cleaning", "Cleaning lyrics with AI...", 50),
+    "search": ("searching", "Searching for song matches...", 70),
+    "rank": ("ranking", "Ranking matches using similarity analysis...", 85),
+}
+if SPECULATIVE_SEARCH:
+    STAGE_STATUS["raw_search"] = ("speculative_search", "Searching raw transcription while lyrics are cleaned...", 60)
+
+def report_stages(processing_stages):
+    """Pipeline event callback that records progress as ProcessingStatus entries"""
+    def on_event(event):
+        stage, status = event["stage"], event["status"]
+        if status == "started" and stage in STAGE_STATUS:
+            name, message, progress = STAGE_STATUS[stage]
+            processing_stages.append(ProcessingStatus(stage=name, message=message, progress=progress))
+        elif status == "finished" and stage == "transcribe":
+            pruned = pruning_status(event["outputs"]["pruning"])
+            if pruned:
+                processing_stages.append(pruned)
+        elif status == "finished" and stage == "refine" and event["outputs"]["refined"]:
+            processing_stages.append(ProcessingStatus(
+                stage="speech_to_text_refine",
+                message=f"Re-transcribed {event['outputs']['refined']} low-confidence chunks with the accurate model",
+                progress=75
+            ))
+            pruned = pruning_status(event["outputs"]["refine_pruning"])
+            if pruned:
+                processing_stages.append(pruned)
+        elif status == "shortcut" and stage == "transcribe":
+            processing_stages.append(ProcessingStatus(
+                stage="streaming_match",
+                message=f"Confident match found after {len(event['outputs']['chunks'])} chunks",
+                progress=85
+            ))
+        elif (status == "shortcut" and stage == "speculative_rank"
+              and top_similarity(event["outputs"]["speculative_results"]) >= SPECULATIVE_CONFIDENCE):
+            # Cleaning finishes in the background and warms its cache
+            processing_stages.append(ProcessingStatus(
+                stage="speculative_match",
+                message="Confident match found on the raw transcription",
+                progress=85
+            ))
+        elif status in ("failed", "timed_out"):
+            logger.error(f"Pipeline stage {stage} {status.replace('_', ' ')}, used its fallback: {event.get('error')}")
+    return on_event
+
+def pipeline_http_error(e: PipelineError) -> HTTPException:
+    """HTTP error for a pipeline stage that failed without a fallback"""
+    if e.stage == "isolate":
+        logger.error(f"Failed to isolate vocals: {e.error}")
+        return HTTPException(status_code=500, detail=f"Failed to isolate vocals: {str(e.error)}")
+    if e.stage == "transcribe" and isinstance(e.error, BudgetExhausted):
+        logger.error(f"Speech-to-text did not finish within the request budget: {e.error}")
+        return HTTPException(status_code=504, detail=f"Speech-to-text did not finish within the request budget: {str(e.error)}")
+    if e.stage == "transcribe":
+        logger.error(f"Speech-to-text failed: {e.error}")
+        return HTTPException(status_code=500, detail=f"Speech-to-text failed: {str(e.error)}")
+    logger.error(f"Unexpected error: {e}")
+    return HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+def whisper_models_in_use():
+    """Whisper models this configuration will load while serving requests"""
+    models = []
+    if STT_STREAMING or STT_CASCADE or TRANSCRIPT_PRUNING:
+        models.append(FAST_MODEL if STT_CASCADE else ACCURATE_MODEL)
+    if STT_CASCADE or STT_BACKEND == "whisper" or (STT_HEDGE and "whisper" in (STT_HEDGE_PRIMARY, STT_HEDGE_SECONDARY)):
+        models.append(ACCURATE_MODEL)
+    return list(dict.fromkeys(models))
+
+warmup_state = {"ready": False, "error": None, "seconds": None}
+
+def model_bytes(model):
+    """Weight and buffer bytes of a torch model (int8 packed weights included)"""
+    total = 0
+    for value in model.state_dict().values():
+        tensors = value if isinstance(value, (tuple, list)) else (value,)
+        for tensor in tensors:
+            if hasattr(tensor, "element_size"):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+def model_memory():
+    models = {(f"whisper_{name}_{mode}",): model for (name, mode), model in loaded_models().items()}
+    if loaded_embedding_model() is not None:
+        models[("embedding",)] = loaded_embedding_model()
+    return {labels: model_bytes(model) for labels, model in models.items()}
+
+register_gauge("model_bytes", "Weight bytes of the models loaded in this worker", model_memory, ("model",))
+register_gauge("process_memory_bytes", "Resident and shared memory of this worker", process_memory, ("kind",))
+register_gauge("queue_jobs", "Identification jobs in this worker by state",
+               lambda: {(state,): admission.stats()[state] for state in ("running", "queued")}, ("state",))
+register_gauge("admission_rejections", "Uploads refused by admission control (cumulative)",
+               lambda: {(reason,): count for reason, count in admission.stats()["rejected"].items()}, ("reason",))
+register_gauge("heavy_stages_running", "CPU-heavy stages holding a scheduler slot in this worker",
+               lambda: {(stage,): stats["running"] for stage, stats in cpu_stats()["stages"].items()}, ("stage",))
+register_gauge("ready", "1 once the models have been warmed up", lambda: int(warmup_state["ready"]))
+
+def warm_up_models(include_spleeter: bool = WARMUP_SPLEETER):
+    """Load the Whisper and MiniLM weights and run one dummy inference on each"""
+    import numpy as np
+    start = time.perf_counter()
+    try:
+        encode("warm up")
+        for name in whisper_models_in_use():
+            transcribe_chunk(load_whisper_model(name), np.zeros(16000, dtype=np.float32))
+        if include_spleeter:
+            get_separator()
+    except Exception as e:
+        logger.error(f"Model warm-up failed: {e}")
+        warmup_state["error"] = str(e)
+    warmup_state["seconds"] = round(time.perf_counter() - start, 2)
+    warmup_state["ready"] = True
+    logger.info(f"Models warmed up in {warmup_state['seconds']}s")
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Pre-forked workers inherit models the master already warmed
+    if WARMUP_ON_STARTUP and not warmup_state["ready"]:
+        threading.Thread(target=warm_up_models, name="warm-up", daemon=True).start()
 
 @app.post("/identify-lyrics", response_model=LyricsIdentificationResponse)
-async def identify_lyrics(file: UploadFile = File(...)):
+async def identify_lyrics(request: Request, response: Response, file: UploadFile = File(...)):
     """
-    Main endpoint to identify lyrics from audio file
+    Main endpoint to identify lyrics from audio file.
+    The upload is checked and queued here; the pipeline runs on a worker thread.
+    Send `X-Debug-Profile: 1` or `?profile=1` to profile this request.
     """
-    processing_stages = []
-    
     # Validate file type
     if not file.filename.lower().endswith(('.mp3', '.wav', '.m4a', '.flac')):
         raise HTTPException(status_code=400, detail="Unsupported audio format. Use MP3, WAV, M4A, or FLAC")
     
-    # Create temporary directory for processing
-    temp_dir = tempfile.mkdtemp()
+    profile = (request.headers.get("X-Debug-Profile") == "1" or request.query_params.get("profile") == "1")
+    trace, trace_token = start_trace("identify_lyrics", profile and debug_allowed(request.headers.get("X-Debug-Token")))
+    trace_id = trace.trace_id if trace else None
+    if trace_id:
+        response.headers["X-Trace-Id"] = trace_id
     
+    ticket = None
+    temp_dir = None
     try:
-        # Save uploaded file
-        processing_stages.append(ProcessingStatus(
-            stage="upload",
-            message="File uploaded successfully",
-            progress=10
-        ))
+        # Admitted inside the try so the slot is released whatever fails after this
+        try:
+            ticket = admission.admit()
+        except QueueFull as e:
+            logger.warning(str(e))
+            raise HTTPException(status_code=429, detail=queue_full_detail(e), headers={"Retry-After": str(e.retry_after)})
+        
+        # Create temporary directory for processing
+        temp_dir = tempfile.mkdtemp()
         
         audio_path = os.path.join(temp_dir, file.filename)
-        with open(audio_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        with span("upload", filename=file.filename):
+            try:
+                set_attributes(size_bytes=save_upload(file.file, audio_path))
+            except UploadTooLarge as e:
+                admission.reject("too_large")
+                raise HTTPException(status_code=413, detail=str(e))
         
-        # Step 1: Isolate vocals
-        processing_stages.append(ProcessingStatus(
-            stage="vocal_isolation",
-            message="Isolating vocals from audio...",
-            progress=20
-        ))
+        # Format and duration from the headers, before anything is decoded
+        with span("probe"):
+            try:
+                audio_info = check_audio(audio_path, file.filename)
+            except AudioRejected as e:
+                admission.reject("bad_audio")
+                raise HTTPException(status_code=400, detail=str(e))
+            set_attributes(**audio_info)
         
+        with span("queue_wait"):
+            queued_sec = await ticket.wait_turn()
+        if queued_sec > 1:
+            logger.info(f"Job started after {queued_sec:.1f}s in the queue")
         try:
-            vocal_path = isolate_vocals(audio_path)
-        except Exception as e:
-            logger.error(f"Failed to isolate vocals: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to isolate vocals: {str(e)}")
-        
-        # Step 2: Extract text
-        processing_stages.append(ProcessingStatus(
-            stage="speech_to_text",
-            message="Extracting lyrics using speech-to-text...",
-            progress=40
-        ))
-        
-        try:
-            raw_transcription = extract_text(vocal_path).strip()
-            if not raw_transcription:
-                raise ValueError("No lyrics were transcribed.")
-        except Exception as e:
-            logger.error(f"Speech-to-text failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Speech-to-text failed: {str(e)}")
-        
-        # Step 3: Clean lyrics
+            with stage_timer("pipeline"):
+                result = await asyncio.to_thread(process_audio, audio_path, audio_info)
+        except HTTPException as e:
+            REQUESTS.inc(f"http_{e.status_code}")
+            raise
+        REQUESTS.inc("partial" if result.partial else "matched" if result.success else "no_match")
+        result.trace_id = trace_id
+        return result
+    
+    except HTTPException as e:
+        if trace_id:
+            e.headers = {**(e.headers or {}), "X-Trace-Id": trace_id}
+        raise
+    
+    finally:
+        finish_trace(trace, trace_token)
+        if ticket is not None:
+            ticket.release()
+        # Cleanup temporary files
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+def process_audio(audio_path: str, audio_info: Dict) -> LyricsIdentificationResponse:
+    """Run the identification pipeline on an admitted upload"""
+    processing_stages = []
+    budget, budget_token = start_budget()
+    
+    try:
+        duration = audio_info.get("duration_sec")
         processing_stages.append(ProcessingStatus(
-            stage="lyrics_cleaning",
-            message="Cleaning lyrics with AI...",
-            progress=50
+            stage="upload",
+            message=f"File uploaded successfully ({duration:.0f}s of {audio_info['format']} audio)" if duration
+                    else "File uploaded successfully",
+            progress=10
         ))
         
+        # Isolate, transcribe, clean, search, rank and refine; see lyrics_pipeline for the stage graph
         try:
-            cleaned_lyrics = clean_lyrics_with_llama3(raw_transcription)
-            cleaned_lyrics = remove_llm_headers(cleaned_lyrics)
-            if not cleaned_lyrics.strip():
-                logger.warning("Lyrics cleaning returned empty output, using raw transcription")
-                cleaned_lyrics = raw_transcription
-        except Exception as e:
-            logger.error(f"Lyrics cleaning failed: {e}")
-            cleaned_lyrics = raw_transcription
+            values = identify_pipeline.run({"audio_path": audio_path}, report_stages(processing_stages))
+        except PipelineError as e:
+            raise pipeline_http_error(e)
+        raw_transcription = values["final_transcription"]
+        cleaned_lyrics = values["final_lyrics"]
+        final_results = values["final_results"]
         
-        # Step 4: Search for matches
-        processing_stages.append(ProcessingStatus(
-            stage="searching",
-            message="Searching for song matches...",
-            progress=70
-        ))
-        
-        candidates = comprehensive_search_strategy(raw_transcription, cleaned_lyrics)
+        partial = budget.exhausted
+        if partial:
+            logger.warning(f"Request budget exhausted, returning partial result: {budget.summary()}")
+            processing_stages.append(ProcessingStatus(
+                stage="budget_exhausted",
+                message=f"Request budget exhausted ({budget.exhausted_reason}), returning the best result so far",
+                progress=90
+            ))
         
-        if not candidates:
+        if not final_results:
             return LyricsIdentificationResponse(
                 success=False,
                 raw_transcription=raw_transcription,
                 cleaned_lyrics=cleaned_lyrics,
                 matches=[],
                 processing_stages=processing_stages,
-                confidence_level="No matches found"
-            )
-        
-        # Step 5: Rank results
-        processing_stages.append(ProcessingStatus(
-            stage="ranking",
-            message="Ranking matches using similarity analysis...",
-            progress=85
-        ))
-        
-        try:
-            full_transcription = f"{raw_transcription}\n\n{cleaned_lyrics}".strip()
-            final_results = rag_search_with_similarity(
-                query=full_transcription,
-                search_results=candidates,
-                use_full_lyrics_comparison=True
+                confidence_level="No matches found",
+                partial=partial,
+                partial_reason=budget.exhausted_reason or None
             )
-        except Exception as e:
-            logger.error(f"Failed to rank results: {e}")
-            final_results = candidates
         
         # Step 6: Format results
         processing_stages.append(ProcessingStatus(
@@ -287,24 +461,25 @@ async def identify_lyrics(file: UploadFile = File(...)):
         ))
         
         # Convert to response format
+        # YouTube links come from GET /links after the response; Spotify links need no lookup
         song_matches = []
         for song in final_results[:5]:  # Top 5 matches
+            query = link_query(song.get('title', ''), song.get('artist', ''))
             match = SongMatch(
                 title=song.get('title', 'Unknown'),
                 artist=song.get('artist', 'Unknown'),
                 similarity=float(song.get('similarity', 0.0)),
                 genius_url=song.get('genius_url') or song.get('url', ''),
                 youtube_url=song.get('youtube_url'),
-                spotify_url=song.get('spotify_url'),
+                spotify_url=song.get('spotify_url') or (find_spotify_link(query) if query else None),
                 search_method=song.get('search_method', 'API')
             )
             song_matches.append(match)
         
         # Determine confidence
-        confidence_level = "No matches found"
+        confidence = "No matches found"
         if song_matches:
-            top_similarity = song_matches[0].similarity
-            confidence_level = determine_confidence_level(top_similarity)
+            confidence = confidence_level(song_matches[0].similarity)
         
         # Cleanup
         gc.collect()
@@ -315,7 +490,9 @@ async def identify_lyrics(file: UploadFile = File(...)):
             cleaned_lyrics=cleaned_lyrics,
             matches=song_matches,
             processing_stages=processing_stages,
-            confidence_level=confidence_level
+            confidence_level=confidence,
+            partial=partial,
+            partial_reason=budget.exhausted_reason or None
         )
         
     except HTTPException:
@@ -325,11 +502,8 @@ async def identify_lyrics(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
     
     finally:
-        # Cleanup temporary files
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass
+        set_attributes(budget=budget.summary())
+        end_budget(budget_token)
 
 @app.get("/")
 async def root():
@@ -341,12 +515,69 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "timestamp": "2025-07-07"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the models have been loaded and warmed"""
+    if not warmup_state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "warmup_seconds": warmup_state["seconds"], "warmup_error": warmup_state["error"]}
+
+@app.get("/stt-backends")
+async def get_stt_backend_stats():
+    """Per-backend speech-to-text latency and error statistics"""
+    return backend_stats()
+
+@app.get("/llm-stats")
+async def get_llm_stats():
+    """LLM cleaning latency, token counts and cache hit ratio"""
+    return llm_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Stage latencies, upstream calls, cache hits, queue depth and memory in Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/traces")
+async def list_traces(x_debug_token: Optional[str] = Header(None)):
+    """Most recent request traces in this worker"""
+    if not debug_allowed(x_debug_token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+    return recent_traces()
+
+@app.get("/debug/traces/{trace_id}")
+async def get_trace_detail(trace_id: str, x_debug_token: Optional[str] = Header(None)):
+    """Spans of one request, with its CPU and memory profile if it was profiled"""
+    if not debug_allowed(x_debug_token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+    trace = get_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (it may belong to another worker or have been evicted)")
+    return trace
+
+@app.get("/queue")
+async def get_queue_stats():
+    """Jobs running and queued in this worker, estimated wait and rejection counts"""
+    return admission.stats()
+
+@app.get("/cpu-stats")
+async def get_cpu_stats():
+    """CPU thread plan and heavy-stage slot usage of this worker"""
+    return cpu_stats()
+
+@app.get("/links", response_model=SongLinks)
+async def get_song_links(title: str, artist: str = ""):
+    """YouTube and Spotify links for one match, fetched after /identify-lyrics has returned"""
+    if not link_query(title, artist):
+        raise HTTPException(status_code=400, detail="A known title or artist is required")
+    return SongLinks(**await asyncio.to_thread(find_links, title, artist))
+
 @app.get("/supported-formats")
 async def get_supported_formats():
     """Get supported audio formats"""
     return {
         "supported_formats": [".mp3", ".wav", ".m4a", ".flac"],
-        "max_file_size": "50MB",
+        "max_file_size": f"{MAX_UPLOAD_MB:g}MB",
+        "max_duration": f"{MAX_AUDIO_DURATION_SEC / 60:g} minutes",
         "processing_time": "2-5 minutes depending on file size"
     }
 
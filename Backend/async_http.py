@@ -0,0 +1,85 @@
+"""
+Shared asyncio loop and pooled HTTP clients for the remote STT backends.
+
+The pipeline calls the backends from synchronous code (and from worker
+threads), while pooled httpx.AsyncClient connections must stay on the loop
+that created them. A single background loop owns every client; `run_sync`
+submits coroutines to it from any thread.
+"""
+import time
+import asyncio
+import threading
+import concurrent.futures
+from typing import Dict
+
+import httpx
+
+from request_budget import cancel_event, CallCancelled
+
+# How often a waiting caller checks whether its call was cancelled
+CANCEL_POLL_SEC = 0.05
+
+_loop = None
+_loop_lock = threading.Lock()
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="stt-http-loop", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro, timeout=None):
+    """
+    Run a coroutine on the shared loop and wait for its result. Inside
+    request_budget.cancellable the coroutine is cancelled (closing its
+    connections) and CallCancelled raised once the caller's event is set.
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    cancelled = cancel_event()
+    if cancelled is None:
+        return future.result(timeout)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        wait_sec = CANCEL_POLL_SEC if deadline is None else max(0.0, min(CANCEL_POLL_SEC, deadline - time.monotonic()))
+        try:
+            return future.result(wait_sec)
+        except concurrent.futures.TimeoutError:
+            if cancelled.is_set():
+                future.cancel()
+                raise CallCancelled("call cancelled, its result is no longer needed")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise
+
+
+def get_client(name: str, base_url: str = "", max_connections: int = 8) -> httpx.AsyncClient:
+    """
+    Return the persistent client for an upstream, creating it on first use.
+
+    Must be called from a coroutine running on the shared loop.
+    """
+    if name not in _clients:
+        _clients[name] = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(60.0, connect=10.0),
+        )
+    return _clients[name]
+
+
+async def iter_bytes(data: bytes, chunk_size: int = 64 * 1024):
+    """Stream an in-memory buffer as an upload body."""
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def split_pcm(pcm: bytes, sample_rate: int, chunk_sec: float):
+    """Split PCM 16-bit mono bytes into chunk_sec pieces (whole buffer if chunk_sec <= 0)."""
+    if chunk_sec <= 0:
+        return [pcm]
+    step = int(chunk_sec * sample_rate) * 2
+    return [pcm[i:i + step] for i in range(0, len(pcm), step)]
@@ -0,0 +1,223 @@
+"""
+Read the format, duration and sample rate of an upload from its headers.
+
+Only the container/frame headers are parsed (a few KB at most, plus a seek
+to the MP4 `moov` atom), so oversized or mislabelled files are rejected
+before Spleeter or librosa decode anything. Returns None for files that are
+not one of the supported formats.
+
+Files the header probes cannot place can be handed to ffprobe
+(probe_decoded), which reads the stream headers of anything ffmpeg decodes.
+"""
+import os
+import json
+import struct
+import subprocess
+from typing import Dict, Optional
+
+PROBE_BYTES = 64 * 1024
+# ffprobe only reads stream headers, so a slow answer means a pathological file
+FFPROBE_TIMEOUT_SEC = float(os.getenv("FFPROBE_TIMEOUT_SEC", "10"))
+
+MP3_BITRATES_V1 = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320]
+MP3_BITRATES_V2 = [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160]
+MP3_SAMPLE_RATES = [44100, 48000, 32000]
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+
+def _info(fmt: str, duration: Optional[float] = None, sample_rate: Optional[int] = None,
+          channels: Optional[int] = None) -> Dict:
+    return {"format": fmt, "duration_sec": duration, "sample_rate": sample_rate, "channels": channels}
+
+
+def _skip_id3(f) -> int:
+    """Seek past an ID3v2 tag at the start of the file. Returns the offset of the audio data."""
+    header = f.read(10)
+    if header[:3] != b"ID3" or len(header) < 10:
+        f.seek(0)
+        return 0
+    # Syncsafe tag size, plus the 10-byte header (and footer if flagged)
+    tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+    offset = 10 + tag_size + (10 if header[5] & 0x10 else 0)
+    f.seek(offset)
+    return offset
+
+
+def probe_wav(f, size: int) -> Optional[Dict]:
+    header = f.read(12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        return None
+    channels = sample_rate = byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, chunk_size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            _, channels, sample_rate, byte_rate = struct.unpack("<HHII", fmt[:12])
+            continue
+        if chunk_id == b"data":
+            # Streamed WAVs leave the size at 0 or 0xFFFFFFFF
+            if chunk_size in (0, 0xFFFFFFFF):
+                chunk_size = size - f.tell()
+            duration = chunk_size / byte_rate if byte_rate else None
+            return _info("wav", duration, sample_rate, channels)
+        f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    return _info("wav", None, sample_rate, channels)
+
+
+def probe_flac(f) -> Optional[Dict]:
+    # Some taggers put an ID3v2 tag in front of the FLAC stream
+    _skip_id3(f)
+    if f.read(4) != b"fLaC":
+        return None
+    block = f.read(4)
+    if len(block) < 4 or block[0] & 0x7F != 0:
+        return _info("flac")
+    info = f.read(34)
+    if len(info) < 18:
+        return _info("flac")
+    sample_rate = int.from_bytes(info[10:13], "big") >> 4
+    channels = ((info[12] >> 1) & 0x07) + 1
+    total_samples = ((info[13] & 0x0F) << 32) | int.from_bytes(info[14:18], "big")
+    duration = total_samples / sample_rate if sample_rate and total_samples else None
+    return _info("flac", duration, sample_rate, channels)
+
+
+def probe_mp3(f, size: int) -> Optional[Dict]:
+    offset = _skip_id3(f)
+    if offset >= size:
+        return None
+    data = f.read(PROBE_BYTES)
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+            continue
+        version = (data[i + 1] >> 3) & 0x03  # 3 = MPEG1, 2 = MPEG2, 0 = MPEG2.5
+        layer = (data[i + 1] >> 1) & 0x03  # 1 = Layer III
+        bitrate_index = data[i + 2] >> 4
+        rate_index = (data[i + 2] >> 2) & 0x03
+        if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        mpeg1 = version == 3
+        sample_rate = MP3_SAMPLE_RATES[rate_index] // (1 if mpeg1 else 2 if version == 2 else 4)
+        bitrate = (MP3_BITRATES_V1 if mpeg1 else MP3_BITRATES_V2)[bitrate_index] * 1000
+        channels = 1 if data[i + 3] >> 6 == 3 else 2
+        samples_per_frame = 1152 if mpeg1 else 576
+        padding = (data[i + 2] >> 1) & 0x01
+        frame_length = (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+        # A real frame is followed by another frame header; random 0xFFE bits are not
+        following = i + frame_length
+        if following + 1 < len(data) and (data[following] != 0xFF or data[following + 1] & 0xE0 != 0xE0):
+            continue
+
+        # VBR files carry the frame count in a Xing/Info or VBRI header in the first frame
+        side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+        xing = i + 4 + side_info
+        if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12 and data[xing + 7] & 0x01:
+            frames = struct.unpack(">I", data[xing + 8:xing + 12])[0]
+            return _info("mp3", frames * samples_per_frame / sample_rate, sample_rate, channels)
+        if data[i + 36:i + 40] == b"VBRI" and len(data) >= i + 54:
+            frames = struct.unpack(">I", data[i + 50:i + 54])[0]
+            return _info("mp3", frames * samples_per_frame / sample_rate, sample_rate, channels)
+        # Constant bitrate: size / bitrate
+        return _info("mp3", (size - offset - i) * 8 / bitrate, sample_rate, channels)
+    return None
+
+
+def probe_adts(f, size: int) -> Optional[Dict]:
+    """Raw AAC in ADTS frames, as some encoders write it (often with an .mp3 or .aac name)."""
+    _skip_id3(f)
+    data = f.read(7)
+    # 12-bit syncword, then layer 00 (MP3 frames have a non-zero layer here)
+    if len(data) < 7 or data[0] != 0xFF or data[1] & 0xF6 != 0xF0:
+        return None
+    rate_index = (data[2] >> 2) & 0x0F
+    if rate_index >= len(ADTS_SAMPLE_RATES):
+        return None
+    channels = ((data[2] & 0x01) << 2) | (data[3] >> 6)
+    return _info("aac", None, ADTS_SAMPLE_RATES[rate_index], channels or None)
+
+
+def _mp4_boxes(f, end: int):
+    """(type, payload start, payload end) of each box between the current position and `end`."""
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        box_size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if box_size == 1:
+            box_size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif box_size == 0:
+            box_size = end - start
+        if box_size < header:
+            return
+        yield box_type, start + header, start + box_size
+        f.seek(start + box_size)
+
+
+def probe_mp4(f, size: int) -> Optional[Dict]:
+    header = f.read(8)
+    if header[4:8] != b"ftyp":
+        return None
+    f.seek(0)
+    for box_type, start, end in _mp4_boxes(f, size):
+        if box_type != b"moov":
+            continue
+        f.seek(start)
+        for inner_type, inner_start, _ in _mp4_boxes(f, end):
+            if inner_type != b"mvhd":
+                continue
+            f.seek(inner_start)
+            version = f.read(4)[0]
+            if version == 1:
+                _, _, timescale, duration = struct.unpack(">QQIQ", f.read(28))
+            else:
+                _, _, timescale, duration = struct.unpack(">IIII", f.read(16))
+            return _info("mp4", duration / timescale if timescale else None)
+        break
+    return _info("mp4")
+
+
+def probe_audio(path: str) -> Optional[Dict]:
+    """Format and duration of an audio file from its headers, or None if it is not WAV/FLAC/MP3/MP4/AAC."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for probe in (lambda: probe_wav(f, size), lambda: probe_flac(f), lambda: probe_mp4(f, size),
+                      lambda: probe_adts(f, size), lambda: probe_mp3(f, size)):
+            f.seek(0)
+            try:
+                info = probe()
+            except (struct.error, IndexError):
+                info = None
+            if info:
+                info["size_bytes"] = size
+                return info
+    return None
+
+
+def probe_decoded(path: str) -> Optional[Dict]:
+    """
+    Format and duration as ffprobe reports them, or None if it finds no
+    audio stream. Raises OSError when ffprobe is not installed.
+    """
+    command = ["ffprobe", "-v", "error", "-of", "json", "-select_streams", "a:0",
+               "-show_format", "-show_streams", path]
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=FFPROBE_TIMEOUT_SEC, check=True)
+        probed = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError):
+        return None
+    streams = probed.get("streams") or []
+    if not streams:
+        return None
+    stream, container = streams[0], probed.get("format") or {}
+    duration = stream.get("duration") or container.get("duration")
+    info = _info(
+        stream.get("codec_name") or container.get("format_name") or "unknown",
+        float(duration) if duration else None,
+        int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+        stream.get("channels"),
+    )
+    info["size_bytes"] = os.path.getsize(path)
+    return info
@@ -0,0 +1,251 @@
+"""
+Performance benchmarks for the Backend pipeline.
+
+Usage:
+    python benchmark.py stt-pool path/to/vocals.wav [--model small.en] [--cores 16]
+    python benchmark.py quant path/to/clips/ [--model small.en]
+    python benchmark.py html [path/to/saved_pages/] [--repeat 20]
+    python benchmark.py import-time [--module api] [--max-sec 2] [--top 15]
+"""
+import argparse
+import os
+import sys
+import time
+import subprocess
+
+import numpy as np
+
+
+def bench_stt_pool(audio_path: str, model_name: str, cores: int):
+    """
+    Time process-pool transcription for every workers x threads split of the
+    given core count and report the fastest one.
+    """
+    from speech_to_text_whisper import (
+        transcribe_chunks, get_transcription_pool, shutdown_transcription_pools, _pool_transcribe,
+        load_whisper_model
+    )
+
+    splits = [(w, cores // w) for w in range(1, cores + 1) if cores % w == 0]
+    results = []
+    for workers, threads in splits:
+        # Warm the model(s) so loading is not part of the measurement
+        if workers == 1:
+            load_whisper_model(model_name)
+        else:
+            pool = get_transcription_pool(model_name, workers, threads)
+            warmup = np.zeros(16000, dtype=np.float32)
+            list(pool.map(_pool_transcribe, [warmup] * workers))
+        start = time.perf_counter()
+        chunks = transcribe_chunks(audio_path, model_name, workers, threads)
+        elapsed = time.perf_counter() - start
+        shutdown_transcription_pools()
+        results.append((elapsed, workers, threads, len(chunks)))
+        print(f"   workers={workers:<3} threads={threads:<3} {elapsed:7.2f}s ({len(chunks)} chunks)")
+
+    results.sort()
+    elapsed, workers, threads, _ = results[0]
+    print(f"\n🏁 Best split on {cores} cores: {workers} workers x {threads} threads ({elapsed:.2f}s)")
+    print(f"   WHISPER_WORKERS={workers}")
+    print(f"   WHISPER_THREADS_PER_WORKER={threads}")
+    return results
+
+
+# Fixed lyric pairs for the embedding quality check: (transcription-like, reference)
+EMBEDDING_PAIRS = [
+    ("coming out of my cage and ive been doing just fine", "Coming out of my cage and I've been doing just fine"),
+    ("jealousy turning saints into the sea", "Jealousy, turning saints into the sea"),
+    ("is this the real life is this just fantasy", "Is this the real life? Is this just fantasy?"),
+    ("hello from the other side i must have called a thousand times", "Hello from the other side, I must've called a thousand times"),
+    ("cause baby now we got bad blood", "'Cause, baby, now we got bad blood"),
+    ("just a small town girl living in a lonely world", "Just a small-town girl, livin' in a lonely world"),
+    ("is this the real life is this just fantasy", "Started out with a kiss, how did it end up like this?"),
+    ("hello from the other side", "Cause baby now we got bad blood"),
+]
+
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level edit distance divided by the reference length."""
+    ref, hyp = reference.lower().split(), hypothesis.lower().split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    row = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        prev, row[0] = row[0], i
+        for j, h in enumerate(hyp, 1):
+            prev, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, prev + (r != h))
+    return row[-1] / len(ref)
+
+
+def bench_quantization(clips_dir: str, model_name: str):
+    """
+    Compare fp32 and int8 inference for Whisper (on a fixed clip set) and
+    MiniLM (on fixed lyric pairs): speedup and quality drop against fp32.
+    """
+    from speech_to_text_whisper import load_whisper_model, load_audio, transcribe_chunk
+    from rag_retrieval import load_embedding_model
+
+    clips = sorted(
+        os.path.join(clips_dir, f) for f in os.listdir(clips_dir)
+        if f.lower().endswith(('.mp3', '.wav', '.flac'))
+    )
+    audio = [load_audio(path)[0] for path in clips]
+
+    print(f"🎙️ Whisper '{model_name}' on {len(clips)} clips")
+    transcripts, timings = {}, {}
+    for mode in ("fp32", "int8"):
+        model = load_whisper_model(model_name, mode)
+        start = time.perf_counter()
+        transcripts[mode] = [transcribe_chunk(model, samples)["text"] for samples in audio]
+        timings[mode] = time.perf_counter() - start
+        print(f"   {mode}: {timings[mode]:.2f}s")
+    wers = [word_error_rate(ref, hyp) for ref, hyp in zip(transcripts["fp32"], transcripts["int8"])]
+    print(f"   speedup: {timings['fp32'] / max(timings['int8'], 1e-9):.2f}x")
+    print(f"   WER of int8 against fp32: {np.mean(wers) * 100 if wers else 0.0:.1f}%")
+
+    print(f"\n🔎 Embeddings on {len(EMBEDDING_PAIRS)} lyric pairs")
+    sims, timings = {}, {}
+    for mode in ("fp32", "int8"):
+        model = load_embedding_model(mode)
+        model.encode(["warm up"])
+        start = time.perf_counter()
+        for _ in range(10):
+            left = model.encode([a for a, _ in EMBEDDING_PAIRS], normalize_embeddings=True)
+            right = model.encode([b for _, b in EMBEDDING_PAIRS], normalize_embeddings=True)
+        timings[mode] = (time.perf_counter() - start) / 10
+        sims[mode] = np.sum(left * right, axis=1)
+        print(f"   {mode}: {timings[mode] * 1000:.1f}ms per batch")
+    drift = np.abs(sims["fp32"] - sims["int8"])
+    print(f"   speedup: {timings['fp32'] / max(timings['int8'], 1e-9):.2f}x")
+    print(f"   cosine similarity drift: mean {drift.mean():.4f}, max {drift.max():.4f}")
+
+
+# Synthetic Genius and Google pages committed with the tests
+HTML_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "fixtures", "html")
+
+
+def bench_html_extraction(fixtures_dir: str, repeat: int):
+    """
+    Time the streaming extractors against the BeautifulSoup implementation on
+    saved pages and check they return the same output. Files named google*.html
+    are Google result pages, every other .html file is a Genius song page.
+    Returns the number of pages whose output differs.
+    """
+    from html_extract import (
+        extract_lyrics, lyrics_containers_text_bs4, clean_lyrics_text,
+        google_result_links, google_result_links_bs4
+    )
+
+    pages = sorted(f for f in os.listdir(fixtures_dir) if f.lower().endswith('.html'))
+    totals = {"fast": 0.0, "bs4": 0.0}
+    mismatches = 0
+    for name in pages:
+        with open(os.path.join(fixtures_dir, name), encoding="utf-8", errors="ignore") as f:
+            html = f.read()
+        if name.lower().startswith("google"):
+            implementations = {"fast": google_result_links, "bs4": google_result_links_bs4}
+        else:
+            implementations = {
+                "fast": extract_lyrics,
+                "bs4": lambda page: clean_lyrics_text(lyrics_containers_text_bs4(page)),
+            }
+        outputs, timings = {}, {}
+        for impl, fn in implementations.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                outputs[impl] = fn(html)
+            timings[impl] = (time.perf_counter() - start) / repeat
+            totals[impl] += timings[impl]
+        same = outputs["fast"] == outputs["bs4"]
+        mismatches += not same
+        print(f"   {name:<40} fast {timings['fast'] * 1000:7.2f}ms  bs4 {timings['bs4'] * 1000:7.2f}ms  "
+              f"{'✅ same output' if same else '❌ output differs'}")
+        if not same:
+            print(f"      fast: {str(outputs['fast'])[:200]}")
+            print(f"      bs4:  {str(outputs['bs4'])[:200]}")
+
+    if pages:
+        print(f"\n🏁 {len(pages)} pages: fast {totals['fast'] * 1000:.1f}ms, bs4 {totals['bs4'] * 1000:.1f}ms "
+              f"({totals['bs4'] / max(totals['fast'], 1e-9):.1f}x), {mismatches} mismatches")
+    return mismatches
+
+
+# Libraries that must only be imported when a model or client is first used
+HEAVY_MODULES = ("torch", "tensorflow", "whisper", "sentence_transformers", "spleeter", "lyricsgenius",
+                 "youtubesearchpython", "ollama", "librosa", "scipy")
+
+
+def bench_import_time(module: str, max_sec: float, top: int) -> bool:
+    """
+    Import `module` in a fresh interpreter, report the wall time and the slowest
+    imports (-X importtime), and check that no heavy library was pulled in.
+    Returns True if the import was too slow or loaded a heavy library.
+    """
+    probe = (f"import sys, time, json; start = time.perf_counter(); import {module}; "
+             f"print(json.dumps([time.perf_counter() - start, sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)]))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        print(f"❌ import {module} failed:\n" + "\n".join(errors[-20:]))
+        return True
+
+    import json
+    elapsed, heavy = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    # importtime lines: "import time: self [us] | cumulative | imported package"
+    timings = []
+    for line in proc.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            timings.append((int(parts[1]), parts[2].strip()))
+    print("🐢 Slowest imports (cumulative):")
+    for cumulative, name in sorted(timings, reverse=True)[:top]:
+        print(f"   {cumulative / 1e6:7.3f}s  {name}")
+
+    print(f"\n⏱️ import {module}: {elapsed:.2f}s (limit {max_sec:.2f}s)")
+    failed = elapsed > max_sec
+    if heavy:
+        print(f"❌ Heavy libraries imported eagerly: {', '.join(heavy)}")
+        failed = True
+    print("✅ Import time OK" if not failed else "❌ Import time check failed")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MuseFinder backend benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stt_pool = sub.add_parser("stt-pool", help="Find the best Whisper process-pool split")
+    stt_pool.add_argument("audio_path")
+    stt_pool.add_argument("--model", default="small.en")
+    stt_pool.add_argument("--cores", type=int, default=os.cpu_count() or 1)
+
+    quant = sub.add_parser("quant", help="Compare fp32 and int8 inference speed and quality")
+    quant.add_argument("clips_dir")
+    quant.add_argument("--model", default="small.en")
+
+    html = sub.add_parser("html", help="Compare streaming HTML extraction with BeautifulSoup (speed and parity)")
+    html.add_argument("fixtures_dir", nargs="?", default=HTML_FIXTURES_DIR)
+    html.add_argument("--repeat", type=int, default=20)
+
+    import_time = sub.add_parser("import-time", help="Check that importing the app is fast and loads no models")
+    import_time.add_argument("--module", default="api")
+    import_time.add_argument("--max-sec", type=float, default=2.0)
+    import_time.add_argument("--top", type=int, default=15)
+
+    args = parser.parse_args()
+    if args.command == "stt-pool":
+        bench_stt_pool(args.audio_path, args.model, args.cores)
+    elif args.command == "quant":
+        bench_quantization(args.clips_dir, args.model)
+    elif args.command == "html":
+        if bench_html_extraction(args.fixtures_dir, args.repeat):
+            raise SystemExit(1)
+    elif args.command == "import-time":
+        if bench_import_time(args.module, args.max_sec, args.top):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Incremental candidate scoring for early search termination.
+
+Search strategies feed their results in as they arrive and each candidate
+gets a cheap score (no lyrics fetch, no embeddings) from:
+  * agreement: every query that returns the URL adds that query's
+    distinctiveness, discounted by the position of the hit;
+  * title overlap: titles usually appear in the lyrics, so title words found
+    in the cleaned lyrics add to the score;
+  * Genius API highlights, which mean the API matched the query text itself.
+
+Once the leader has been returned by SEARCH_STOP_MIN_HITS queries and scores
+SEARCH_STOP_MARGIN times the runner-up, the remaining strategies are skipped.
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+from distinctiveness import tokenize, line_distinctiveness, STOPWORDS
+
+SEARCH_EARLY_STOP = os.getenv("SEARCH_EARLY_STOP", "true").lower() in ("1", "true", "yes")
+SEARCH_STOP_MARGIN = float(os.getenv("SEARCH_STOP_MARGIN", "2.0"))
+SEARCH_STOP_MIN_HITS = int(os.getenv("SEARCH_STOP_MIN_HITS", "2"))
+
+
+def candidate_url(candidate: Dict) -> str:
+    return candidate.get('genius_url') or candidate.get('url', '')
+
+
+class CandidateTracker:
+    def __init__(self, lyrics: str, enabled: bool = SEARCH_EARLY_STOP):
+        self.enabled = enabled
+        self.lyric_tokens = set(tokenize(lyrics))
+        self.scores: Dict[str, float] = {}
+        self.hits: Dict[str, int] = {}
+        self.titles: Dict[str, str] = {}
+
+    def _title_overlap(self, candidate: Dict, url: str) -> float:
+        """Fraction of the title's content words that occur in the lyrics."""
+        title = candidate.get('title') or ''
+        if not title or title.lower().startswith('unknown'):
+            title = url.rstrip('/').rsplit('/', 1)[-1].replace('-lyrics', '').replace('-', ' ')
+        # Scraped titles look like "Song by Artist"; artist names rarely appear in lyrics
+        words = [w for w in tokenize(title.split(' by ')[0]) if w not in STOPWORDS]
+        if not words:
+            return 0.0
+        return sum(1 for w in words if w in self.lyric_tokens) / len(words)
+
+    def add(self, results: List[Dict], query: str) -> None:
+        """Score the results of one query."""
+        if not results:
+            return
+        weight = max(1.0, line_distinctiveness(query))
+        seen = set()
+        for position, candidate in enumerate(results):
+            url = candidate_url(candidate)
+            if not url or url in seen:
+                continue
+            seen.add(url)
+            score = weight / (1 + position)
+            if candidate.get('api_confidence'):
+                score *= 1.5
+            if url not in self.titles:
+                self.titles[url] = candidate.get('title', '')
+                score += weight * self._title_overlap(candidate, url)
+            self.scores[url] = self.scores.get(url, 0.0) + score
+            self.hits[url] = self.hits.get(url, 0) + 1
+
+    def standings(self) -> List[Tuple[str, float]]:
+        return sorted(self.scores.items(), key=lambda item: item[1], reverse=True)
+
+    def leader(self) -> Optional[str]:
+        standings = self.standings()
+        return standings[0][0] if standings else None
+
+    def decided(self) -> bool:
+        """True once the leader is clear enough that further searching is wasted."""
+        if not self.enabled or not self.scores:
+            return False
+        standings = self.standings()
+        url, top = standings[0]
+        runner_up = standings[1][1] if len(standings) > 1 else 0.0
+        return self.hits[url] >= SEARCH_STOP_MIN_HITS and top >= SEARCH_STOP_MARGIN * runner_up
+
+    def summary(self) -> str:
+        url = self.leader()
+        if url is None:
+            return "no candidates"
+        return f"{self.titles.get(url) or url} (score {self.scores[url]:.1f}, {self.hits[url]} queries)"
@@ -0,0 +1,236 @@
+"""
+Central CPU budget for TensorFlow (Spleeter), PyTorch (Whisper, MiniLM) and
+the BLAS behind NumPy/librosa.
+
+Left alone, each library sizes its thread pool to every core, so a single
+request already runs several times more threads than there are cores and
+concurrent requests make it worse. The scheduler divides the cores once per
+server:
+
+  * the cores are shared between pre-forked workers, and with CPU_PINNING
+    each worker is pinned to its own core set;
+  * at most HEAVY_STAGE_SLOTS heavy stages (separation, transcription,
+    embedding) run at once across all workers, the rest wait for a slot, and
+    the master reclaims the slots of a worker that dies while holding them;
+  * a heavy stage gets CPU_CORES / HEAVY_STAGE_SLOTS intra-op threads (capped
+    to the worker's core set) and CPU_INTEROP_THREADS inter-op threads, so the
+    running stages together fill the machine without oversubscribing it.
+
+configure_process() must run before NumPy, torch or TensorFlow are imported:
+BLAS and OpenMP read their pool sizes from the environment once, at load time.
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# Cores to use (0 = every core this process may run on)
+CPU_CORES = int(os.getenv("CPU_CORES", "0"))
+# Heavy stages allowed to run at the same time across all workers (0 = one per worker)
+HEAVY_STAGE_SLOTS = int(os.getenv("HEAVY_STAGE_SLOTS", "0"))
+# Pin each pre-forked worker to its own share of the cores
+CPU_PINNING = os.getenv("CPU_PINNING", "false").lower() in ("1", "true", "yes")
+CPU_INTEROP_THREADS = int(os.getenv("CPU_INTEROP_THREADS", "1"))
+
+HEAVY_STAGES = ("separation", "transcription", "embedding")
+# Per-stage intra-op thread overrides, e.g. CPU_THREADS_TRANSCRIPTION=4 (0 = automatic)
+STAGE_THREAD_OVERRIDES = {stage: int(os.getenv(f"CPU_THREADS_{stage.upper()}", "0")) for stage in HEAVY_STAGES}
+TORCH_STAGES = ("transcription", "embedding")
+
+_plan: Optional[Dict] = None
+_slots = None
+# Slots held by each worker, so the master can give back those of a worker that died holding them
+_held = None
+_worker_index: Optional[int] = None
+_configure_lock = threading.Lock()
+_local = threading.local()
+_stats_lock = threading.Lock()
+_stats = {stage: {"runs": 0, "running": 0, "wait_sec": 0.0, "max_wait_sec": 0.0, "busy_sec": 0.0}
+          for stage in HEAVY_STAGES}
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    return cores[:CPU_CORES] if CPU_CORES > 0 else cores
+
+
+def make_plan(workers: int = 1) -> Dict:
+    """How the cores are divided for `workers` pre-forked workers."""
+    cores = available_cores()
+    workers = max(1, workers)
+    slots = HEAVY_STAGE_SLOTS or workers
+    threads = max(1, len(cores) // slots)
+    if CPU_PINNING:
+        threads = min(threads, max(1, len(cores) // workers))
+    stage_threads = {stage: STAGE_THREAD_OVERRIDES[stage] or threads for stage in HEAVY_STAGES}
+    return {
+        "cores": cores,
+        "workers": workers,
+        "slots": slots,
+        "pinning": CPU_PINNING,
+        "stage_threads": stage_threads,
+        "interop_threads": CPU_INTEROP_THREADS,
+    }
+
+
+def configure_process(workers: int = 1) -> Dict:
+    """
+    Fix the thread plan for this process (and any workers forked from it).
+    Only the first call takes effect, so the pre-fork master can configure
+    for N workers before importing the app, which configures for one.
+    """
+    global _plan, _slots, _held
+    with _configure_lock:
+        if _plan is not None:
+            return _plan
+        _plan = make_plan(workers)
+        # Created before fork, so every worker shares the same slots
+        _slots = multiprocessing.BoundedSemaphore(_plan["slots"])
+        # Each entry is only written by its worker (or the master once that worker is gone)
+        _held = multiprocessing.Array("i", _plan["workers"], lock=False)
+        threads = str(max(_plan["stage_threads"].values()))
+        # Explicit settings in the environment win
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS"):
+            os.environ.setdefault(name, threads)
+        os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(_plan["stage_threads"]["separation"]))
+        os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(_plan["interop_threads"]))
+        print(f"🧮 CPU plan: {len(_plan['cores'])} cores, {_plan['workers']} workers, "
+              f"{_plan['slots']} heavy stage slots, threads {_plan['stage_threads']}"
+              f"{', pinned' if _plan['pinning'] else ''}")
+        return _plan
+
+
+def current_plan() -> Dict:
+    return _plan or configure_process()
+
+
+def stage_threads(stage: str) -> int:
+    # Does not configure the process: module-level defaults read this at import time
+    return (_plan or make_plan())["stage_threads"][stage]
+
+
+def worker_cores(index: int) -> List[int]:
+    """Core set of pre-forked worker `index` when pinning is enabled."""
+    plan = current_plan()
+    cores = plan["cores"]
+    share = max(1, len(cores) // plan["workers"])
+    start = (index * share) % len(cores)
+    return cores[start:start + share]
+
+
+def configure_worker(index: int) -> None:
+    """Called in a freshly forked worker: pin it and size torch's pools."""
+    global _worker_index
+    _worker_index = index
+    plan = current_plan()
+    if plan["pinning"] and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, worker_cores(index))
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(stage_threads("transcription"))
+        try:
+            torch.set_num_interop_threads(plan["interop_threads"])
+        except RuntimeError:
+            # Already fixed by the first parallel op in the master (warm-up)
+            pass
+
+
+def reclaim_worker_slots(index: int) -> int:
+    """
+    Release the slots a dead worker was holding; the pre-fork master calls
+    this when it reaps a worker. A worker killed inside heavy_stage (SIGKILL,
+    OOM killer) never reaches its finally block, and without this every
+    worker would eventually block on the lost slots.
+    """
+    current_plan()
+    held = _held[index]
+    _held[index] = 0
+    for _ in range(held):
+        _slots.release()
+    if held:
+        print(f"🧹 Reclaimed {held} CPU slot(s) from worker #{index}")
+    return held
+
+
+def configure_tensorflow() -> None:
+    """Size TensorFlow's pools; call before its first op runs."""
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(stage_threads("separation"))
+        tf.config.threading.set_inter_op_parallelism_threads(current_plan()["interop_threads"])
+    except RuntimeError:
+        # TensorFlow has already been initialised in this process
+        pass
+
+
+@contextmanager
+def heavy_stage(stage: str):
+    """
+    Run a CPU-heavy stage once a slot is free, with the stage's thread count.
+    Nested stages on the same thread reuse the outer slot.
+    """
+    if getattr(_local, "stage", None):
+        yield
+        return
+    current_plan()
+    waited_from = time.perf_counter()
+    _slots.acquire()
+    index = _worker_index or 0
+    with _stats_lock:
+        _held[index] += 1
+    started = time.perf_counter()
+    waited = started - waited_from
+    if waited > 1.0:
+        print(f"⏳ {stage} waited {waited:.1f}s for a CPU slot")
+    if stage in TORCH_STAGES and "torch" in sys.modules:
+        # Sets torch's process-wide intra-op pool size, so a stage running
+        # concurrently in this worker also picks up the latest value
+        sys.modules["torch"].set_num_threads(stage_threads(stage))
+    with _stats_lock:
+        stats = _stats[stage]
+        stats["running"] += 1
+        stats["wait_sec"] += waited
+        stats["max_wait_sec"] = max(stats["max_wait_sec"], waited)
+    _local.stage = stage
+    try:
+        yield
+    finally:
+        _local.stage = None
+        with _stats_lock:
+            _held[index] -= 1
+        _slots.release()
+        with _stats_lock:
+            stats["running"] -= 1
+            stats["runs"] += 1
+            stats["busy_sec"] += time.perf_counter() - started
+
+
+def cpu_stats() -> Dict:
+    plan = current_plan()
+    with _stats_lock:
+        stages = {}
+        for stage, stats in _stats.items():
+            runs = stats["runs"]
+            stages[stage] = {
+                "threads": plan["stage_threads"][stage],
+                "runs": runs,
+                "running": stats["running"],
+                "avg_wait_sec": round(stats["wait_sec"] / runs, 3) if runs else None,
+                "max_wait_sec": round(stats["max_wait_sec"], 3),
+                "avg_busy_sec": round(stats["busy_sec"] / runs, 3) if runs else None,
+            }
+    return {
+        "cores": len(plan["cores"]),
+        "workers": plan["workers"],
+        "worker_index": _worker_index,
+        "worker_cores": worker_cores(_worker_index) if plan["pinning"] and _worker_index is not None else None,
+        "heavy_stage_slots": plan["slots"],
+        "interop_threads": plan["interop_threads"],
+        "stages": stages,
+    }
@@ -0,0 +1,138 @@
+"""
+Corpus-driven line distinctiveness scoring.
+
+A lyrics corpus is reduced to a hashed n-gram document-frequency table: one
+uint32 array (2^20 buckets, 4 MB) saved as .npy and memory-mapped at load
+time. Lines are scored by the IDF of their n-grams, so queries favour the
+words and phrases that are rare across songs rather than hand-picked ones.
+
+Build a table:
+    python distinctiveness.py build path/to/lyrics_corpus/ data/ngram_df.npy
+"""
+import os
+import re
+import sys
+import math
+import zlib
+from typing import Iterable, List
+
+import numpy as np
+
+DF_TABLE_PATH = os.getenv(
+    "DF_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ngram_df.npy")
+)
+DF_BUCKETS = 1 << 20
+MAX_NGRAM = 3
+
+# Used when no corpus table is available: common words get a low IDF
+STOPWORDS = set("""
+a about all am an and are as at be been but by can could did do don't for from get got had has have he her
+him his how i i'm if in into is it it's just know let like me my no not now of oh on one or our out say she so
+that the their them then there they this to too up us was we were what when where who why will with would
+yeah you your you're baby love go come want need make way time
+""".split())
+
+_table = None
+# Set after the first lookup, so a missing table is not looked for again on every idf() call
+_table_checked = False
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def ngrams(tokens: List[str], max_n: int = MAX_NGRAM) -> Iterable[str]:
+    for n in range(1, max_n + 1):
+        for i in range(len(tokens) - n + 1):
+            yield ' '.join(tokens[i:i + n])
+
+
+def _bucket(ngram: str) -> int:
+    # crc32 is stable across processes (unlike hash()); bucket 0 holds the document count
+    return 1 + zlib.crc32(ngram.encode("utf-8")) % (DF_BUCKETS - 1)
+
+
+def build_df_table(documents: Iterable[str], out_path: str) -> int:
+    """Count in how many documents each n-gram appears and save the table. Returns the doc count."""
+    table = np.zeros(DF_BUCKETS, dtype=np.uint32)
+    n_docs = 0
+    for doc in documents:
+        buckets = np.fromiter({_bucket(g) for g in ngrams(tokenize(doc))}, dtype=np.int64)
+        table[buckets] += 1
+        n_docs += 1
+    table[0] = n_docs
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    np.save(out_path, table)
+    return n_docs
+
+
+def load_df_table(path: str = DF_TABLE_PATH):
+    """Memory-map the DF table once; returns None if it has not been built."""
+    global _table, _table_checked
+    if not _table_checked:
+        _table_checked = True
+        if not os.path.exists(path):
+            return None
+        try:
+            _table = np.load(path, mmap_mode="r")
+            print(f"✅ Loaded n-gram DF table ({int(_table[0])} documents)")
+        except Exception as e:
+            print(f"⚠️ Failed to load n-gram DF table: {e}")
+    return _table
+
+
+def idf(ngram: str) -> float:
+    table = load_df_table()
+    if table is None:
+        words = ngram.split()
+        common = sum(1 for w in words if w in STOPWORDS)
+        return 0.5 if common == len(words) else 1.0 + 2.0 * (len(words) - common) / len(words)
+    n_docs = int(table[0])
+    return math.log((n_docs + 1) / (int(table[_bucket(ngram)]) + 1)) + 1.0
+
+
+def line_distinctiveness(line: str) -> float:
+    """
+    Higher for lines made of rare words and rare word sequences. Longer
+    n-grams count more, and the sum is damped so long generic lines do not win.
+    """
+    tokens = tokenize(line)
+    if len(tokens) < 3:
+        return 0.0
+    total = sum(idf(g) * len(g.split()) for g in ngrams(tokens))
+    return total / math.sqrt(len(tokens))
+
+
+def most_distinctive_lines(lines: List[str], max_lines: int, min_chars: int = 8) -> List[str]:
+    """Top lines by distinctiveness, skipping near-duplicates (same token sequence)."""
+    scored = sorted(
+        ((line_distinctiveness(line), line) for line in lines if len(line.strip()) >= min_chars),
+        key=lambda x: x[0], reverse=True
+    )
+    chosen, seen = [], set()
+    for score, line in scored:
+        key = ' '.join(tokenize(line))
+        if key in seen:
+            continue
+        seen.add(key)
+        chosen.append(line)
+        if len(chosen) >= max_lines:
+            break
+    return chosen
+
+
+def _read_corpus(corpus_dir: str) -> Iterable[str]:
+    """One song per .txt file, searched recursively."""
+    for root, _, files in os.walk(corpus_dir):
+        for name in sorted(files):
+            if name.endswith(".txt"):
+                with open(os.path.join(root, name), encoding="utf-8", errors="ignore") as f:
+                    yield f.read()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        count = build_df_table(_read_corpus(sys.argv[2]), sys.argv[3])
+        print(f"✅ Built n-gram DF table from {count} documents at {sys.argv[3]}")
+    else:
+        print("Usage: python distinctiveness.py build <corpus_dir> <out.npy>")
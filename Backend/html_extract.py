@@ -0,0 +1,214 @@
+"""
+Targeted HTML extraction for Genius lyrics pages and Google result pages.
+
+The fast paths stream the page through html.parser's tokenizer without
+building a tree. Only the elements the pipeline uses are collected (Genius
+`data-lyrics-container` divs, Google result anchors/cites/spans), and lyrics
+parsing starts at the first container and stops once the last one closes.
+The BeautifulSoup versions are the previous implementation, kept as the
+fallback for old page layouts and as the reference for the parity check in
+`benchmark.py html`.
+"""
+import re
+from html.parser import HTMLParser
+from typing import List
+
+LYRICS_CONTAINER_MARKER = 'data-lyrics-container="true"'
+# Previous selector chain, first match wins (BeautifulSoup fallback only)
+LYRICS_SELECTORS = [
+    '[data-lyrics-container="true"]',
+    '.lyrics',
+    '.Lyrics__Container-sc-1ynbvzw-6',
+    '.LyricsBody__Container-sc-1ynbvzw-6',
+    '[class*="lyrics"]',
+    '[class*="Lyrics"]',
+    '[class*="LyricsBody"]',
+    '.song_body-lyrics p',
+    '.verse, .chorus, .bridge'
+]
+MIN_CONTAINER_CHARS = 50
+MAX_LYRICS_CHARS = 1500
+
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+SKIP_TEXT_TAGS = {'script', 'style', 'template'}
+FEED_CHUNK = 16 * 1024
+
+
+class _LyricsContainerParser(HTMLParser):
+    """Collects the text nodes of each lyrics container, nested markup included."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.containers: List[List[str]] = []
+        # Only the container's own tag name is counted, so unclosed inner tags
+        # (`<p>` without `</p>`) cannot keep the container open past its end tag
+        self.tag = None
+        self.depth = 0
+        self.skip_tag = None
+        self.skip_depth = 0
+        self.remaining = 0  # containers still to close
+        self.pending: List[str] = []
+
+    def _flush(self):
+        # A text node can arrive in several handle_data calls when it spans two fed chunks
+        if self.pending:
+            text = ''.join(self.pending).strip()
+            self.pending = []
+            if text:
+                self.containers[-1].append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if self.depth:
+            if tag == self.tag:
+                self.depth += 1
+            if self.skip_depth:
+                if tag == self.skip_tag:
+                    self.skip_depth += 1
+            elif tag in SKIP_TEXT_TAGS:
+                self.skip_tag = tag
+                self.skip_depth = 1
+        elif tag not in VOID_TAGS and ('data-lyrics-container', 'true') in attrs:
+            self.containers.append([])
+            self.tag = tag
+            self.depth = 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if not self.depth:
+            return
+        if self.skip_depth and tag == self.skip_tag:
+            self.skip_depth -= 1
+        if tag != self.tag:
+            return
+        self.depth -= 1
+        if not self.depth:
+            # The container's end tag closes anything still open inside it
+            self.skip_depth = 0
+            self.remaining -= 1
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_data(self, data):
+        if self.depth and not self.skip_depth:
+            self.pending.append(data)
+
+
+def lyrics_containers_text(html: str) -> List[str]:
+    """Text of every Genius lyrics container, nodes joined by newlines (fast path)."""
+    start = html.find(LYRICS_CONTAINER_MARKER)
+    if start < 0:
+        return []
+    start = html.rfind('<', 0, start)
+    parser = _LyricsContainerParser()
+    parser.remaining = html.count(LYRICS_CONTAINER_MARKER)
+    # Stream from the first container and stop as soon as the last one closes
+    for offset in range(start, len(html), FEED_CHUNK):
+        parser.feed(html[offset:offset + FEED_CHUNK])
+        if parser.remaining <= 0 and not parser.depth:
+            break
+    return ['\n'.join(parts) for parts in parser.containers]
+
+
+def lyrics_containers_text_bs4(html: str) -> List[str]:
+    """Reference implementation: the BeautifulSoup selector chain."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for selector in LYRICS_SELECTORS:
+        elements = soup.select(selector)
+        if elements:
+            texts = [element.get_text(separator='\n', strip=True) for element in elements]
+            if any(text and len(text) > MIN_CONTAINER_CHARS for text in texts):
+                return texts
+    return []
+
+
+def clean_lyrics_text(texts: List[str]) -> str:
+    lyrics_text = ''.join(text + "\n" for text in texts if text and len(text) > MIN_CONTAINER_CHARS)
+    if not lyrics_text:
+        return ""
+    lyrics_text = re.sub(r'\n+', '\n', lyrics_text)
+    lyrics_text = re.sub(r'\[.*?\]', '', lyrics_text)
+    lyrics_text = re.sub(r'\s+', ' ', lyrics_text.strip())
+    return lyrics_text[:MAX_LYRICS_CHARS]
+
+
+def extract_lyrics(html: str) -> str:
+    """Lyrics text from a Genius song page, falling back to BeautifulSoup for old layouts."""
+    lyrics = clean_lyrics_text(lyrics_containers_text(html))
+    if lyrics:
+        return lyrics
+    # No container, or every container too short: move on to the other selectors like before
+    return clean_lyrics_text(lyrics_containers_text_bs4(html))
+
+
+class _GoogleLinkParser(HTMLParser):
+    """Genius hrefs of anchors, plus the text of cite/span elements mentioning genius.com."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs: List[str] = []
+        self.cites: List[str] = []
+        self.spans: List[str] = []
+        self.open_text = []  # (tag, text parts, result list, slot) for each open cite/span
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            href = dict(attrs).get('href') or ''
+            if 'genius.com' in href:
+                self.hrefs.append(href)
+        elif tag in ('cite', 'span'):
+            # Reserve the slot now so results stay in document (start tag) order
+            results = self.cites if tag == 'cite' else self.spans
+            results.append(None)
+            self.open_text.append((tag, [], results, len(results) - 1))
+
+    def handle_endtag(self, tag):
+        if tag not in ('cite', 'span'):
+            return
+        # Close the innermost open element of this tag (tolerates unclosed inner tags)
+        for i in range(len(self.open_text) - 1, -1, -1):
+            if self.open_text[i][0] == tag:
+                for _, parts, results, index in self.open_text[i:]:
+                    results[index] = ''.join(parts)
+                del self.open_text[i:]
+                break
+
+    def handle_data(self, data):
+        for _, parts, _, _ in self.open_text:
+            parts.append(data)
+
+    def links(self) -> List[str]:
+        for _, parts, results, index in self.open_text:
+            results[index] = ''.join(parts)
+        texts = [t for t in self.cites + self.spans if t and 'genius.com' in t]
+        return self.hrefs + texts
+
+
+def google_result_links(html: str) -> List[str]:
+    """Strings that may hold Genius URLs, in the order the BeautifulSoup selectors returned them (fast path)."""
+    if 'genius.com' not in html:
+        return []
+    parser = _GoogleLinkParser()
+    parser.feed(html)
+    parser.close()
+    return parser.links()
+
+
+def google_result_links_bs4(html: str) -> List[str]:
+    """Reference implementation: the BeautifulSoup/soupsieve selectors."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for selector in ('a[href*="genius.com"]', 'cite:contains("genius.com")', 'span:contains("genius.com")'):
+        for element in soup.select(selector):
+            href = element.get('href') or element.get_text()
+            if href:
+                links.append(href)
+    return links
@@ -1,23 +1,225 @@
-import ollama
-
-def clean_lyrics_with_llama3(raw_lyrics: str) -> str:
-    prompt = (
-        "The following text is a noisy, possibly hallucinated transcription of a song's lyrics. "
-        "Please clean it up to make it look like real English song lyrics, removing repetitions, "
-        "hallucinations, and non-lyric content. Only output the cleaned lyrics.\n\n"
-        f"Raw lyrics:\n{raw_lyrics}\n\nCleaned lyrics:"
-    )
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+import httpx
+from rule_cleaner import rule_based_clean, quality_score
+from metrics import timed_stage, upstream_call, record_cache
+
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3")
+# Tiered cleaning: rules first, then a small local model, then LLM_MODEL, each
+# only when the quality score of the best text so far stays below the threshold
+LLM_SMALL_MODEL = os.getenv("LLM_SMALL_MODEL", "llama3.2:1b")
+CLEAN_QUALITY_THRESHOLD = float(os.getenv("CLEAN_QUALITY_THRESHOLD", "0.75"))
+# Per-request cap on time spent cleaning; the best text so far is returned when it runs out
+LLM_CLEAN_BUDGET_SEC = float(os.getenv("LLM_CLEAN_BUDGET_SEC", "20"))
+# Overridable so a local stand-in Ollama server can be used
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Keep the model resident between requests instead of reloading it
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Sent with every chat: a request with a different context size makes Ollama
+# reload the model, and temperature 0 keeps cached and fresh results alike
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+OLLAMA_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "temperature": 0}
+
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+
+PROMPT_TEMPLATE = (
+    "The following text is a noisy, possibly hallucinated transcription of a song's lyrics. "
+    "Please clean it up to make it look like real English song lyrics, removing repetitions, "
+    "hallucinations, and non-lyric content. Only output the cleaned lyrics.\n\n"
+    "Raw lyrics:\n{raw_lyrics}\n\nCleaned lyrics:"
+)
+
+_client = None
+_transport = None
+_stats_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "total_latency": 0.0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "last": None,
+    "tier_rules": 0,
+    "tier_small": 0,
+    "tier_large": 0,
+    # Cleanings where no tier reached CLEAN_QUALITY_THRESHOLD (counted under the tier whose text was used)
+    "below_threshold": 0,
+    "budget_exhausted": 0,
+}
+
+
+def get_client(timeout: float = None):
+    """
+    Ollama client over one HTTP connection pool shared by every request.
+    With `timeout`, a client whose HTTP calls give up after that many seconds.
+    """
+    global _client, _transport
+    import ollama
+    if _client is None:
+        _transport = httpx.HTTPTransport()
+        _client = ollama.Client(host=OLLAMA_HOST, transport=_transport)
+    if timeout is None:
+        return _client
+    return ollama.Client(host=OLLAMA_HOST, timeout=timeout, transport=_transport)
+
+
+def llm_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    generated = stats["cache_misses"]
+    stats["avg_latency"] = round(stats["total_latency"] / generated, 3) if generated else None
+    stats["cache_hit_ratio"] = round(stats["cache_hits"] / stats["requests"], 3) if stats["requests"] else 0.0
+    return stats
+
+
+def _cache_key(raw_lyrics: str, model: str) -> str:
+    # Whitespace/case differences between re-uploads should hit the same entry
+    normalized = re.sub(r'\s+', ' ', raw_lyrics.strip().lower())
+    return hashlib.sha256(f"{model}\n{PROMPT_TEMPLATE}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+def _cache_get(key: str):
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cleaned = json.load(f)["cleaned"]
+        os.utime(path)  # Mark as recently used
+        return cleaned
+    except (OSError, ValueError, KeyError):
+        return None
+
 
+def _cache_put(key: str, cleaned: str, model: str) -> None:
     try:
-        response = ollama.chat(
-            model="llama3",
-            messages=[{"role": "user", "content": prompt}],
-        )
-        return response['message']['content'].strip()
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        tmp_path = os.path.join(LLM_CACHE_DIR, f"{key}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"cleaned": cleaned, "model": model}, f)
+        os.replace(tmp_path, os.path.join(LLM_CACHE_DIR, f"{key}.json"))
+        _cache_evict()
+    except OSError as e:
+        print(f"⚠️ Could not write LLM cache entry: {e}")
+
+
+def _cache_evict() -> None:
+    """Least-recently-used eviction by file mtime."""
+    entries = [e for e in os.scandir(LLM_CACHE_DIR) if e.name.endswith(".json")]
+    if len(entries) <= LLM_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - LLM_CACHE_MAX_ENTRIES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _record(**fields) -> None:
+    with _stats_lock:
+        for name, value in fields.items():
+            if name == "last":
+                _stats["last"] = value
+            else:
+                _stats[name] += value
+
+
+def clean_with_model(raw_lyrics: str, model: str = LLM_MODEL, timeout: float = None) -> str:
+    """
+    Clean lyrics with one Ollama model, using the on-disk cache. Raises
+    TimeoutError when the model does not answer within `timeout` seconds.
+    """
+    key = _cache_key(raw_lyrics, model)
+    cached = _cache_get(key)
+    record_cache("llm", cached is not None)
+    if cached is not None:
+        print("⚡ LLM cleaning cache hit")
+        _record(requests=1, cache_hits=1)
+        return cached
+
+    prompt = PROMPT_TEMPLATE.format(raw_lyrics=raw_lyrics)
+
+    try:
+        start = time.perf_counter()
+        with upstream_call("ollama"):
+            response = get_client(timeout).chat(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                options=OLLAMA_OPTIONS,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+            )
+        latency = time.perf_counter() - start
+        cleaned = response['message']['content'].strip()
+    except httpx.TimeoutException:
+        raise TimeoutError(f"⚠️ {model} did not answer within {timeout:.1f}s")
     except TypeError as e:
         if "proxies" in str(e):
             raise RuntimeError("⚠️ Ollama appears to be using a patched or misconfigured requests.post() call. "
                                "Check for global proxy settings or monkey patches.")
         raise
     except Exception as e:
-        raise RuntimeError(f"⚠️ Failed to clean lyrics with Llama 3: {e}")
+        raise RuntimeError(f"⚠️ Failed to clean lyrics with {model}: {e}")
+
+    prompt_tokens = response.get('prompt_eval_count') or 0
+    completion_tokens = response.get('eval_count') or 0
+    _record(
+        requests=1, cache_misses=1, total_latency=latency,
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        last={"latency": round(latency, 3), "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens},
+    )
+    print(f"🤖 {model} cleaning took {latency:.1f}s ({prompt_tokens} prompt / {completion_tokens} completion tokens)")
+
+    if cleaned:
+        _cache_put(key, cleaned, model)
+    return cleaned
+
+
+@timed_stage("llm_clean")
+def clean_lyrics_with_llama3(raw_lyrics: str, budget_sec: float = LLM_CLEAN_BUDGET_SEC) -> str:
+    """
+    Tiered cleaning: a deterministic rule pass, then LLM_SMALL_MODEL, then
+    LLM_MODEL, stopping at the first result whose quality score reaches
+    CLEAN_QUALITY_THRESHOLD. Never spends more than `budget_sec` waiting on models.
+    """
+    start = time.monotonic()
+    best = rule_based_clean(raw_lyrics) or raw_lyrics
+    best_score = quality_score(best)
+    best_tier = "tier_rules"
+    print(f"🧹 Rule-based cleaning score: {best_score:.2f}")
+    if best_score >= CLEAN_QUALITY_THRESHOLD:
+        _record(tier_rules=1)
+        return best
+
+    for tier, model in (("tier_small", LLM_SMALL_MODEL), ("tier_large", LLM_MODEL)):
+        if not model:
+            continue
+        remaining = budget_sec - (time.monotonic() - start)
+        if remaining <= 0:
+            break
+        # Feed the rule-cleaned text: fewer prompt tokens, same content
+        try:
+            cleaned = clean_with_model(best, model, timeout=remaining)
+        except TimeoutError:
+            # The connection is dropped, so Ollama stops generating rather
+            # than keeping the model busy for the requests queued behind it
+            print(f"⏱️ Cleaning budget of {budget_sec:.0f}s exhausted waiting for {model}")
+            _record(budget_exhausted=1)
+            break
+        except Exception as e:
+            print(f"⚠️ {e}")
+            continue
+        score = quality_score(cleaned)
+        print(f"🤖 {model} cleaning score: {score:.2f}")
+        if score > best_score:
+            best, best_score, best_tier = cleaned, score, tier
+        if best_score >= CLEAN_QUALITY_THRESHOLD:
+            _record(**{best_tier: 1})
+            return best
+    # Every tier fell short: count the tier whose text is returned
+    _record(below_threshold=1, **{best_tier: 1})
+    return best
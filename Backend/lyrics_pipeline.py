@@ -0,0 +1,479 @@
+"""
+The identification pipeline shared by the API (api.py) and the CLI (main.py).
+
+Stages and the values they pass (see pipeline.py for the engine):
+
+  isolate           audio_path -> vocal_path
+  transcribe        vocal_path -> raw_transcription, chunks (+ streaming results in the API)
+  clean             raw_transcription -> cleaned_lyrics
+  raw_search        raw_transcription -> raw_candidates, searched_queries
+  speculative_rank  raw_transcription, raw_candidates -> speculative_results
+  search            raw_transcription, cleaned_lyrics, raw_candidates, searched_queries -> candidates
+  rank              raw_transcription, cleaned_lyrics, candidates -> results
+  refine            vocal_path, raw_transcription, chunks, cleaned_lyrics, results
+                      -> final_transcription, final_lyrics, final_results, refined, refine_pruning
+  enrich (CLI)      final_results -> linked_results
+
+clean and raw_search both only need the transcription, so the LLM cleans
+while the raw lines are searched and ranked; lyrics of every candidate are
+prefetched in the background while the remaining strategies search. When
+the speculative ranking reaches SPECULATIVE_CONFIDENCE (or the request
+budget runs out) it becomes the final `results` and cleaning, search and
+ranking are abandoned; the LLM call still finishes and warms its cache.
+
+With STT_CASCADE the transcription uses the fast Whisper model. If no
+result reaches CASCADE_CONFIDENCE, refine re-transcribes the low-confidence
+chunks with the accurate model and resumes the graph from the refined
+transcription (isolation and transcription are not rerun).
+"""
+import os
+import re
+import string
+from typing import Dict, List
+
+from vocal_isolation import isolate_vocals
+from stt_backends import extract_text
+from speech_to_text_whisper import (
+    transcribe_chunks, refine_low_confidence, join_transcript, chunk_segments, FAST_MODEL, ACCURATE_MODEL
+)
+from transcript_pruning import pruned_transcript
+from search_songs import search_genius_by_lyrics_scrape, extract_key_phrases, search_multiple_strategies
+from rag_retrieval import rag_search_with_similarity, prefetch_lyrics, enrich_with_links
+from llm_cleaner import clean_lyrics_with_llama3, LLM_CLEAN_BUDGET_SEC
+from lyrics_search import search_by_lyrics
+from distinctiveness import line_distinctiveness
+from candidate_tracker import CandidateTracker
+from metrics import timed_stage, stage_timer
+from request_budget import budget_exhausted, call_timeout
+from pipeline import Pipeline, Stage, StageCache
+
+# Coarse-to-fine STT: transcribe with a fast Whisper model, search, and only
+# re-transcribe low-confidence chunks with the accurate model if no match is confident
+STT_CASCADE = os.getenv("STT_CASCADE", "false").lower() in ("1", "true", "yes")
+CASCADE_CONFIDENCE = float(os.getenv("CASCADE_CONFIDENCE", "60"))
+
+# Drop low-confidence, hallucinated and repeated Whisper segments before
+# cleaning and searching. Uses the Whisper backend for transcription.
+TRANSCRIPT_PRUNING = os.getenv("TRANSCRIPT_PRUNING", "false").lower() in ("1", "true", "yes")
+
+# Speculative search: search on the raw transcription while the LLM cleans it,
+# and skip the LLM entirely if a raw-text candidate reaches SPECULATIVE_CONFIDENCE
+SPECULATIVE_SEARCH = os.getenv("SPECULATIVE_SEARCH", "true").lower() in ("1", "true", "yes")
+SPECULATIVE_CONFIDENCE = float(os.getenv("SPECULATIVE_CONFIDENCE", "80"))
+
+# Hard limit on the cleaning stage; the LLM tiers already stop at LLM_CLEAN_BUDGET_SEC,
+# this only catches a hung call. The raw transcription is used past it.
+CLEAN_STAGE_TIMEOUT_SEC = float(os.getenv("CLEAN_STAGE_TIMEOUT_SEC", str(LLM_CLEAN_BUDGET_SEC + 10)))
+
+# Candidates found for a (raw, cleaned) transcription, so the same recording
+# identified again skips the search strategies. 0 disables the cache.
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "128"))
+
+
+def remove_llm_headers(text: str) -> str:
+    """Remove LLM-added phrases like 'Here are the cleaned-up lyrics:'"""
+    lines = text.strip().splitlines()
+    return '\n'.join(
+        line for line in lines
+        if not re.match(r'^\s*(here\s+(are|is)|these|the following)\b.*?:?', line.strip(), re.IGNORECASE)
+    ).strip()
+
+
+def clean_transcription(raw_transcription: str) -> str:
+    """LLM-clean a transcription, falling back to the raw text"""
+    try:
+        cleaned_lyrics = remove_llm_headers(
+            clean_lyrics_with_llama3(raw_transcription, call_timeout(LLM_CLEAN_BUDGET_SEC))
+        )
+    except Exception as e:
+        print(f"⚠️ Lyrics cleaning failed: {e}")
+        return raw_transcription
+    if not cleaned_lyrics.strip():
+        print("⚠️ Lyrics cleaning returned empty output, using raw transcription")
+        return raw_transcription
+    return cleaned_lyrics
+
+
+def dedupe_candidates(candidates):
+    """Remove duplicate candidates by URL, preserving order"""
+    seen_urls = set()
+    unique_candidates = []
+    for candidate in candidates:
+        url = candidate.get('genius_url') or candidate.get('url', '')
+        if url and url not in seen_urls:
+            seen_urls.add(url)
+            unique_candidates.append(candidate)
+    return unique_candidates
+
+
+def normalize_query(query: str) -> str:
+    """Key used to recognise a query that was already searched"""
+    return ' '.join(query.lower().translate(str.maketrans('', '', string.punctuation)).split())
+
+
+def search_once(query, max_results, searched_queries):
+    """search_by_lyrics, skipping queries already run for this transcription"""
+    key = normalize_query(query)
+    if key in searched_queries:
+        print("       ⏭️ Already searched")
+        return []
+    searched_queries.add(key)
+    results = search_by_lyrics(query, max_results=max_results)
+    # Fetch candidate lyrics while the remaining strategies search
+    prefetch_lyrics(results)
+    return results
+
+
+def search_raw_lines(raw_lyrics, searched_queries, search_attempts=None, tracker=None):
+    """Strategy 4: search on raw transcription lines"""
+    candidates = []
+    raw_lines = [line.strip() for line in raw_lyrics.split('\n') if line.strip() and len(line.strip()) > 10]
+    for i, line in enumerate(raw_lines[:3]):
+        line_clean = line.translate(str.maketrans('', '', string.punctuation))
+        print(f"   [{i+1}] Trying raw line: '{line[:50]}{'...' if len(line) > 50 else ''}'")
+        if search_attempts is not None:
+            search_attempts.append(f"Raw line: {line}")
+
+        results = search_once(line_clean, 5, searched_queries)
+        if results:
+            print(f"       ✅ Found {len(results)} matches")
+            candidates.extend(results)
+        if tracker is not None:
+            tracker.add(results, line_clean)
+            if tracker.decided():
+                break
+    return candidates
+
+
+@timed_stage("search")
+def comprehensive_search_strategy(raw_lyrics, cleaned_lyrics, searched_queries=None):
+    """
+    Enhanced search strategy that tries multiple approaches systematically.
+    Candidates are scored as they arrive and the remaining strategies are
+    skipped once one song clearly leads.
+    """
+    print("🔍 Starting comprehensive search strategy...")
+
+    all_candidates = []
+    search_attempts = []
+    if searched_queries is None:
+        searched_queries = set()
+    tracker = CandidateTracker(cleaned_lyrics)
+
+    def finish():
+        # Remove duplicates while preserving order
+        unique_candidates = dedupe_candidates(all_candidates)
+
+        print("\n📊 Search Summary:")
+        print(f"   • Total searches attempted: {len(search_attempts)}")
+        print(f"   • Total candidates found: {len(all_candidates)}")
+        print(f"   • Unique candidates: {len(unique_candidates)}")
+        if tracker.decided():
+            print(f"   • Stopped early, clear leader: {tracker.summary()}")
+
+        if not unique_candidates:
+            print("\n🔍 Search attempts made:")
+            for attempt in search_attempts[-5:]:  # Show last 5 attempts
+                print(f"   • {attempt[:80]}{'...' if len(attempt) > 80 else ''}")
+
+        return unique_candidates
+
+    # Parse lines for different strategies
+    cleaned_lines = [line.strip() for line in cleaned_lyrics.split('\n') if line.strip() and len(line.strip()) > 10]
+
+    # Strategy 1: Key phrases from cleaned lyrics (most distinctive)
+    print("🎯 Strategy 1: Key phrases from cleaned lyrics")
+    key_phrases = extract_key_phrases(cleaned_lyrics, 5)
+
+    for i, phrase in enumerate(key_phrases):
+        if len(phrase.strip()) < 15:
+            continue
+
+        print(f"   [{i+1}] Trying phrase: '{phrase[:60]}{'...' if len(phrase) > 60 else ''}'")
+        search_attempts.append(f"Key phrase: {phrase}")
+
+        results = search_once(phrase, 8, searched_queries)
+        if results:
+            print(f"       ✅ Found {len(results)} matches")
+            all_candidates.extend(results)
+        else:
+            print("       ❌ No matches")
+        tracker.add(results, phrase)
+        if tracker.decided():
+            return finish()
+
+    # Strategy 2: Multi-strategy search (uses multiple search patterns)
+    print("\n🎯 Strategy 2: Multi-strategy search patterns")
+    multi_results = search_multiple_strategies(cleaned_lyrics, max_results_per_strategy=3, tracker=tracker)
+    if multi_results:
+        print(f"   ✅ Multi-strategy found {len(multi_results)} additional matches")
+        prefetch_lyrics(multi_results)
+        # Convert format to match other results
+        for result in multi_results:
+            formatted_result = {
+                'title': result.get('title', 'Unknown'),
+                'artist': 'Unknown',
+                'genius_url': result.get('url', ''),
+                'search_method': 'multi_strategy'
+            }
+            all_candidates.append(formatted_result)
+    if tracker.decided():
+        return finish()
+
+    # Strategy 3: Best individual lines from cleaned lyrics
+    print("\n🎯 Strategy 3: Best individual cleaned lines")
+    # Score lines by length and uniqueness
+    scored_lines = sorted(
+        ((round(line_distinctiveness(line), 1), line) for line in cleaned_lines),
+        reverse=True, key=lambda x: x[0]
+    )
+
+    for i, (score, line) in enumerate(scored_lines[:3]):
+        print(f"   [{i+1}] Trying line (score: {score}): '{line[:50]}{'...' if len(line) > 50 else ''}'")
+        search_attempts.append(f"Cleaned line: {line}")
+
+        results = search_once(line, 5, searched_queries)
+        if results:
+            print(f"       ✅ Found {len(results)} matches")
+            all_candidates.extend(results)
+        else:
+            print("       ❌ No matches")
+        tracker.add(results, line)
+        if tracker.decided():
+            return finish()
+
+    # Strategy 4: Best raw transcription lines (in case cleaning removed important info)
+    if len(all_candidates) < 5:
+        print("\n🎯 Strategy 4: Raw transcription lines")
+        all_candidates.extend(search_raw_lines(raw_lyrics, searched_queries, search_attempts, tracker))
+        if tracker.decided():
+            return finish()
+
+    # Strategy 5: Combined phrases for better context
+    if len(all_candidates) < 5 and len(cleaned_lines) >= 2:
+        print("\n🎯 Strategy 5: Combined phrases")
+        for i in range(min(3, len(cleaned_lines) - 1)):
+            combined = f"{cleaned_lines[i].strip()} {cleaned_lines[i+1].strip()}"
+            if len(combined) > 120:  # Keep reasonable length
+                combined = combined[:120]
+
+            print(f"   [{i+1}] Trying combined: '{combined[:50]}{'...' if len(combined) > 50 else ''}'")
+            search_attempts.append(f"Combined: {combined}")
+
+            results = search_once(combined, 3, searched_queries)
+            if results:
+                print(f"       ✅ Found {len(results)} matches")
+                all_candidates.extend(results)
+            tracker.add(results, combined)
+            if tracker.decided():
+                return finish()
+
+    # Strategy 6: Fallback web scraping if still not enough results
+    if len(all_candidates) < 3 and not budget_exhausted():
+        print("\n🎯 Strategy 6: Fallback web scraping")
+        fallback_terms = (key_phrases[:2] + cleaned_lines[:2])
+
+        for term in fallback_terms:
+            if len(term.strip()) < 15:
+                continue
+
+            print(f"   🕷️ Scraping with: '{term[:50]}{'...' if len(term) > 50 else ''}'")
+            search_attempts.append(f"Web scraping: {term}")
+
+            scrape_results = search_genius_by_lyrics_scrape(term, max_results=3)
+            if scrape_results:
+                print(f"       ✅ Scraping found {len(scrape_results)} matches")
+                prefetch_lyrics(scrape_results)
+                for result in scrape_results:
+                    formatted_result = {
+                        'title': result.get('title', 'Unknown'),
+                        'artist': 'Unknown',
+                        'genius_url': result.get('url', ''),
+                        'search_method': 'web_scraping'
+                    }
+                    all_candidates.append(formatted_result)
+
+    return finish()
+
+
+def top_similarity(results) -> float:
+    """Similarity (0-100) of the best ranked result, 0 if there is none"""
+    if not results:
+        return 0.0
+    return float(results[0].get('similarity', 0.0) or 0.0)
+
+
+def confidence_level(similarity_score: float) -> str:
+    """Human-readable confidence for the top similarity score"""
+    if similarity_score > 80:
+        return "High confidence match!"
+    elif similarity_score > 60:
+        return "Good match found"
+    elif similarity_score > 40:
+        return "Possible match - verify manually"
+    else:
+        return "Low confidence - consider manual verification"
+
+
+def transcript_from_chunks(chunks):
+    """
+    Join Whisper chunks into a transcription, pruning unreliable segments when
+    enabled. Returns (transcription, pruning report or None)
+    """
+    if not TRANSCRIPT_PRUNING:
+        return join_transcript(chunks).strip(), None
+    text, report = pruned_transcript(chunk_segments(chunks), join_transcript(chunks))
+    if report["fallback"]:
+        print(f"⚠️ Pruning dropped every segment ({report['dropped']}), using the unpruned transcription")
+    else:
+        print(f"✂️ Transcript pruning: {report}")
+    return text, report
+
+
+# Stage functions: keyword arguments are the stage inputs
+
+def transcribe_text(vocal_path: str):
+    chunks = None
+    if STT_CASCADE or TRANSCRIPT_PRUNING:
+        # Whisper chunks are kept so refine can re-transcribe the weak ones
+        chunks = transcribe_chunks(vocal_path, FAST_MODEL if STT_CASCADE else ACCURATE_MODEL)
+        raw_transcription = transcript_from_chunks(chunks)[0]
+    else:
+        raw_transcription = extract_text(vocal_path).strip()
+    if not raw_transcription:
+        raise ValueError("No lyrics were transcribed.")
+    return raw_transcription, chunks
+
+
+def speculative_search(raw_transcription: str):
+    searched_queries = set()
+    if not SPECULATIVE_SEARCH:
+        return [], searched_queries
+    print("\n🎯 Speculative search on the raw transcription")
+    return dedupe_candidates(search_raw_lines(raw_transcription, searched_queries)), searched_queries
+
+
+def rank_speculative(raw_transcription: str, raw_candidates: List[Dict]) -> List[Dict]:
+    if not raw_candidates:
+        return []
+    return rag_search_with_similarity(query=raw_transcription, search_results=raw_candidates,
+                                      use_full_lyrics_comparison=True)
+
+
+def speculation_settles(outputs: Dict) -> bool:
+    results = outputs["speculative_results"]
+    if top_similarity(results) >= SPECULATIVE_CONFIDENCE:
+        print("🎯 Confident match on the raw transcription, not waiting for the LLM")
+        return True
+    # No budget left for the full search: the raw-text ranking is the best there will be
+    return bool(results) and budget_exhausted()
+
+
+def search_candidates(raw_transcription: str, cleaned_lyrics: str, raw_candidates: List[Dict],
+                      searched_queries: set) -> List[Dict]:
+    if budget_exhausted():
+        return raw_candidates
+    # Queries already run on the raw text are skipped
+    return dedupe_candidates(
+        raw_candidates + comprehensive_search_strategy(raw_transcription, cleaned_lyrics, searched_queries)
+    )
+
+
+def search_cache_key(raw_transcription: str, cleaned_lyrics: str, raw_candidates: List[Dict],
+                     searched_queries: set):
+    return normalize_query(raw_transcription), normalize_query(cleaned_lyrics)
+
+
+def rank_candidates(raw_transcription: str, cleaned_lyrics: str, candidates: List[Dict]) -> List[Dict]:
+    if not candidates:
+        return []
+    print(f"\n🤖 Ranking {len(candidates)} candidates using full transcription similarity...")
+    # The full transcription (raw and cleaned) matches better than either alone
+    return rag_search_with_similarity(query=f"{raw_transcription}\n\n{cleaned_lyrics}".strip(),
+                                      search_results=candidates, use_full_lyrics_comparison=True)
+
+
+def keep_first_pass(vocal_path: str, raw_transcription: str, chunks, cleaned_lyrics: str, results: List[Dict]):
+    return raw_transcription, cleaned_lyrics, results, 0, None
+
+
+def refine_stage(second_pass: Pipeline) -> Stage:
+    """
+    Coarse-to-fine refinement: when the first pass found nothing confident,
+    re-transcribe the low-confidence chunks with the accurate model and run
+    `second_pass` from the refined transcription. Without STT_CASCADE (or
+    Whisper chunks) the first pass is passed through.
+    """
+    def refine(vocal_path: str, raw_transcription: str, chunks, cleaned_lyrics: str, results: List[Dict]):
+        if (not STT_CASCADE or not chunks or budget_exhausted()
+                or top_similarity(results) >= CASCADE_CONFIDENCE):
+            return keep_first_pass(vocal_path, raw_transcription, chunks, cleaned_lyrics, results)
+        with stage_timer("stt_refine"):
+            refined = refine_low_confidence(chunks)
+        if not refined:
+            return keep_first_pass(vocal_path, raw_transcription, chunks, cleaned_lyrics, results)
+        raw_transcription, pruning = transcript_from_chunks(chunks)
+        print(f"🔁 Searching again with the refined transcription ({refined} chunks re-transcribed)")
+        values = second_pass.run({"vocal_path": vocal_path, "raw_transcription": raw_transcription, "chunks": chunks})
+        return raw_transcription, values["cleaned_lyrics"], values["results"], refined, pruning
+
+    return Stage("refine", refine, inputs=("vocal_path", "raw_transcription", "chunks", "cleaned_lyrics", "results"),
+                 outputs={"final_transcription": str, "final_lyrics": str, "final_results": list,
+                          "refined": int, "refine_pruning": (dict, type(None))},
+                 fallback=keep_first_pass)
+
+
+def add_links(final_results: List[Dict]) -> List[Dict]:
+    return enrich_with_links(final_results)
+
+
+search_cache = StageCache("search", SEARCH_CACHE_SIZE)
+
+TRANSCRIBE = Stage("transcribe", transcribe_text, inputs=("vocal_path",),
+                   outputs={"raw_transcription": str, "chunks": (list, type(None))}, timer="stt")
+
+
+def identification_stages(transcribe: Stage = TRANSCRIBE, enrich: bool = False) -> List[Stage]:
+    """
+    The stage graph. `transcribe` must read `vocal_path` and produce
+    `raw_transcription` and `chunks` (Whisper chunks or None); `enrich` adds
+    YouTube/Spotify links (the API serves those separately from GET /links).
+    """
+    stages = [
+        Stage("isolate", isolate_vocals, inputs=("audio_path",), outputs={"vocal_path": str}),
+        transcribe,
+        Stage("clean", clean_transcription, inputs=("raw_transcription",), outputs={"cleaned_lyrics": str},
+              timeout=CLEAN_STAGE_TIMEOUT_SEC, fallback=lambda raw_transcription: raw_transcription),
+        Stage("raw_search", speculative_search, inputs=("raw_transcription",),
+              outputs={"raw_candidates": list, "searched_queries": set}),
+        Stage("speculative_rank", rank_speculative, inputs=("raw_transcription", "raw_candidates"),
+              outputs={"speculative_results": list},
+              fallback=lambda raw_transcription, raw_candidates: raw_candidates,
+              shortcut_if=speculation_settles,
+              shortcut={"results": "speculative_results", "cleaned_lyrics": "raw_transcription"}),
+        # After the speculative ranking so a settled match never starts the full search
+        Stage("search", search_candidates,
+              inputs=("raw_transcription", "cleaned_lyrics", "raw_candidates", "searched_queries"),
+              outputs={"candidates": list}, after=("speculative_rank",),
+              cache=search_cache, cache_key=search_cache_key,
+              fallback=lambda raw_transcription, cleaned_lyrics, raw_candidates, searched_queries: raw_candidates),
+        Stage("rank", rank_candidates, inputs=("raw_transcription", "cleaned_lyrics", "candidates"),
+              outputs={"results": list},
+              fallback=lambda raw_transcription, cleaned_lyrics, candidates: candidates),
+    ]
+    # The refined transcription goes through the same stages once more
+    second_pass = Pipeline(list(stages), inputs={"audio_path": str}, targets=("results", "cleaned_lyrics"))
+    stages.append(refine_stage(second_pass))
+    if enrich:
+        stages.append(Stage("enrich", add_links, inputs=("final_results",), outputs={"linked_results": list},
+                            fallback=lambda final_results: final_results))
+    return stages
+
+
+def identification_pipeline(transcribe: Stage = TRANSCRIBE, enrich: bool = False) -> Pipeline:
+    """
+    Pipeline from an uploaded file (`audio_path`) to ranked `final_results`,
+    `final_lyrics` and `final_transcription` (after any refinement).
+    """
+    targets = ("linked_results" if enrich else "final_results", "final_lyrics", "final_transcription")
+    return Pipeline(identification_stages(transcribe, enrich), inputs={"audio_path": str}, targets=targets)
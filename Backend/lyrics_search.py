@@ -1,23 +1,39 @@
-import lyricsgenius
 import os
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
 from search_songs import search_genius_by_lyrics_scrape, extract_key_phrases, search_multiple_strategies
+from request_budget import spend_call, budget_exhausted, BudgetExhausted
+from candidate_tracker import CandidateTracker
+from metrics import upstream_call
+from tracing import traced, set_attributes
 
 # Use environment variable for API token
 GENIUS_TOKEN = os.getenv('GENIUS_TOKEN', "")
 
-# Initialize Genius client with better settings
-genius = lyricsgenius.Genius(
-    GENIUS_TOKEN, 
-    skip_non_songs=True, 
-    excluded_terms=["(Remix)", "(Live)", "(Acoustic)", "(Demo)", "Script", "Annotated", "Interview"],
-    remove_section_headers=True,
-    timeout=15
-)
+_genius = None
+_genius_lock = threading.Lock()
 
-def search_by_lyrics_api_enhanced(lyrics_snippet: str, max_results: int = 8) -> List[Dict]:
+
+def get_genius():
+    """Genius client with better settings, created on first use."""
+    global _genius
+    with _genius_lock:
+        if _genius is None:
+            import lyricsgenius
+            _genius = lyricsgenius.Genius(
+                GENIUS_TOKEN, 
+                skip_non_songs=True, 
+                excluded_terms=["(Remix)", "(Live)", "(Acoustic)", "(Demo)", "Script", "Annotated", "Interview"],
+                remove_section_headers=True,
+                timeout=15
+            )
+    return _genius
+
+def search_by_lyrics_api_enhanced(lyrics_snippet: str, max_results: int = 8,
+                                  tracker: Optional[CandidateTracker] = None) -> List[Dict]:
     """
-    Enhanced API search with better term selection and error handling
+    Enhanced API search with better term selection and error handling.
+    Stops trying further terms once `tracker` has a clear leader.
     """
     results = []
     
@@ -51,8 +67,12 @@ def search_by_lyrics_api_enhanced(lyrics_snippet: str, max_results: int = 8) ->
             try:
                 print(f"   📡 API search {i+1}: '{term[:40]}{'...' if len(term) > 40 else ''}'")
                 
-                search_result = genius.search_songs(term, per_page=min(max_results, 10))
+                spend_call("genius_api")
+                with upstream_call("genius_api") as call:
+                    search_result = get_genius().search_songs(term, per_page=min(max_results, 10))
+                    call.outcome = "hit" if search_result and search_result.get('hits') else "miss"
                 
+                term_results = []
                 if search_result and 'hits' in search_result:
                     for hit in search_result['hits']:
                         result = hit['result']
@@ -74,14 +94,25 @@ def search_by_lyrics_api_enhanced(lyrics_snippet: str, max_results: int = 8) ->
                             "api_confidence": hit.get('highlights', []) != []  # Has highlights = better match
                         }
                         
+                        term_results.append(song_info)
                         # Avoid duplicates
                         if not any(r['genius_url'] == song_info['genius_url'] for r in results):
                             results.append(song_info)
                 
+                # Score every term's results, including the one that fills the list
+                if tracker is not None:
+                    tracker.add(term_results, term)
+                    if tracker.decided():
+                        print(f"   🎯 Clear leader after {i+1} API searches: {tracker.summary()}")
+                        break
+                
                 # If we got some good results early, we can be less aggressive
                 if len(results) >= max_results:
                     break
                     
+            except BudgetExhausted:
+                print("   ⏱️ Request budget exhausted, stopping API search")
+                break
             except Exception as e:
                 print(f"   ⚠️ API error with term '{term[:30]}...': {e}")
                 continue
@@ -92,7 +123,8 @@ def search_by_lyrics_api_enhanced(lyrics_snippet: str, max_results: int = 8) ->
     print(f"   ✅ API found {len(results)} results")
     return results
 
-def search_by_lyrics_scrape_enhanced(lyrics_snippet: str, max_results: int = 8) -> List[Dict]:
+def search_by_lyrics_scrape_enhanced(lyrics_snippet: str, max_results: int = 8,
+                                     tracker: Optional[CandidateTracker] = None) -> List[Dict]:
     """
     Enhanced scraping search using multiple strategies
     """
@@ -100,7 +132,7 @@ def search_by_lyrics_scrape_enhanced(lyrics_snippet: str, max_results: int = 8)
     
     try:
         # Use the multi-strategy search from search_songs.py
-        results = search_multiple_strategies(lyrics_snippet, max_results_per_strategy=3)
+        results = search_multiple_strategies(lyrics_snippet, max_results_per_strategy=3, tracker=tracker)
         
         # Convert to consistent format
         formatted_results = []
@@ -132,23 +164,29 @@ def search_by_lyrics_scrape_enhanced(lyrics_snippet: str, max_results: int = 8)
         print(f"⚠️ Enhanced scraping error: {e}")
         return []
 
+@traced("search_by_lyrics")
 def search_by_lyrics(lyrics_snippet: str, max_results: int = 10) -> List[Dict]:
     """
     Enhanced combined search function with better strategy coordination
     """
+    set_attributes(snippet=lyrics_snippet[:80], max_results=max_results)
     print(f"🔍 Enhanced search for: '{lyrics_snippet[:60]}{'...' if len(lyrics_snippet) > 60 else ''}'")
     
     all_results = []
+    if budget_exhausted():
+        print("⏱️ Request budget exhausted, skipping search")
+        return all_results
+    tracker = CandidateTracker(lyrics_snippet)
     
     # Strategy 1: Try API first (faster, more reliable when it works)
     print("📡 Trying Genius API...")
-    api_results = search_by_lyrics_api_enhanced(lyrics_snippet, max_results // 2)
+    api_results = search_by_lyrics_api_enhanced(lyrics_snippet, max_results // 2, tracker)
     all_results.extend(api_results)
     
-    # Strategy 2: Enhanced scraping (more comprehensive)
-    if len(api_results) < max_results // 2:
+    # Strategy 2: Enhanced scraping (more comprehensive), unless the API already agrees on a song
+    if len(api_results) < max_results // 2 and not budget_exhausted() and not tracker.decided():
         print("🕷️ Complementing with enhanced web scraping...")
-        scrape_results = search_by_lyrics_scrape_enhanced(lyrics_snippet, max_results - len(api_results))
+        scrape_results = search_by_lyrics_scrape_enhanced(lyrics_snippet, max_results - len(api_results), tracker)
         
         # Merge results, avoiding duplicates
         for result in scrape_results:
@@ -156,7 +194,7 @@ def search_by_lyrics(lyrics_snippet: str, max_results: int = 10) -> List[Dict]:
                 all_results.append(result)
     
     # Strategy 3: If still not enough results, try fallback methods
-    if len(all_results) < 3:
+    if len(all_results) < 3 and not budget_exhausted() and not tracker.decided():
         print("🔄 Trying fallback search methods...")
         
         # Try with individual distinctive lines
@@ -212,7 +250,7 @@ def get_song_lyrics(song_url: str) -> str:
     try:
         # Extract song ID from URL
         song_id = song_url.split('/')[-1].replace('-lyrics', '')
-        song = genius.song(song_id)
+        song = get_genius().song(song_id)
         return song.lyrics if song else ""
     except Exception as e:
         print(f"⚠️ Error getting lyrics from {song_url}: {e}")
@@ -0,0 +1,226 @@
+"""
+In-process metrics exposed in the Prometheus text format (GET /metrics).
+
+  * musefinder_stage_seconds: latency histogram per pipeline stage
+    (isolation, stt, llm_clean, search, lyrics_fetch, ranking, enrichment);
+  * musefinder_upstream_calls_total / musefinder_upstream_seconds: outbound
+    calls by upstream and outcome (hit, miss, captcha, timeout, error);
+  * musefinder_cache_requests_total: cache lookups by cache and result;
+  * gauges registered by the app (queue depth, heavy stage slots, model and
+    process memory), computed only when /metrics is scraped.
+
+Recording is a lock, a bisect and a couple of additions, so it stays on in
+the hot path. Stage timers and upstream calls also open a tracing span. Values are per process: with the pre-fork server each worker
+reports its own, so scrape the workers individually or sum per worker.
+"""
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from tracing import span
+
+PREFIX = "musefinder_"
+# Pipeline stages run from tens of milliseconds (cached lookups) to minutes (separation)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 15, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Computed at scrape time by `fn`, which returns a number or {label values: number}."""
+
+    def __init__(self, name: str, help_text: str, fn: Callable, labels: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            values = self.fn()
+        except Exception as e:
+            return [f"# {self.name} unavailable: {e}".replace("\n", " ")]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in sorted(values.items()):
+            if value is None:
+                continue
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("stage_seconds", "Latency of each pipeline stage", ("stage",))
+STAGE_ERRORS = Counter("stage_errors_total", "Pipeline stages that raised", ("stage",))
+UPSTREAM_CALLS = Counter("upstream_calls_total", "Outbound calls by upstream and outcome", ("upstream", "outcome"))
+UPSTREAM_SECONDS = Histogram("upstream_seconds", "Latency of outbound calls", ("upstream",), UPSTREAM_BUCKETS)
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache and result", ("cache", "result"))
+REQUESTS = Counter("requests_total", "Identification requests by outcome", ("outcome",))
+
+_metrics: list = [STAGE_SECONDS, STAGE_ERRORS, UPSTREAM_CALLS, UPSTREAM_SECONDS, CACHE_REQUESTS, REQUESTS]
+
+
+def register_gauge(name: str, help_text: str, fn: Callable, labels: Sequence[str] = ()) -> None:
+    _metrics.append(Gauge(name, help_text, fn, labels))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def timed_stage(stage: str):
+    """Decorator form of stage_timer."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _UpstreamCall:
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = "hit"
+
+
+def classify_error(error: BaseException) -> str:
+    # requests, httpx and the builtin all name their timeout exceptions *Timeout*
+    if "Timeout" in type(error).__name__:
+        return "timeout"
+    # CallCancelled (hedging loser) and asyncio.CancelledError
+    if "Cancelled" in type(error).__name__:
+        return "cancelled"
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return "rate_limited"
+    return "error"
+
+
+@contextmanager
+def upstream_call(upstream: str):
+    """
+    Time one outbound call. Set `.outcome` ("hit", "miss", "captcha", ...)
+    inside the block; exceptions are counted as "timeout", "cancelled" or "error".
+    """
+    call = _UpstreamCall()
+    start = time.perf_counter()
+    with span(f"upstream:{upstream}") as current:
+        try:
+            yield call
+        except BaseException as e:
+            call.outcome = classify_error(e)
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream)
+            UPSTREAM_CALLS.inc(upstream, call.outcome)
+            if current is not None:
+                current.set(outcome=call.outcome)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def process_memory() -> Optional[Dict[Tuple, int]]:
+    """Resident and shared memory of this process in bytes (Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(v) for v in f.read().split()[:3])
+    except OSError:
+        return None
+    import resource
+    page = resource.getpagesize()
+    return {("resident",): resident * page, ("shared",): shared * page}
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,7 @@
 from pydub import AudioSegment
+import io
 import os
+import wave
 
 def mp3_to_wav(mp3_path):
     wav_path = os.path.splitext(mp3_path)[0] + ".wav"
@@ -8,3 +10,22 @@ def mp3_to_wav(mp3_path):
     audio.export(wav_path, format="wav", codec="pcm_s16le")
     return wav_path
 
+def decode_pcm16(path, sample_rate=44100):
+    """
+    Decode any ffmpeg-readable file to raw PCM 16-bit mono bytes in memory.
+    """
+    audio = AudioSegment.from_file(path)
+    audio = audio.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+    return audio.raw_data
+
+def pcm16_to_wav_bytes(pcm, sample_rate=44100):
+    """
+    Wrap raw PCM 16-bit mono bytes in a WAV header without touching disk.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return buffer.getvalue()
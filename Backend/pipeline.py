@@ -0,0 +1,321 @@
+"""
+A small stage-graph engine for the identification pipeline.
+
+Each Stage declares the named values it reads (`inputs`) and the typed
+values it produces (`outputs`). A Pipeline is built from stages plus the
+values callers supply and the `targets` they want back; it checks the graph
+once (every input has exactly one producer, no cycles) and then, per run,
+starts each stage as soon as its inputs exist, so independent stages overlap
+on a thread pool. Only stages that lead to a missing target are run, which
+lets a caller resume from any intermediate value (e.g. re-search a refined
+transcription without isolating or transcribing again).
+
+Per stage, optionally:
+  * timeout: the stage is abandoned after this many seconds (capped to the
+    request budget) and its fallback used;
+  * fallback: called with the same inputs when the stage raises or times
+    out; without one the run fails with PipelineError;
+  * cache: a StageCache looked up with cache_key(**inputs) before running;
+  * shortcut_if / shortcut: when the predicate holds for the stage's
+    outputs, the mapped values not produced yet are published as other
+    stages' outputs (e.g. a confident speculative ranking becomes the final
+    `results`), and the stages that would have produced them are skipped or
+    abandoned;
+  * timer: the metrics stage name to record the run under. Every stage runs
+    in a tracing span either way.
+
+Callers observe a run through `on_event`, which receives dicts with `stage`,
+`status` (started, finished, cached, failed, timed_out, shortcut, skipped,
+abandoned), `elapsed_sec`, and `outputs` or `error` where relevant. Events
+are delivered on the thread that called run(), in order.
+"""
+import os
+import copy
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from metrics import stage_timer, record_cache
+from tracing import span
+from request_budget import propagate, budget_exhausted, call_timeout
+
+# Threads per run: enough for the stages that overlap plus ones left running after a timeout
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "4"))
+
+
+class PipelineError(RuntimeError):
+    """A stage failed (raised, timed out or returned the wrong type) and had no fallback."""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class StageCache:
+    """Thread-safe LRU of stage outputs, reported under `name` in musefinder_cache_requests_total."""
+
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            outputs = self._entries.get(key)
+            if outputs is not None:
+                self._entries.move_to_end(key)
+        record_cache(self.name, outputs is not None)
+        # Copies, so callers can mutate what they get back
+        return copy.deepcopy(outputs) if outputs is not None else None
+
+    def put(self, key, outputs: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = copy.deepcopy(outputs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class Stage:
+    """
+    One step of a pipeline. `fn` is called with the values named in `inputs`
+    as keyword arguments and returns its single output, or a tuple with one
+    value per output in declaration order. `outputs` maps each name to a type
+    (or tuple of types) that the value is checked against. `after` names
+    stages that must finish first without passing a value.
+    """
+
+    def __init__(self, name: str, fn: Callable, inputs: Sequence[str] = (), outputs: Dict[str, Any] = None,
+                 after: Sequence[str] = (), timeout: Optional[float] = None, fallback: Optional[Callable] = None,
+                 cache: Optional[StageCache] = None, cache_key: Optional[Callable] = None,
+                 shortcut_if: Optional[Callable] = None, shortcut: Dict[str, str] = None,
+                 timer: Optional[str] = None):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = dict(outputs or {})
+        self.after = tuple(after)
+        self.timeout = timeout
+        self.fallback = fallback
+        self.cache = cache
+        self.cache_key = cache_key
+        self.shortcut_if = shortcut_if
+        self.shortcut = dict(shortcut or {})
+        self.timer = timer
+        if not self.outputs:
+            raise ValueError(f"Stage '{name}' declares no outputs")
+        if cache is not None and cache_key is None:
+            raise ValueError(f"Stage '{name}' has a cache but no cache_key")
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name}: {', '.join(self.inputs)} -> {', '.join(self.outputs)})"
+
+    def collect(self, result) -> Dict[str, Any]:
+        """Map what `fn` (or the fallback) returned to named outputs, checking their types."""
+        names = list(self.outputs)
+        if len(names) == 1:
+            result = (result,)
+        if not isinstance(result, tuple) or len(result) != len(names):
+            raise TypeError(f"expected {len(names)} outputs ({', '.join(names)}), got {type(result).__name__}")
+        outputs = dict(zip(names, result))
+        for name, value in outputs.items():
+            if not isinstance(value, self.outputs[name]):
+                raise TypeError(f"output '{name}' is {type(value).__name__}, expected {_type_name(self.outputs[name])}")
+        return outputs
+
+    def execute(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Run the stage in its span (and metrics timer), on the calling thread."""
+        with (stage_timer(self.timer) if self.timer else span(f"stage:{self.name}")):
+            return self.collect(self.fn(**inputs))
+
+
+def _type_name(types) -> str:
+    if isinstance(types, tuple):
+        return " | ".join(t.__name__ for t in types)
+    return types.__name__
+
+
+class Pipeline:
+    def __init__(self, stages: Iterable[Stage], inputs: Dict[str, Any], targets: Sequence[str],
+                 workers: int = PIPELINE_WORKERS):
+        self.stages: List[Stage] = list(stages)
+        self.inputs = dict(inputs)
+        self.targets = tuple(targets)
+        self.workers = max(1, workers)
+        self.by_name: Dict[str, Stage] = {}
+        self.producers: Dict[str, Stage] = {}
+        self.types: Dict[str, Any] = dict(self.inputs)
+        for stage in self.stages:
+            if stage.name in self.by_name:
+                raise ValueError(f"Duplicate stage '{stage.name}'")
+            self.by_name[stage.name] = stage
+            for name, types in stage.outputs.items():
+                if name in self.producers or name in self.inputs:
+                    raise ValueError(f"'{name}' is produced by more than one stage")
+                self.producers[name] = stage
+                self.types[name] = types
+        self._validate()
+
+    def _validate(self) -> None:
+        for stage in self.stages:
+            for name in stage.inputs:
+                if name not in self.types:
+                    raise ValueError(f"Stage '{stage.name}' reads '{name}', which nothing provides")
+            for name in stage.after:
+                if name not in self.by_name:
+                    raise ValueError(f"Stage '{stage.name}' runs after unknown stage '{name}'")
+            for target, source in stage.shortcut.items():
+                if target not in self.types or source not in self.types:
+                    raise ValueError(f"Stage '{stage.name}' has a shortcut between unknown values")
+        for target in self.targets:
+            if target not in self.types:
+                raise ValueError(f"Target '{target}' is not produced by any stage")
+        # Depth-first search for cycles through inputs and `after`
+        state: Dict[str, int] = {}
+
+        def visit(stage: Stage) -> None:
+            if state.get(stage.name) == 2:
+                return
+            if state.get(stage.name) == 1:
+                raise ValueError(f"Stage graph has a cycle through '{stage.name}'")
+            state[stage.name] = 1
+            for upstream in self._upstream(stage):
+                visit(upstream)
+            state[stage.name] = 2
+
+        for stage in self.stages:
+            visit(stage)
+
+    def _upstream(self, stage: Stage) -> List[Stage]:
+        upstream = [self.producers[name] for name in stage.inputs if name in self.producers]
+        return upstream + [self.by_name[name] for name in stage.after]
+
+    def _needed(self, values: Dict[str, Any], done: set) -> set:
+        """Names of the stages that still have to run to produce the missing targets."""
+        needed = set()
+        todo = [self.producers[name] for name in self.targets if name not in values and name in self.producers]
+        while todo:
+            stage = todo.pop()
+            if stage.name in needed or stage.name in done or all(name in values for name in stage.outputs):
+                continue
+            needed.add(stage.name)
+            todo.extend(self.producers[name] for name in stage.inputs if name not in values and name in self.producers)
+            todo.extend(self.by_name[name] for name in stage.after)
+        return needed
+
+    def _ready(self, stage: Stage, values: Dict[str, Any], done: set) -> bool:
+        return (all(name in values for name in stage.inputs)
+                and all(name in done or all(o in values for o in self.by_name[name].outputs) for name in stage.after))
+
+    def run(self, values: Dict[str, Any], on_event: Optional[Callable[[Dict], None]] = None) -> Dict[str, Any]:
+        """
+        Run the stages needed for the targets, starting from `values` (the
+        pipeline inputs, or any intermediate values to resume from). Returns
+        all values produced. Raises PipelineError if a stage without a
+        fallback fails.
+        """
+        values = dict(values)
+        for name, value in values.items():
+            if name in self.types and not isinstance(value, self.types[name]):
+                raise TypeError(f"'{name}' is {type(value).__name__}, expected {_type_name(self.types[name])}")
+        emit = on_event or (lambda event: None)
+        done: set = set()
+        running: Dict[Any, tuple] = {}  # future -> (stage, inputs, started, deadline)
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pipeline")
+
+        def complete(stage: Stage, outputs: Dict[str, Any], status: str, started: float, **details) -> None:
+            done.add(stage.name)
+            values.update(outputs)
+            emit({"stage": stage.name, "status": status, "elapsed_sec": round(time.monotonic() - started, 3),
+                  "outputs": outputs, **details})
+            if stage.shortcut_if is not None and stage.shortcut_if(outputs):
+                # Values a stage already produced (e.g. cleaning finished first) are kept
+                provided = {target: values[source] for target, source in stage.shortcut.items() if target not in values}
+                values.update(provided)
+                emit({"stage": stage.name, "status": "shortcut", "provides": list(provided), "outputs": outputs})
+
+        def recover(stage: Stage, inputs: Dict[str, Any], error: BaseException, started: float, status: str) -> None:
+            if stage.fallback is None:
+                raise PipelineError(stage.name, error)
+            print(f"⚠️ Stage {stage.name} {status.replace('_', ' ')} ({error}), using its fallback")
+            try:
+                outputs = stage.collect(stage.fallback(**inputs))
+            except Exception as e:
+                raise PipelineError(stage.name, e) from e
+            complete(stage, outputs, status, started, error=str(error))
+
+        try:
+            while True:
+                needed = self._needed(values, done)
+                # Work nobody needs any more (e.g. after a shortcut) is left to finish in the background
+                for future, (stage, _, started, _) in list(running.items()):
+                    if stage.name not in needed:
+                        del running[future]
+                        done.add(stage.name)
+                        emit({"stage": stage.name, "status": "abandoned",
+                              "elapsed_sec": round(time.monotonic() - started, 3)})
+                running_names = {stage.name for stage, _, _, _ in running.values()}
+                rescan = False
+                for stage in self.stages:
+                    if (stage.name not in needed or stage.name in running_names
+                            or not self._ready(stage, values, done)):
+                        continue
+                    inputs = {name: values[name] for name in stage.inputs}
+                    started = time.monotonic()
+                    emit({"stage": stage.name, "status": "started"})
+                    if stage.cache is not None:
+                        key = stage.cache_key(**inputs)
+                        cached = stage.cache.get(key) if key is not None else None
+                        if cached is not None:
+                            complete(stage, cached, "cached", started)
+                            # The hit may have made more stages ready, or shortcut others
+                            rescan = True
+                            break
+                    timeout = call_timeout(stage.timeout) if stage.timeout else None
+                    future = executor.submit(propagate(stage.execute), inputs)
+                    running[future] = (stage, inputs, started, started + timeout if timeout else None)
+                    running_names.add(stage.name)
+                if rescan:
+                    continue
+                if not running:
+                    break
+
+                deadlines = [deadline for _, _, _, deadline in running.values() if deadline is not None]
+                wait_sec = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                finished, _ = wait(list(running), timeout=wait_sec, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage, inputs, started, _ = running.pop(future)
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        recover(stage, inputs, e, started, "failed")
+                        continue
+                    complete(stage, outputs, "finished", started)
+                    if stage.cache is not None and not budget_exhausted():
+                        # A stage cut short by the request budget is not worth remembering
+                        key = stage.cache_key(**inputs)
+                        if key is not None:
+                            stage.cache.put(key, outputs)
+                now = time.monotonic()
+                for future, (stage, inputs, started, deadline) in list(running.items()):
+                    if deadline is not None and now >= deadline and not future.done():
+                        del running[future]
+                        recover(stage, inputs, TimeoutError(f"no result after {deadline - started:.1f}s"),
+                                started, "timed_out")
+        finally:
+            # Running stages are not interrupted; stages not yet started are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        missing = [name for name in self.targets if name not in values]
+        if missing:
+            raise PipelineError("pipeline", RuntimeError(f"no stage produced {', '.join(missing)}"))
+        for stage in self.stages:
+            if stage.name not in done and not all(name in values for name in stage.outputs):
+                emit({"stage": stage.name, "status": "skipped"})
+        return values
@@ -0,0 +1,180 @@
+"""
+Pre-fork serving: load the models once and fork workers that share them.
+
+    python prefork_server.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+
+The master imports the app, loads the Whisper and MiniLM weights, runs one
+dummy inference on each and freezes the GC. It then binds the port and
+forks PREFORK_WORKERS uvicorn workers. Weights are never written after
+loading, so workers share their pages copy-on-write instead of each holding
+a copy. Each worker exits after PREFORK_MAX_JOBS requests and the master
+forks a fresh one from the same warm image.
+
+The cores are divided by cpu_scheduler before torch is imported: heavy
+stages are limited across all workers and, with CPU_PINNING, each worker
+gets its own core set.
+
+TensorFlow (Spleeter) is not preloaded because its thread pools do not
+survive fork; each worker loads Spleeter on first use. Whisper process pools
+(WHISPER_WORKERS > 1) are spawned by each worker and load their own models.
+"""
+import os
+import gc
+import sys
+import time
+import random
+import signal
+import socket
+import argparse
+from typing import Dict
+
+PREFORK_WORKERS = int(os.getenv("PREFORK_WORKERS", "2"))
+# Recycle a worker after this many requests (0 = never)
+PREFORK_MAX_JOBS = int(os.getenv("PREFORK_MAX_JOBS", "200"))
+PREFORK_REPORT_SEC = float(os.getenv("PREFORK_REPORT_SEC", "60"))
+
+SMAPS_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memory_report(pid: int) -> Dict[str, int]:
+    """Resident memory of a process in kB, split into shared and private pages."""
+    usage = dict.fromkeys(SMAPS_FIELDS, 0)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in usage:
+                    usage[name] = int(value.split()[0])
+    except OSError:
+        pass
+    usage["Shared"] = usage["Shared_Clean"] + usage["Shared_Dirty"]
+    usage["Private"] = usage["Private_Clean"] + usage["Private_Dirty"]
+    return usage
+
+
+def print_memory_report(master_pid: int, workers: Dict[int, float]) -> None:
+    print("📊 Memory (MB)      rss   shared  private      pss")
+    total_rss = total_pss = 0
+    for label, pid in [("master", master_pid)] + [(f"worker {pid}", pid) for pid in workers]:
+        usage = memory_report(pid)
+        total_rss += usage["Rss"]
+        total_pss += usage["Pss"]
+        print(f"   {label:<14} {usage['Rss'] / 1024:7.0f} {usage['Shared'] / 1024:8.0f} "
+              f"{usage['Private'] / 1024:8.0f} {usage['Pss'] / 1024:8.0f}")
+    # PSS splits shared pages between their users, so it adds up to real usage
+    print(f"   total: {total_pss / 1024:.0f} MB actually used vs {total_rss / 1024:.0f} MB summed RSS")
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, index: int) -> None:
+    import uvicorn
+    from cpu_scheduler import configure_worker
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    configure_worker(index)
+    # Jitter so workers started together are not all recycled at the same moment
+    max_jobs = PREFORK_MAX_JOBS + random.randint(0, PREFORK_MAX_JOBS // 10) if PREFORK_MAX_JOBS else None
+    config = uvicorn.Config(app, limit_max_requests=max_jobs, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from pre-forked workers sharing loaded models")
+    parser.add_argument("--workers", type=int, default=PREFORK_WORKERS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    from cpu_scheduler import configure_process, reclaim_worker_slots
+    configure_process(args.workers)
+
+    import torch
+    # Warm up single-threaded: an OpenMP pool started before fork hangs in the children
+    torch.set_num_threads(1)
+
+    print("🧠 Loading and warming models in the master process...")
+    start = time.perf_counter()
+    from api import app, warm_up_models, warmup_state
+    warm_up_models(include_spleeter=False)
+    if warmup_state["error"]:
+        print(f"⚠️ Warm-up failed, workers will load models on first use: {warmup_state['error']}")
+    else:
+        print(f"✅ Models ready in {time.perf_counter() - start:.1f}s")
+
+    # Move everything loaded so far out of the GC's reach so collections in the
+    # workers do not write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port)
+    master_pid = os.getpid()
+    workers: Dict[int, float] = {}
+    worker_index: Dict[int, int] = {}
+    running = True
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock, index)
+            finally:
+                os._exit(0)
+        workers[pid] = time.time()
+        worker_index[pid] = index
+        print(f"👷 Started worker {pid} (#{index})")
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"🚀 Serving on http://{args.host}:{args.port} with {args.workers} workers "
+          f"(recycled every {PREFORK_MAX_JOBS or '∞'} requests)")
+    for index in range(args.workers):
+        spawn(index)
+
+    last_report = time.time()
+    while running:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in workers:
+            uptime = time.time() - workers.pop(pid)
+            print(f"♻️ Worker {pid} exited after {uptime:.0f}s (status {status}), replacing it")
+            index = worker_index.pop(pid)
+            reclaim_worker_slots(index)
+            spawn(index)
+            continue
+        if PREFORK_REPORT_SEC > 0 and time.time() - last_report >= PREFORK_REPORT_SEC:
+            print_memory_report(master_pid, workers)
+            last_report = time.time()
+        time.sleep(0.5)
+
+    print("🛑 Shutting down workers...")
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in list(workers):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
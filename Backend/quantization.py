@@ -0,0 +1,33 @@
+import os
+
+# Per-model inference mode: "fp32" (default) or "int8" (dynamic quantisation of Linear layers)
+WHISPER_INFERENCE = os.getenv("WHISPER_INFERENCE", "fp32").lower()
+EMBEDDING_INFERENCE = os.getenv("EMBEDDING_INFERENCE", "fp32").lower()
+
+INFERENCE_MODES = ("fp32", "int8")
+
+
+def quantize_linear_layers(model):
+    """
+    Dynamically quantise every Linear layer to int8 for CPU inference.
+
+    Weights are stored as int8 and activations are quantised on the fly, so
+    no calibration data is needed. Subclasses of nn.Linear (Whisper wraps it
+    to cast dtypes) are treated as plain nn.Linear, which is equivalent on CPU.
+    """
+    import torch
+
+    for module in model.modules():
+        if isinstance(module, torch.nn.Linear) and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def apply_inference_mode(model, mode: str):
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}', expected one of {INFERENCE_MODES}")
+    if mode == "int8":
+        print("⚙️ Quantising Linear layers to int8...")
+        return quantize_linear_layers(model)
+    return model
@@ -1,36 +1,96 @@
 from typing import List, Dict, Optional
-from sentence_transformers import SentenceTransformer
-from scipy.spatial.distance import cosine
 import urllib.parse
 import re
 import requests
-from bs4 import BeautifulSoup
+from html_extract import extract_lyrics
+import os
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from quantization import apply_inference_mode, EMBEDDING_INFERENCE
+from cpu_scheduler import heavy_stage
+from metrics import upstream_call, timed_stage, record_cache
+from tracing import set_attributes
+from request_budget import spend_call, call_timeout, budget_exhausted, propagate, BudgetExhausted
 
-# Load embedding model once
-try:
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    print("✅ Sentence transformer model loaded successfully")
-except Exception as e:
-    print(f"❌ Failed to load sentence transformer: {e}")
-    model = None
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
 
-# Try importing YouTube search with fallback
-try:
-    from youtubesearchpython import VideosSearch
-    YOUTUBE_AVAILABLE = True
-except ImportError:
-    print("⚠️ youtubesearchpython not available. YouTube links will be generated as search URLs.")
-    YOUTUBE_AVAILABLE = False
+# Candidate lyrics are fetched in the background as soon as search finds them,
+# so ranking mostly reads lyrics that are already in memory
+LYRICS_PREFETCH_WORKERS = int(os.getenv("LYRICS_PREFETCH_WORKERS", "4"))
+LYRICS_CACHE_SIZE = int(os.getenv("LYRICS_CACHE_SIZE", "256"))
+# Streaming links are looked up off the critical path (GET /links) and cached
+LINKS_CONCURRENCY = int(os.getenv("LINKS_CONCURRENCY", "5"))
+LINKS_CACHE_SIZE = int(os.getenv("LINKS_CACHE_SIZE", "512"))
+
+_lyrics_executor = ThreadPoolExecutor(max_workers=LYRICS_PREFETCH_WORKERS, thread_name_prefix="lyrics-prefetch")
+_lyrics_futures = OrderedDict()
+_lyrics_lock = threading.Lock()
+_links_cache = OrderedDict()
+_links_lock = threading.Lock()
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+_videos_search = None
+
+
+def load_embedding_model(mode: str = EMBEDDING_INFERENCE):
+    """Load the sentence transformer in the given inference mode ('fp32' or 'int8')."""
+    from sentence_transformers import SentenceTransformer
+
+    device = 'cpu' if mode != 'fp32' else None
+    return apply_inference_mode(SentenceTransformer(EMBEDDING_MODEL_NAME, device=device), mode)
+
+
+def get_model():
+    """The embedding model, loaded on first use (None if it failed to load)."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                try:
+                    _model = load_embedding_model()
+                    print(f"✅ Sentence transformer model loaded successfully ({EMBEDDING_INFERENCE})")
+                except Exception as e:
+                    print(f"❌ Failed to load sentence transformer: {e}")
+                    _model = None
+                _model_loaded = True
+    return _model
+
+
+def loaded_embedding_model():
+    """The embedding model if it has been loaded, without loading it."""
+    return _model
+
+
+def get_videos_search():
+    """youtubesearchpython's VideosSearch, imported on first use (None if unavailable)."""
+    global _videos_search
+    if _videos_search is None:
+        try:
+            from youtubesearchpython import VideosSearch
+            _videos_search = VideosSearch
+        except ImportError:
+            print("⚠️ youtubesearchpython not available. YouTube links will be generated as search URLs.")
+            _videos_search = False
+    return _videos_search or None
+
+
+def cosine(u, v) -> float:
+    """Cosine distance, as scipy.spatial.distance.cosine."""
+    return 1.0 - float(np.dot(u, v) / (np.linalg.norm(u) * np.linalg.norm(v)))
 
 
 def encode(text: str):
     """Encodes a string into a dense vector using SentenceTransformer."""
+    model = get_model()
     if model is None:
         return None
     try:
-        return model.encode(text, convert_to_numpy=True)
+        with heavy_stage("embedding"):
+            return model.encode(text, convert_to_numpy=True)
     except Exception as e:
         print(f"⚠️ Encoding error: {e}")
         return None
@@ -95,12 +155,14 @@ def parse_genius_url(url: str) -> tuple:
     return None, None
 
 
+@timed_stage("lyrics_fetch")
 def get_lyrics_from_genius(url: str, max_retries: int = 2) -> str:
     """
     Enhanced lyrics scraping with better error handling and retry logic.
     """
     if not url:
         return ""
+    set_attributes(url=url)
         
     for attempt in range(max_retries):
         try:
@@ -112,43 +174,19 @@ def get_lyrics_from_genius(url: str, max_retries: int = 2) -> str:
                 'Connection': 'keep-alive',
             }
             
-            response = requests.get(url, headers=headers, timeout=15)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Enhanced selectors for lyrics (Genius updates their CSS frequently)
-            lyrics_selectors = [
-                '[data-lyrics-container="true"]',
-                '.lyrics',
-                '.Lyrics__Container-sc-1ynbvzw-6',
-                '.LyricsBody__Container-sc-1ynbvzw-6',
-                '[class*="lyrics"]',
-                '[class*="Lyrics"]',
-                '[class*="LyricsBody"]',
-                '.song_body-lyrics p',
-                '.verse, .chorus, .bridge'
-            ]
-            
-            lyrics_text = ""
-            for selector in lyrics_selectors:
-                lyrics_elements = soup.select(selector)
-                if lyrics_elements:
-                    for element in lyrics_elements:
-                        # Better text extraction preserving structure
-                        text = element.get_text(separator='\n', strip=True)
-                        if text and len(text) > 50:
-                            lyrics_text += text + "\n"
-                    if lyrics_text:
-                        break
-            
+            spend_call("genius_lyrics")
+            with upstream_call("genius_lyrics") as call:
+                response = requests.get(url, headers=headers, timeout=call_timeout(15))
+                response.raise_for_status()
+                
+                # Only the lyrics containers are parsed; old layouts fall back to BeautifulSoup
+                lyrics_text = extract_lyrics(response.text)
+                call.outcome = "hit" if lyrics_text else "miss"
             if lyrics_text:
-                # Clean up the lyrics text
-                lyrics_text = re.sub(r'\n+', '\n', lyrics_text)
-                lyrics_text = re.sub(r'\[.*?\]', '', lyrics_text)
-                lyrics_text = re.sub(r'\s+', ' ', lyrics_text.strip())
-                return lyrics_text[:1500]
+                return lyrics_text
                 
+        except BudgetExhausted:
+            break
         except requests.exceptions.Timeout:
             print(f"⚠️ Timeout getting lyrics from {url} (attempt {attempt + 1})")
             time.sleep(1)
@@ -162,13 +200,67 @@ def get_lyrics_from_genius(url: str, max_retries: int = 2) -> str:
     return ""
 
 
+def canonical_genius_url(url: str) -> str:
+    """Key that treats http/https, www, case, query strings and trailing slashes as the same page."""
+    url = url.strip().split('?')[0].split('#')[0].rstrip('/').lower()
+    return re.sub(r'^https?://(www\.)?', 'https://', url)
+
+
+def _lyrics_future(url: str, start: bool = True):
+    key = canonical_genius_url(url)
+    with _lyrics_lock:
+        future = _lyrics_futures.get(key)
+        if future is not None:
+            _lyrics_futures.move_to_end(key)
+            return future
+        if not start:
+            return None
+        future = _lyrics_executor.submit(propagate(get_lyrics_from_genius), url)
+        _lyrics_futures[key] = future
+        while len(_lyrics_futures) > LYRICS_CACHE_SIZE:
+            _lyrics_futures.popitem(last=False)
+        return future
+
+
+def prefetch_lyrics(candidates: List[Dict]) -> None:
+    """Start fetching lyrics for newly found candidates in the background (one fetch per page)."""
+    for candidate in candidates:
+        url = candidate.get('genius_url') or candidate.get('url')
+        if url:
+            _lyrics_future(url)
+
+
+def fetch_lyrics(url: str, wait: bool = True) -> str:
+    """
+    Lyrics for a candidate, reusing a prefetch when one was started. With
+    wait=False only an already finished prefetch is used and nothing new is fetched.
+    """
+    future = _lyrics_future(url, start=False)
+    record_cache("lyrics", future is not None)
+    if future is None and wait:
+        future = _lyrics_future(url)
+    if future is None or (not wait and not future.done()):
+        return ""
+    try:
+        lyrics = future.result()
+    except Exception as e:
+        print(f"⚠️ Lyrics prefetch failed for {url}: {e}")
+        lyrics = ""
+    if not lyrics:
+        # Let a later request retry pages that failed or ran out of budget
+        with _lyrics_lock:
+            if _lyrics_futures.get(canonical_genius_url(url)) is future:
+                del _lyrics_futures[canonical_genius_url(url)]
+    return lyrics
+
+
 def calculate_enhanced_similarity(query_lyrics: str, candidate_text: str, 
                                 lyrics_content: str = "", title: str = "", 
                                 artist: str = "") -> float:
     """
     Enhanced similarity calculation using multiple comparison strategies.
     """
-    if model is None:
+    if get_model() is None:
         return 0.0
     
     try:
@@ -242,12 +334,13 @@ def calculate_enhanced_similarity(query_lyrics: str, candidate_text: str,
         return 0.0
 
 
+@timed_stage("ranking")
 def rank_by_similarity(query_lyrics: str, candidates: List[Dict], 
                       use_full_lyrics_comparison: bool = True) -> List[Dict]:
     """
     Enhanced ranking with full lyrics comparison and better similarity calculation.
     """
-    if model is None:
+    if get_model() is None:
         print("⚠️ Similarity ranking unavailable - returning original order")
         return candidates
     
@@ -272,9 +365,10 @@ def rank_by_similarity(query_lyrics: str, candidates: List[Dict],
             
             # Get lyrics content if enabled and URL available
             lyrics_content = ""
+            # Out of budget: only use lyrics that were already prefetched
             if use_full_lyrics_comparison and genius_url:
                 print(f"   📖 Fetching lyrics for candidate {i+1}: {title}")
-                lyrics_content = get_lyrics_from_genius(genius_url)
+                lyrics_content = fetch_lyrics(genius_url, wait=not budget_exhausted())
                 if lyrics_content:
                     song['fetched_lyrics'] = lyrics_content[:200] + "..." if len(lyrics_content) > 200 else lyrics_content
                 else:
@@ -324,7 +418,8 @@ def find_youtube_link(query: str) -> str:
     """
     Enhanced YouTube search with better query formatting.
     """
-    if not YOUTUBE_AVAILABLE:
+    VideosSearch = get_videos_search()
+    if VideosSearch is None:
         encoded_query = urllib.parse.quote_plus(f"{query} official music video")
         return f"https://www.youtube.com/results?search_query={encoded_query}"
     
@@ -339,10 +434,15 @@ def find_youtube_link(query: str) -> str:
         
         for term in search_terms:
             try:
-                search = VideosSearch(term, limit=1)
-                results = search.result().get("result", [])
+                spend_call("youtube")
+                with upstream_call("youtube") as call:
+                    search = VideosSearch(term, limit=1)
+                    results = search.result().get("result", [])
+                    call.outcome = "hit" if results else "miss"
                 if results:
                     return results[0].get("link")
+            except BudgetExhausted:
+                break
             except:
                 continue
                 
@@ -364,39 +464,61 @@ def find_spotify_link(query: str) -> str:
     return f"https://open.spotify.com/search/{encoded_query}"
 
 
-def enrich_with_links(songs: List[Dict]) -> List[Dict]:
+def link_query(title: str, artist: str) -> str:
+    """Search query for a song's streaming links, '' if neither title nor artist is known."""
+    title = (title or '').strip()
+    artist = (artist or '').strip()
+    title_known = title.lower() not in ['unknown title', 'unknown', '']
+    artist_known = artist.lower() not in ['unknown artist', 'unknown', '']
+    if not title_known and not artist_known:
+        return ""
+    return f"{title} {artist}".strip() if artist_known else title
+
+
+@timed_stage("enrichment")
+def find_links(title: str, artist: str = "") -> Dict[str, Optional[str]]:
+    """YouTube and Spotify links for a song, cached by query."""
+    query = link_query(title, artist)
+    if not query:
+        return {"youtube_url": None, "spotify_url": None}
+    key = query.lower()
+    with _links_lock:
+        cached = key in _links_cache
+        if cached:
+            _links_cache.move_to_end(key)
+            links = dict(_links_cache[key])
+    record_cache("links", cached)
+    if cached:
+        return links
+
+    links = {"youtube_url": find_youtube_link(query), "spotify_url": find_spotify_link(query)}
+    # Search-page fallbacks are not cached so a later lookup can find the real video
+    if "/results?search_query=" not in (links["youtube_url"] or ""):
+        with _links_lock:
+            _links_cache[key] = links
+            while len(_links_cache) > LINKS_CACHE_SIZE:
+                _links_cache.popitem(last=False)
+    return dict(links)
+
+
+def enrich_with_links(songs: List[Dict], max_songs: int = 5) -> List[Dict]:
     """
-    Enhanced link enrichment with better error handling.
+    Add YouTube/Spotify links to the top songs, looked up concurrently.
+    Not part of ranking: the API serves links separately from GET /links.
     """
-    for i, song in enumerate(songs[:5]):  # Only enrich top 5
-        title = song.get('title') or 'Unknown Title'
-        artist = song.get('artist') or 'Unknown Artist'
-        
-        # Skip if both are unknown or invalid
-        if (title.lower() in ['unknown title', 'unknown'] and 
-            artist.lower() in ['unknown artist', 'unknown']):
-            continue
-            
-        # Create search query
-        if artist.lower() not in ['unknown artist', 'unknown']:
-            query = f"{title} {artist}".strip()
-        else:
-            query = title.strip()
-        
-        print(f"   🔗 Enriching [{i+1}] {title} by {artist}")
-        
-        try:
-            # Add YouTube link
-            if not song.get('youtube_url'):
-                song['youtube_url'] = find_youtube_link(query)
-                time.sleep(0.3)  # Rate limiting
-            
-            # Add Spotify link
-            if not song.get('spotify_url'):
-                song['spotify_url'] = find_spotify_link(query)
-                
-        except Exception as e:
-            print(f"   ⚠️ Error enriching {title}: {e}")
+    targets = [song for song in songs[:max_songs] if link_query(song.get('title'), song.get('artist'))]
+    if not targets:
+        return songs
+
+    def lookup(song):
+        print(f"   🔗 Enriching {song.get('title')} by {song.get('artist')}")
+        return find_links(song.get('title'), song.get('artist'))
+
+    with ThreadPoolExecutor(max_workers=LINKS_CONCURRENCY, thread_name_prefix="links") as executor:
+        for song, links in zip(targets, executor.map(propagate(lookup), targets)):
+            for name, url in links.items():
+                if url and not song.get(name):
+                    song[name] = url
 
     return songs
 
@@ -426,14 +548,8 @@ def rag_search_with_similarity(query: str, search_results: List[Dict],
         print(f"⚠️ Similarity ranking failed: {e}")
         ranked = search_results
     
-    # Enrich with links
-    try:
-        enriched = enrich_with_links(ranked)
-        print(f"✅ Enriched top results with streaming links")
-        return enriched
-    except Exception as e:
-        print(f"⚠️ Link enrichment failed: {e}")
-        return ranked
+    # Streaming links are not looked up here: see enrich_with_links / GET /links
+    return ranked
 
 
 # Utility functions for testing and debugging
@@ -0,0 +1,141 @@
+"""
+Per-request deadline and outbound-call budget.
+
+The API opens a RequestBudget for each identification. It is kept in a
+ContextVar so the code that actually talks to upstreams (search, scraping,
+lyrics fetches, link lookups, STT backends) can check it without passing a
+parameter through every signature. Outside a request (CLI, benchmarks)
+there is no budget and every check passes.
+"""
+import os
+import time
+import threading
+import contextvars
+from typing import Dict, Optional
+
+REQUEST_DEADLINE_SEC = float(os.getenv("REQUEST_DEADLINE_SEC", "180"))
+REQUEST_MAX_CALLS = int(os.getenv("REQUEST_MAX_CALLS", "80"))
+
+
+class BudgetExhausted(RuntimeError):
+    """Raised at an outbound call site once the request deadline or call budget is spent."""
+
+
+class CallCancelled(RuntimeError):
+    """Raised by an outbound call whose result is no longer wanted (e.g. the losing hedged STT engine)."""
+
+
+class RequestBudget:
+    def __init__(self, deadline_sec: float = REQUEST_DEADLINE_SEC, max_calls: int = REQUEST_MAX_CALLS):
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline_sec
+        self.max_calls = max_calls
+        self.calls = 0
+        self.calls_by_kind: Dict[str, int] = {}
+        self.exhausted_reason = ""
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    @property
+    def exhausted(self) -> bool:
+        if not self.exhausted_reason and self.remaining() <= 0:
+            self.exhausted_reason = "deadline"
+        return bool(self.exhausted_reason)
+
+    def check(self) -> None:
+        if self.exhausted:
+            raise BudgetExhausted(f"Request budget exhausted ({self.exhausted_reason})")
+
+    def spend(self, kind: str) -> None:
+        """Account for one outbound call, or raise if the budget is already spent."""
+        with self._lock:
+            self.check()
+            if self.calls >= self.max_calls:
+                self.exhausted_reason = "call_budget"
+                self.check()
+            self.calls += 1
+            self.calls_by_kind[kind] = self.calls_by_kind.get(kind, 0) + 1
+
+    def summary(self) -> Dict:
+        return {
+            "elapsed_sec": round(time.monotonic() - self.started, 2),
+            "calls": self.calls,
+            "calls_by_kind": dict(self.calls_by_kind),
+            "exhausted_reason": self.exhausted_reason or None,
+        }
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_budget", default=None)
+_cancelled: contextvars.ContextVar = contextvars.ContextVar("call_cancelled", default=None)
+
+
+def start_budget(deadline_sec: float = REQUEST_DEADLINE_SEC, max_calls: int = REQUEST_MAX_CALLS):
+    """Open a budget for the current request. Returns (budget, token) for end_budget."""
+    budget = RequestBudget(deadline_sec, max_calls)
+    return budget, _current.set(budget)
+
+
+def end_budget(token) -> None:
+    _current.reset(token)
+
+
+def current_budget() -> Optional[RequestBudget]:
+    return _current.get()
+
+
+def spend_call(kind: str) -> None:
+    budget = _current.get()
+    if budget is not None:
+        budget.spend(kind)
+
+
+def check_budget() -> None:
+    budget = _current.get()
+    if budget is not None:
+        budget.check()
+
+
+def budget_exhausted() -> bool:
+    budget = _current.get()
+    return budget is not None and budget.exhausted
+
+
+def call_timeout(default: float) -> float:
+    """`default` capped to the time left before the request deadline."""
+    budget = _current.get()
+    if budget is None:
+        return default
+    return max(0.1, min(default, budget.remaining()))
+
+
+def cancellable(fn, cancelled: threading.Event):
+    """
+    Wrap `fn` so the outbound calls it makes can be abandoned by setting
+    `cancelled`. Calls that can be interrupted (async_http.run_sync) then
+    stop and raise CallCancelled; others finish and their result is dropped.
+    """
+    def run(*args, **kwargs):
+        token = _cancelled.set(cancelled)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _cancelled.reset(token)
+    return run
+
+
+def cancel_event() -> Optional[threading.Event]:
+    """The event set when the current call is no longer wanted, None outside `cancellable`."""
+    return _cancelled.get()
+
+
+def propagate(fn):
+    """
+    Wrap `fn` so it sees the caller's budget when run on an executor thread.
+    Each call runs in its own copy of the context, so the wrapper is safe to map.
+    """
+    ctx = contextvars.copy_context()
+    def run(*args, **kwargs):
+        return ctx.copy().run(fn, *args, **kwargs)
+    return run
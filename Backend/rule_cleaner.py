@@ -0,0 +1,105 @@
+import re
+from typing import List
+
+FILLER_WORDS = {'uh', 'um', 'umm', 'uhh', 'hmm', 'mm', 'mmm', 'ah', 'ahh', 'er', 'erm'}
+# Vocalisations that are lyrics when sung once but noise when looped
+VOCALISATIONS = {'oh', 'ooh', 'yeah', 'la', 'na', 'da', 'woah', 'whoa', 'hey', 'ha'}
+
+HEADER_PATTERN = re.compile(
+    r'^\s*(here\s+(are|is)|these|the following|cleaned lyrics|lyrics|transcription)\b.*?:\s*$', re.IGNORECASE
+)
+NON_LYRIC_PATTERN = re.compile(r'\[[^\]]*\]|\([^)]*(music|instrumental|applause|inaudible)[^)]*\)|♪', re.IGNORECASE)
+
+MAX_LINE_WORDS = 12
+MAX_LINE_REPEATS = 2
+
+
+def _words(line: str) -> List[str]:
+    return re.findall(r"[a-z0-9']+", line.lower())
+
+
+def split_lines(text: str, transform=None) -> List[str]:
+    """
+    Re-segment run-on transcription into lyric-sized lines on punctuation and
+    length. `transform` rewrites each sentence's word list before it is cut.
+    """
+    lines = []
+    for sentence in re.split(r'(?<=[.!?;])\s+|\n+', text):
+        words = sentence.strip().split()
+        if transform is not None:
+            words = transform(words)
+        for i in range(0, len(words), MAX_LINE_WORDS):
+            piece = ' '.join(words[i:i + MAX_LINE_WORDS]).strip(' .')
+            if piece:
+                lines.append(piece)
+    return lines
+
+
+def collapse_repeated_ngrams(words: List[str], max_n: int = 4) -> List[str]:
+    """Collapse immediately repeated n-grams ('oh oh oh oh', 'I love you I love you I love you')."""
+    def key(ws):
+        return [w.lower().strip(',.!?') for w in ws]
+
+    for n in range(max_n, 0, -1):
+        # A doubled phrase is often a real lyric, a doubled word rarely is
+        max_copies = 2 if n > 1 else 1
+        out, i = [], 0
+        while i < len(words):
+            gram = words[i:i + n]
+            copies = 1
+            while len(gram) == n and key(words[i + copies * n:i + (copies + 1) * n]) == key(gram):
+                copies += 1
+            if copies == 1:
+                out.append(words[i])
+                i += 1
+            else:
+                out.extend(gram * min(copies, max_copies))
+                i += n * copies
+        words = out
+    return words
+
+
+def rule_based_clean(raw_lyrics: str) -> str:
+    """
+    Deterministic cleanup: strip headers and non-lyric tags, drop fillers,
+    collapse looped n-grams, re-segment into lines and cap repeated lines.
+    """
+    text = NON_LYRIC_PATTERN.sub(' ', raw_lyrics)
+    lines = [line for line in text.splitlines() if not HEADER_PATTERN.match(line)]
+
+    cleaned = []
+    seen = {}
+    def drop_noise(words):
+        return collapse_repeated_ngrams([w for w in words if w.lower().strip(',.!?') not in FILLER_WORDS])
+
+    for line in split_lines('\n'.join(lines), drop_noise):
+        line = line[0].upper() + line[1:]
+        key = ' '.join(_words(line))
+        if not key:
+            continue
+        seen[key] = seen.get(key, 0) + 1
+        if seen[key] > MAX_LINE_REPEATS:
+            continue
+        cleaned.append(line)
+    return '\n'.join(cleaned)
+
+
+def quality_score(text: str) -> float:
+    """
+    0-1 estimate of how much the text looks like clean lyrics: penalises
+    repeated lines, looped vocalisations, filler, and very short or long lines.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    words = _words(text)
+    if not lines or len(words) < 4:
+        return 0.0
+
+    unique_line_ratio = len({' '.join(_words(l)) for l in lines}) / len(lines)
+    unique_word_ratio = min(1.0, len(set(words)) / len(words) * 2)
+    noise_ratio = sum(1 for w in words if w in FILLER_WORDS or w in VOCALISATIONS) / len(words)
+    avg_line_words = len(words) / len(lines)
+    line_shape = 1.0 if 3 <= avg_line_words <= MAX_LINE_WORDS else 0.5
+
+    score = (0.35 * unique_line_ratio + 0.25 * unique_word_ratio
+             + 0.25 * (1.0 - min(1.0, noise_ratio * 3)) + 0.15 * line_shape)
+    return round(score, 3)
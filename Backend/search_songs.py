@@ -1,64 +1,27 @@
 import requests
-from bs4 import BeautifulSoup
 import re
 from urllib.parse import quote_plus
 import time
 import random
+from distinctiveness import most_distinctive_lines
+from html_extract import google_result_links
+from metrics import upstream_call
+from tracing import traced, set_attributes
+from request_budget import spend_call, call_timeout, budget_exhausted, current_budget, BudgetExhausted
 
 def extract_key_phrases(lyrics: str, max_phrases: int = 5):
     """
-    Enhanced key phrase extraction focusing on distinctive lyrics
+    Key phrase extraction: the most distinctive lines by corpus n-gram IDF
     """
     lines = [line.strip() for line in lyrics.split('\n') if line.strip()]
-    
-    # Score lines based on uniqueness indicators
-    scored_lines = []
-    
-    for line in lines:
-        if len(line) < 8:  # Skip very short lines
-            continue
-            
-        score = len(line)  # Base score on length
-        line_lower = line.lower()
-        
-        # Boost score for distinctive patterns
-        uniqueness_indicators = [
-            ('coming out', 15), ('started with', 12), ('how did it end up', 20),
-            ('it was only', 10), ('stomach is sick', 15), ('all in my head', 10),
-            ('calling a cab', 12), ('having a smoke', 12), ('going to bed', 8),
-            ('touching his chest', 15), ('falling asleep', 10)
-        ]
-        
-        for phrase, boost in uniqueness_indicators:
-            if phrase in line_lower:
-                score += boost
-        
-        # Boost for questions (often memorable)
-        if '?' in line:
-            score += 8
-        
-        # Boost for emotional content
-        emotional_words = ['sick', 'head', 'heart', 'soul', 'feel', 'love', 'hate', 'want', 'need']
-        for word in emotional_words:
-            if word in line_lower:
-                score += 3
-        
-        # Penalize very common phrases
-        common_phrases = ['and i', 'but i', 'when i', 'that i', 'if i', 'so i']
-        for phrase in common_phrases:
-            if phrase in line_lower:
-                score -= 2
-        
-        scored_lines.append((score, line))
-    
-    # Sort by score and return top phrases
-    scored_lines.sort(reverse=True, key=lambda x: x[0])
-    return [line for score, line in scored_lines[:max_phrases]]
+    return most_distinctive_lines(lines, max_phrases, min_chars=8)
 
+@traced("search_genius_by_lyrics_scrape")
 def search_genius_by_lyrics_scrape(lyrics_snippet: str, max_results: int = 5):
     """
     Enhanced Google search scraping with better query strategies and error handling
     """
+    set_attributes(snippet=lyrics_snippet[:80], max_results=max_results)
     # Create more targeted search variations
     search_queries = []
     
@@ -122,16 +85,24 @@ def search_genius_by_lyrics_scrape(lyrics_snippet: str, max_results: int = 5):
             or "captcha" in response_text.lower()
         )
     
+    def budget_sleep(delay):
+        # Never sleep past the request deadline
+        budget = current_budget()
+        time.sleep(max(0.0, min(delay, budget.remaining())) if budget else delay)
+    
     def backoff_sleep(retry_count, base=3.0, jitter=2.0):
         delay = base * (2 ** retry_count) + random.uniform(0, jitter)
         print(f"🕒 Sleeping for {delay:.2f}s before retrying...")
-        time.sleep(delay)
+        budget_sleep(delay)
     
     MAX_RETRIES = 4
 
     for i, query in enumerate(search_queries):
         if len(all_links) >= max_results:
             break
+        if budget_exhausted():
+            print("⏱️ Request budget exhausted, stopping Google search")
+            break
 
         print(f"🔍 Trying query {i+1}/{len(search_queries)}: {query[:50]}...")
         
@@ -144,10 +115,19 @@ def search_genius_by_lyrics_scrape(lyrics_snippet: str, max_results: int = 5):
                 session = requests.Session()
                 session.headers.update(headers)
                 
-                response = session.get(search_url, timeout=15)
+                spend_call("google_search")
+                with upstream_call("google_search") as call:
+                    response = session.get(search_url, timeout=call_timeout(15))
+                    # Detect CAPTCHA or 429
+                    blocked = response.status_code == 429 or is_google_captcha(response.text)
+                    if blocked:
+                        call.outcome = "captcha"
+                    elif not response.ok:
+                        call.outcome = "error"
+                    elif 'genius.com' not in response.text:
+                        call.outcome = "miss"
 
-                # Detect CAPTCHA or 429
-                if response.status_code == 429 or is_google_captcha(response.text):
+                if blocked:
                     print(f"⚠️ Rate limited or CAPTCHA detected (attempt {retry+1})")
                     if retry < MAX_RETRIES - 1:
                         backoff_sleep(retry)
@@ -158,81 +138,64 @@ def search_genius_by_lyrics_scrape(lyrics_snippet: str, max_results: int = 5):
 
                 response.raise_for_status()
 
-                # Parse the page normally if no CAPTCHA
-                soup = BeautifulSoup(response.text, 'html.parser')
-                
-                # More comprehensive link extraction
-                link_selectors = [
-                    'a[href*="genius.com"]',
-                    'cite:contains("genius.com")',
-                    'span:contains("genius.com")'
-                ]
-                
+                # Only result anchors/cites/spans are parsed, no full document tree
                 found_links_this_query = 0
                 
-                for selector in link_selectors:
-                    try:
-                        elements = soup.select(selector)
-                        for element in elements:
-                            href = element.get('href') or element.get_text()
-                            if not href:
-                                continue
-                                
-                            # Extract Genius URLs
-                            genius_urls = re.findall(r'https://genius\.com/[^"&\s]+', href)
-                            for url in genius_urls:
-                                if re.match(r"https://genius\.com/.+-lyrics/?$", url):
-                                    # Extract better title info
-                                    title_part = url.split("/")[-1].replace("-lyrics", "")
-                                    
-                                    # Try to separate artist and song
-                                    parts = title_part.split('-')
-                                    if len(parts) >= 2:
-                                        # Last part is usually song, earlier parts are artist
-                                        potential_artist = ' '.join(parts[:-1]).replace('-', ' ').title()
-                                        potential_song = parts[-1].replace('-', ' ').title()
-                                        title = f"{potential_song} by {potential_artist}"
-                                    else:
-                                        title = title_part.replace("-", " ").title()
-                                    
-                                    # Check for duplicates
-                                    if not any(link['url'] == url for link in all_links):
-                                        all_links.append({
-                                            "title": title,
-                                            "url": url,
-                                            "search_query": query  # Track which query found this
-                                        })
-                                        found_links_this_query += 1
-                    except Exception as e:
-                        print(f"⚠️ Error parsing selector {selector}: {e}")
-                        continue
+                for href in google_result_links(response.text):
+                    # Extract Genius URLs
+                    genius_urls = re.findall(r'https://genius\.com/[^"&\s]+', href)
+                    for url in genius_urls:
+                        if re.match(r"https://genius\.com/.+-lyrics/?$", url):
+                            # Extract better title info
+                            title_part = url.split("/")[-1].replace("-lyrics", "")
+                            
+                            # Try to separate artist and song
+                            parts = title_part.split('-')
+                            if len(parts) >= 2:
+                                # Last part is usually song, earlier parts are artist
+                                potential_artist = ' '.join(parts[:-1]).replace('-', ' ').title()
+                                potential_song = parts[-1].replace('-', ' ').title()
+                                title = f"{potential_song} by {potential_artist}"
+                            else:
+                                title = title_part.replace("-", " ").title()
+                            
+                            # Check for duplicates
+                            if not any(link['url'] == url for link in all_links):
+                                all_links.append({
+                                    "title": title,
+                                    "url": url,
+                                    "search_query": query  # Track which query found this
+                                })
+                                found_links_this_query += 1
                 
                 print(f"✅ Found {found_links_this_query} new links from this query")
                 
                 # Add random delay between successful requests
                 if i < len(search_queries) - 1:  # Don't sleep after last query
-                    time.sleep(random.uniform(3, 7))
+                    budget_sleep(random.uniform(3, 7))
                 
                 break  # Successful request, break retry loop
 
+            except BudgetExhausted:
+                break
             except requests.exceptions.Timeout:
                 print(f"⚠️ Timeout on query attempt {retry+1} for '{query[:50]}...'")
                 if retry < MAX_RETRIES - 1:
                     backoff_sleep(retry)
                 else:
-                    print(f"❌ Max retries reached due to timeouts")
+                    print("❌ Max retries reached due to timeouts")
             except requests.exceptions.RequestException as e:
                 print(f"⚠️ Request error on query attempt {retry+1} for '{query[:50]}...': {e}")
                 if retry < MAX_RETRIES - 1:
                     backoff_sleep(retry)
                 else:
-                    print(f"❌ Max retries reached due to request errors")
+                    print("❌ Max retries reached due to request errors")
             except Exception as e:
                 print(f"⚠️ Unexpected error on query attempt {retry+1} for '{query[:50]}...': {e}")
                 if retry < MAX_RETRIES - 1:
                     backoff_sleep(retry)
                 else:
-                    print(f"❌ Max retries reached due to unexpected errors")
+                    print("❌ Max retries reached due to unexpected errors")
     
     # Enhanced filtering
     filtered_links = []
@@ -258,12 +221,23 @@ def search_genius_by_lyrics_scrape(lyrics_snippet: str, max_results: int = 5):
     print(f"🎵 Total unique results found: {len(filtered_links)}")
     return filtered_links[:max_results]
 
-def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int = 3):
+def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int = 3, tracker=None):
     """
-    Use multiple search strategies and combine results
+    Use multiple search strategies and combine results. When a CandidateTracker
+    is given, results are scored as they arrive and the remaining strategies
+    are skipped once it has a clear leader.
     """
     all_results = []
     
+    def leader_found(results, query):
+        if tracker is None:
+            return False
+        tracker.add(results, query)
+        if tracker.decided():
+            print(f"🎯 Clear leader, skipping remaining strategies: {tracker.summary()}")
+            return True
+        return False
+    
     # Strategy 1: Key phrases (most distinctive lines)
     print("🎯 Strategy 1: Key phrases")
     try:
@@ -274,6 +248,8 @@ def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int =
                 result['search_strategy'] = f'key_phrase: {phrase[:30]}...'
                 if not any(r['url'] == result['url'] for r in all_results):
                     all_results.append(result)
+            if leader_found(results, phrase):
+                return all_results
     except Exception as e:
         print(f"⚠️ Error in Strategy 1: {e}")
     
@@ -288,6 +264,8 @@ def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int =
                 result['search_strategy'] = f'first_line: {first_line[:30]}...'
                 if not any(r['url'] == result['url'] for r in all_results):
                     all_results.append(result)
+            if leader_found(results, first_line):
+                return all_results
     except Exception as e:
         print(f"⚠️ Error in Strategy 2: {e}")
     
@@ -301,6 +279,8 @@ def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int =
                 result['search_strategy'] = f'question: {question[:30]}...'
                 if not any(r['url'] == result['url'] for r in all_results):
                     all_results.append(result)
+            if leader_found(results, question):
+                return all_results
     except Exception as e:
         print(f"⚠️ Error in Strategy 3: {e}")
     
@@ -315,6 +295,8 @@ def search_multiple_strategies(lyrics_text: str, max_results_per_strategy: int =
                 result['search_strategy'] = f'combined: {combined[:30]}...'
                 if not any(r['url'] == result['url'] for r in all_results):
                     all_results.append(result)
+            if leader_found(results, combined):
+                return all_results
     except Exception as e:
         print(f"⚠️ Error in Strategy 4: {e}")
     
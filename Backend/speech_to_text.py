@@ -1,49 +1,61 @@
 import os
-import subprocess
-import soundfile as sf
-import requests
-from mp3_wav import mp3_to_wav
+import asyncio
+from mp3_wav import decode_pcm16
+from async_http import get_client, iter_bytes, run_sync, split_pcm
+from request_budget import spend_call, call_timeout
 
 DEEPGRAM_API_KEY = os.getenv("DEEPGRAM_API_KEY", "")
+# Overridable so a local stand-in server can replace the real API
+DEEPGRAM_URL = os.getenv("DEEPGRAM_URL", "https://api.deepgram.com/v1/listen")
 
-def reencode_wav(input_path, output_path):
-    """
-    Re-encode a WAV file to standard PCM 16-bit mono 44.1kHz using ffmpeg.
-    """
-    cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-acodec", "pcm_s16le", "-ar", "44100", "-ac", "1", output_path
-    ]
-    subprocess.run(cmd, check=True)
+SAMPLE_RATE = 44100
+# Split uploads into chunks of this length sent concurrently (0 = one upload)
+DEEPGRAM_CHUNK_SEC = float(os.getenv("DEEPGRAM_CHUNK_SEC", "0"))
+DEEPGRAM_CONCURRENCY = int(os.getenv("DEEPGRAM_CONCURRENCY", "4"))
 
-def extract_text(path: str) -> str:
+
+async def transcribe_pcm(pcm: bytes) -> str:
     """
-    Transcribe the isolated audio file using Deepgram Nova-3 API.
+    Stream raw PCM 16-bit mono audio to Deepgram Nova-3 over the pooled client.
     """
-    file_name = mp3_to_wav(path)
-    # Re-encode to PCM 16-bit mono 44.1kHz for best compatibility
-    reencoded_file = file_name.replace(".wav", "_reencoded.wav")
-    reencode_wav(file_name, reencoded_file)
-    file_name = reencoded_file
-
-    print("Checking WAV file:", file_name)
-    try:
-        info = sf.info(file_name)
-        print("WAV info:", info)
-        print("WAV file size:", os.path.getsize(file_name), "bytes")
-    except Exception as e:
-        print("WAV file is not valid:", e)
-        raise
-
-    url = "https://api.deepgram.com/v1/listen?model=nova-3&punctuate=true&language=en"
+    client = get_client("deepgram", max_connections=DEEPGRAM_CONCURRENCY)
+    params = {
+        "model": "nova-3",
+        "punctuate": "true",
+        "language": "en",
+        "encoding": "linear16",
+        "sample_rate": SAMPLE_RATE,
+        "channels": 1,
+    }
     headers = {
         "Authorization": f"Token {DEEPGRAM_API_KEY}",
-        "Content-Type": "audio/wav"
+        "Content-Type": "audio/l16",
     }
-    with open(file_name, "rb") as audio:
-        print("Uploading audio to Deepgram Nova-3...")
-        response = requests.post(url, headers=headers, data=audio)
+    spend_call("deepgram")
+    response = await client.post(DEEPGRAM_URL, params=params, headers=headers, content=iter_bytes(pcm),
+                                 timeout=call_timeout(60.0))
     response.raise_for_status()
     result = response.json()
-    print("Deepgram response:", result)
     return result["results"]["channels"][0]["alternatives"][0]["transcript"]
+
+
+async def extract_text_async(path: str) -> str:
+    """
+    Transcribe the isolated audio file using Deepgram Nova-3 API.
+    """
+    pcm = await asyncio.to_thread(decode_pcm16, path, SAMPLE_RATE)
+    chunks = split_pcm(pcm, SAMPLE_RATE, DEEPGRAM_CHUNK_SEC)
+    print(f"Uploading {len(pcm)} bytes of PCM audio to Deepgram Nova-3 ({len(chunks)} request(s))...")
+
+    semaphore = asyncio.Semaphore(DEEPGRAM_CONCURRENCY)
+
+    async def transcribe_one(chunk):
+        async with semaphore:
+            return await transcribe_pcm(chunk)
+
+    transcripts = await asyncio.gather(*(transcribe_one(chunk) for chunk in chunks))
+    return " ".join(t.strip() for t in transcripts if t and t.strip())
+
+
+def extract_text(path: str) -> str:
+    return run_sync(extract_text_async(path))
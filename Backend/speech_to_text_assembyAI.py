@@ -1,121 +1,89 @@
 import os
-import tempfile
-import numpy as np
-import librosa
-import soundfile as sf
-import requests
 import time
-import subprocess
-from mp3_wav import mp3_to_wav
+import asyncio
+from mp3_wav import decode_pcm16, pcm16_to_wav_bytes
+from async_http import get_client, iter_bytes, run_sync, split_pcm
+from request_budget import spend_call, check_budget, call_timeout
 
-ASSEMBLYAI_API_KEY = "Enter your own key"
-UPLOAD_ENDPOINT = "https://api.assemblyai.com/v2/upload"
-TRANSCRIBE_ENDPOINT = "https://api.assemblyai.com/v2/transcript"
+ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY", "Enter your own key")
+# Overridable so a local stand-in server can replace the real API
+ASSEMBLYAI_BASE_URL = os.getenv("ASSEMBLYAI_BASE_URL", "https://api.assemblyai.com")
+UPLOAD_ENDPOINT = f"{ASSEMBLYAI_BASE_URL}/v2/upload"
+TRANSCRIBE_ENDPOINT = f"{ASSEMBLYAI_BASE_URL}/v2/transcript"
 
+SAMPLE_RATE = 44100
 MAX_CHUNK_SEC = 30.0
-MIN_CHUNK_SEC = 10.0
+# Split uploads into chunks of this length processed concurrently (0 = one job)
+ASSEMBLYAI_CHUNK_SEC = float(os.getenv("ASSEMBLYAI_CHUNK_SEC", "0"))
+ASSEMBLYAI_CONCURRENCY = int(os.getenv("ASSEMBLYAI_CONCURRENCY", "4"))
 
-def upload_to_assemblyai(filename):
+# Adaptive polling: start fast, back off while the job is still queued/processing
+POLL_INITIAL_SEC = 0.5
+POLL_MAX_SEC = 5.0
+POLL_BACKOFF = 1.5
+
+
+def _client():
+    return get_client("assemblyai", max_connections=ASSEMBLYAI_CONCURRENCY * 2)
+
+
+async def upload_to_assemblyai(wav_bytes: bytes) -> str:
     headers = {'authorization': ASSEMBLYAI_API_KEY}
-    with open(filename, 'rb') as f:
-        response = requests.post(UPLOAD_ENDPOINT, headers=headers, files={'file': f})
+    spend_call("assemblyai")
+    response = await _client().post(UPLOAD_ENDPOINT, headers=headers, content=iter_bytes(wav_bytes))
     response.raise_for_status()
     return response.json()['upload_url']
 
-def transcribe_with_assemblyai(audio_url, timeout=300):
-    headers = {
-        'authorization': ASSEMBLYAI_API_KEY,
-        'content-type': 'application/json'
-    }
-    json = { "audio_url": audio_url, "language_code": "en" }
-    response = requests.post(TRANSCRIBE_ENDPOINT, json=json, headers=headers)
+
+async def transcribe_with_assemblyai(audio_url: str, timeout: float = 300) -> str:
+    headers = {'authorization': ASSEMBLYAI_API_KEY}
+    json = {"audio_url": audio_url, "language_code": "en"}
+    # Polling counts against the request deadline, not the call budget
+    timeout = call_timeout(timeout)
+    spend_call("assemblyai")
+    response = await _client().post(TRANSCRIBE_ENDPOINT, json=json, headers=headers)
     response.raise_for_status()
     transcript_id = response.json()['id']
 
     polling_endpoint = f"{TRANSCRIBE_ENDPOINT}/{transcript_id}"
-    start_time = time.time()
+    start_time = time.monotonic()
+    delay = POLL_INITIAL_SEC
     while True:
-        poll_response = requests.get(polling_endpoint, headers=headers)
+        check_budget()
+        poll_response = await _client().get(polling_endpoint, headers=headers)
         poll_response.raise_for_status()
-        status = poll_response.json()['status']
-        print(f"AssemblyAI status: {status} (waiting...)")  # <-- Status update
+        result = poll_response.json()
+        status = result['status']
+        print(f"AssemblyAI status: {status} (waiting {delay:.1f}s...)")
         if status == 'completed':
-            return poll_response.json()['text']
+            return result.get('text') or ''
         elif status == 'failed' or status == 'error':
-            print("AssemblyAI error details:", poll_response.json())
-            raise Exception("Transcription failed:", poll_response.json())
-        if time.time() - start_time > timeout:
+            print("AssemblyAI error details:", result)
+            raise Exception("Transcription failed:", result)
+        if time.monotonic() - start_time > timeout:
             raise TimeoutError("AssemblyAI transcription timed out.")
-        time.sleep(3)
+        await asyncio.sleep(delay)
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_SEC)
 
-def extract_text(path: str) -> str:
+
+async def extract_text_async(path: str) -> str:
     """
     Transcribe the isolated audio file using AssemblyAI's official API pattern.
     """
-    # Convert to wav if needed
-    file_name = mp3_to_wav(path)
-    import soundfile as sf
-    import os
-
-    # Re-encode to standard PCM 16-bit mono 44.1kHz
-    reencoded_file = file_name.replace(".wav", "_reencoded.wav")
-    reencode_wav(file_name, reencoded_file)
-    file_name = reencoded_file
-
-    print("Checking WAV file:", file_name)
-    try:
-        info = sf.info(file_name)
-        print("WAV info:", info)
-        print("WAV file size:", os.path.getsize(file_name), "bytes")
-    except Exception as e:
-        print("WAV file is not valid:", e)
-        raise
-
-    # Upload audio file
-    headers = {'authorization': ASSEMBLYAI_API_KEY}
-    with open(file_name, 'rb') as f:
-        print("Uploading audio to AssemblyAI...")
-        upload_response = requests.post(UPLOAD_ENDPOINT, headers=headers, files={'file': f})
-    upload_response.raise_for_status()
-    audio_url = upload_response.json()['upload_url']
-
-    # Start transcription
-    transcript_request = {
-        'audio_url': audio_url,
-        'language_code': 'en'
-    }
-    print("Requesting transcription from AssemblyAI...")
-    transcript_response = requests.post(
-        TRANSCRIBE_ENDPOINT, json=transcript_request, headers=headers
-    )
-    transcript_response.raise_for_status()
-    transcript_id = transcript_response.json()['id']
-    polling_endpoint = f"{TRANSCRIBE_ENDPOINT}/{transcript_id}"
+    pcm = await asyncio.to_thread(decode_pcm16, path, SAMPLE_RATE)
+    chunks = split_pcm(pcm, SAMPLE_RATE, ASSEMBLYAI_CHUNK_SEC)
+    print(f"Uploading audio to AssemblyAI ({len(chunks)} job(s))...")
 
-    # Poll for completion
-    print("Polling AssemblyAI for transcription status...")
-    start_time = time.time()
-    timeout = 300  # 5 minutes
-    while True:
-        poll_response = requests.get(polling_endpoint, headers=headers)
-        poll_response.raise_for_status()
-        status = poll_response.json()['status']
-        print(f"AssemblyAI status: {status} (waiting...)")
-        if status == 'completed':
-            return poll_response.json().get('text', '')
-        elif status == 'failed' or status == 'error':
-            print("AssemblyAI error details:", poll_response.json())
-            raise Exception("Transcription failed:", poll_response.json())
-        if time.time() - start_time > timeout:
-            raise TimeoutError("AssemblyAI transcription timed out.")
-        time.sleep(3)
+    semaphore = asyncio.Semaphore(ASSEMBLYAI_CONCURRENCY)
 
-def reencode_wav(input_path, output_path):
-    """
-    Re-encode a WAV file to standard PCM 16-bit mono 44.1kHz using ffmpeg.
-    """
-    cmd = [
-        "ffmpeg", "-y", "-i", input_path,
-        "-acodec", "pcm_s16le", "-ar", "44100", "-ac", "1", output_path
-    ]
-    subprocess.run(cmd, check=True)
+    async def transcribe_one(chunk):
+        async with semaphore:
+            audio_url = await upload_to_assemblyai(pcm16_to_wav_bytes(chunk, SAMPLE_RATE))
+            return await transcribe_with_assemblyai(audio_url)
+
+    transcripts = await asyncio.gather(*(transcribe_one(chunk) for chunk in chunks))
+    return " ".join(t.strip() for t in transcripts if t and t.strip())
+
+
+def extract_text(path: str) -> str:
+    return run_sync(extract_text_async(path))
@@ -1,17 +1,60 @@
 import os
-import tempfile
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import librosa
-import soundfile as sf
 import speech_recognition as sr
 from mp3_wav import mp3_to_wav
-import wave
+from request_budget import spend_call, propagate, BudgetExhausted
 
 r = sr.Recognizer()
 
+# Overridable so a local stand-in server can replace the real API
+GOOGLE_SPEECH_ENDPOINT = os.getenv("GOOGLE_SPEECH_ENDPOINT", "")
+
+# Chunks are recognised concurrently; each call is a blocking network round-trip
+GOOGLE_CONCURRENCY = int(os.getenv("GOOGLE_CONCURRENCY", "6"))
+GOOGLE_MAX_RETRIES = int(os.getenv("GOOGLE_MAX_RETRIES", "3"))
+
+
+def recognize(audio) -> str:
+    if GOOGLE_SPEECH_ENDPOINT:
+        return r.recognize_google(audio, endpoint=GOOGLE_SPEECH_ENDPOINT)
+    return r.recognize_google(audio)
+
 MAX_CHUNK_SEC = 20.0
 MIN_CHUNK_SEC = 2.0
 
+def to_audio_data(samples: np.ndarray, sample_rate: int) -> sr.AudioData:
+    """Build 16-bit PCM AudioData straight from a float chunk, no WAV round-trip."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return sr.AudioData(pcm.tobytes(), sample_rate, 2)
+
+def recognize_chunk(audio: sr.AudioData) -> str:
+    """
+    Recognise one chunk, retrying transient RequestErrors with backoff.
+    Returns "" only when Google heard no speech; the last RequestError is
+    raised so an outage counts as a backend error and failover moves on.
+    """
+    for attempt in range(GOOGLE_MAX_RETRIES):
+        try:
+            spend_call("google_stt")
+            return recognize(audio).strip()
+        except sr.UnknownValueError:
+            return ""
+        except BudgetExhausted:
+            # Keep whatever the other chunks already produced
+            return ""
+        except sr.RequestError as e:
+            if attempt == GOOGLE_MAX_RETRIES - 1:
+                print(f"Google API error: {e}")
+                raise
+            delay = 0.5 * (2 ** attempt) + random.uniform(0, 0.5)
+            print(f"⚠️ Google API error ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+    return ""
+
 def extract_text(path: str) -> str:
     file_name = mp3_to_wav(path)
     # Normalize audio to -20dBFS for consistent splitting
@@ -22,41 +65,27 @@ def extract_text(path: str) -> str:
 
     non_silent_intervals = librosa.effects.split(audio_data, top_db=15)
 
-    text_fragments = []
-    with tempfile.TemporaryDirectory() as folder_name:
-        for i, (start, end) in enumerate(non_silent_intervals):
-            duration = (end - start) / sample_rate
-            if duration < MIN_CHUNK_SEC:
-                continue
-            chunk_starts = np.arange(start, end, int(MAX_CHUNK_SEC * sample_rate))
-            for j, chunk_start in enumerate(chunk_starts):
-                chunk_end = min(chunk_start + int(MAX_CHUNK_SEC * sample_rate), end)
-                chunk_file = os.path.join(folder_name, f"chunk{i}_{j}.wav")
-                sf.write(chunk_file, audio_data[chunk_start:chunk_end], sample_rate)
-                print(f"Chunk {i}_{j}: {round((chunk_end-chunk_start)/sample_rate, 2)} seconds")
-                with sr.AudioFile(chunk_file) as source:
-                    audio = r.record(source)
-                    try:
-                        text = r.recognize_google(audio)
-                        if text.strip():
-                            text_fragments.append(text.capitalize() + ".")
-                    except sr.UnknownValueError:
-                        continue
+    chunks = []
+    for i, (start, end) in enumerate(non_silent_intervals):
+        duration = (end - start) / sample_rate
+        if duration < MIN_CHUNK_SEC:
+            continue
+        chunk_starts = np.arange(start, end, int(MAX_CHUNK_SEC * sample_rate))
+        for j, chunk_start in enumerate(chunk_starts):
+            chunk_end = min(chunk_start + int(MAX_CHUNK_SEC * sample_rate), end)
+            print(f"Chunk {i}_{j}: {round((chunk_end-chunk_start)/sample_rate, 2)} seconds")
+            chunks.append(to_audio_data(audio_data[chunk_start:chunk_end], sample_rate))
+
+    # map() returns transcripts in chunk order regardless of completion order
+    with ThreadPoolExecutor(max_workers=max(1, GOOGLE_CONCURRENCY)) as executor:
+        texts = list(executor.map(propagate(recognize_chunk), chunks))
+    text_fragments = [text.capitalize() + "." for text in texts if text]
+
     # Fallback if nothing was transcribed
     if not text_fragments:
-        with wave.open(file_name, 'rb') as wf:
-            duration = wf.getnframes() / wf.getframerate()
-            print(f"Fallback file duration: {duration:.2f} seconds")
-            print("No lyrics detected in chunks, trying whole file (first 30 seconds)...")
-            with sr.AudioFile(file_name) as source:
-                # Only read the first 30 seconds
-                audio = r.record(source, duration=30)
-                try:
-                    text = r.recognize_google(audio)
-                    if text.strip():
-                        text_fragments.append(text.capitalize() + ".")
-                except sr.UnknownValueError:
-                    pass
-                except sr.RequestError as e:
-                    print(f"Google API error: {e}")
+        print(f"Fallback file duration: {len(audio_data) / sample_rate:.2f} seconds")
+        print("No lyrics detected in chunks, trying whole file (first 30 seconds)...")
+        text = recognize_chunk(to_audio_data(audio_data[:int(30 * sample_rate)], sample_rate))
+        if text:
+            text_fragments.append(text.capitalize() + ".")
     return " ".join(text_fragments)
@@ -1,46 +1,331 @@
 import os
-import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Iterator
 import numpy as np
-import librosa
-import soundfile as sf
-import whisper
 from mp3_wav import mp3_to_wav
+from quantization import apply_inference_mode, WHISPER_INFERENCE
+from cpu_scheduler import heavy_stage, stage_threads
 
-MAX_CHUNK_SEC = 20.0
-MIN_CHUNK_SEC = 2.0
+# Frame-energy VAD with hysteresis: a region opens on frames louder than
+# VAD_ON_DB (relative to the loudest frame) and extends while above VAD_OFF_DB
+VAD_FRAME_SEC = 0.03
+VAD_HOP_SEC = 0.01
+VAD_ON_DB = float(os.getenv("VAD_ON_DB", "-15"))
+VAD_OFF_DB = float(os.getenv("VAD_OFF_DB", "-25"))
+VAD_MIN_REGION_SEC = 0.2
 
-def extract_text(path: str) -> str:
+# Chunk packer: merge neighbouring vocal regions into windows close to
+# Whisper's 30 s context, splitting long regions at the quietest frame
+PACK_TARGET_SEC = float(os.getenv("PACK_TARGET_SEC", "28"))
+PACK_MAX_GAP_SEC = float(os.getenv("PACK_MAX_GAP_SEC", "4"))
+
+# Coarse-to-fine cascade: a cheap model transcribes everything first, the
+# accurate model only revisits chunks Whisper itself was unsure about.
+FAST_MODEL = os.getenv("WHISPER_FAST_MODEL", "base.en")
+ACCURATE_MODEL = os.getenv("WHISPER_ACCURATE_MODEL", "small.en")
+LOGPROB_THRESHOLD = float(os.getenv("WHISPER_LOGPROB_THRESHOLD", "-1.0"))
+NO_SPEECH_THRESHOLD = float(os.getenv("WHISPER_NO_SPEECH_THRESHOLD", "0.6"))
+
+# Process-pool transcription: each worker keeps a warm model and a limited
+# number of torch intra-op threads. WHISPER_WORKERS=1 keeps the in-process loop.
+# By default the pool splits the transcription stage's share of the CPU plan.
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+WHISPER_THREADS_PER_WORKER = int(os.getenv("WHISPER_THREADS_PER_WORKER", "0")) or max(
+    1, stage_threads("transcription") // max(1, WHISPER_WORKERS)
+)
+
+# Same as whisper.audio.SAMPLE_RATE; whisper itself is imported when a model is first loaded
+SAMPLE_RATE = 16000
+
+_models = {}
+_pools = {}
+_worker_model = None
+
+
+def load_whisper_model(name: str, mode: str = WHISPER_INFERENCE):
+    """Load a Whisper model once per process (and inference mode) and reuse it afterwards."""
+    key = (name, mode)
+    if key not in _models:
+        import whisper
+        print(f"🧠 Loading Whisper model '{name}' ({mode})...")
+        device = "cpu" if mode != "fp32" else None
+        _models[key] = apply_inference_mode(whisper.load_model(name, device=device), mode)
+    return _models[key]
+
+
+def loaded_models() -> Dict:
+    """Whisper models loaded in this process, keyed by (name, inference mode)."""
+    return dict(_models)
+
+
+def load_audio(path: str):
+    """Decode to 16 kHz mono float32 (what Whisper expects) and normalise the peak."""
+    import librosa
     file_name = mp3_to_wav(path)
     # Normalize audio to -10dBFS for consistent splitting
-    audio_data, sample_rate = librosa.load(file_name, sr=None)
+    audio_data, sample_rate = librosa.load(file_name, sr=SAMPLE_RATE)
     peak = np.max(np.abs(audio_data))
     if peak > 0:
         audio_data = audio_data / peak * 0.3
+    return audio_data.astype(np.float32), sample_rate
+
+
+def frame_energy_db(audio_data: np.ndarray, sample_rate: int):
+    """Per-frame energy in dB relative to the loudest frame, and the hop size in samples."""
+    frame = max(1, int(VAD_FRAME_SEC * sample_rate))
+    hop = max(1, int(VAD_HOP_SEC * sample_rate))
+    n_frames = max(1, 1 + (len(audio_data) - frame) // hop)
+    # Running sum of squares gives every frame's energy without materialising frames
+    squares = np.concatenate(([0.0], np.cumsum(np.square(audio_data, dtype=np.float64))))
+    starts = np.arange(n_frames) * hop
+    stops = np.minimum(starts + frame, len(audio_data))
+    energy = (squares[stops] - squares[starts]) / frame
+    peak = energy.max() if energy.size and energy.max() > 0 else 1.0
+    return 10.0 * np.log10(energy / peak + 1e-10), hop
+
+
+def vad_regions(energy_db: np.ndarray):
+    """Return (starts, ends) frame indices of voiced regions, ends exclusive."""
+    active = energy_db > VAD_OFF_DB
+    seed = energy_db > VAD_ON_DB
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], active.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if not len(starts):
+        return starts, ends
+    # Hysteresis: keep a run above the off threshold only if it crosses the on threshold
+    seeded = np.add.reduceat(seed.astype(np.int32), starts) > 0
+    long_enough = (ends - starts) >= int(VAD_MIN_REGION_SEC / VAD_HOP_SEC)
+    keep = seeded & long_enough
+    return starts[keep], ends[keep]
+
+
+def pack_regions(starts: np.ndarray, ends: np.ndarray, energy_db: np.ndarray):
+    """Merge neighbouring regions into ~PACK_TARGET_SEC windows; split long ones at low-energy frames."""
+    target = int(PACK_TARGET_SEC / VAD_HOP_SEC)
+    max_gap = int(PACK_MAX_GAP_SEC / VAD_HOP_SEC)
+
+    windows = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if windows and end - windows[-1][0] <= target and start - windows[-1][1] <= max_gap:
+            windows[-1][1] = end
+        else:
+            windows.append([start, end])
+
+    packed = []
+    for start, end in windows:
+        while end - start > target:
+            # Cut at the quietest frame in the second half of the window
+            lo, hi = start + target // 2, start + target
+            cut = lo + int(np.argmin(energy_db[lo:hi]))
+            packed.append((start, cut))
+            start = cut
+        packed.append((start, end))
+    return packed
+
+
+def split_chunks(audio_data: np.ndarray, sample_rate: int) -> List[Dict]:
+    """Find vocal regions and pack them into chunks that fill Whisper's context window."""
+    energy_db, hop = frame_energy_db(audio_data, sample_rate)
+    starts, ends = vad_regions(energy_db)
+    frame = int(VAD_FRAME_SEC * sample_rate)
+    chunks = []
+    for i, (start, end) in enumerate(pack_regions(starts, ends, energy_db)):
+        chunks.append({
+            "label": str(i),
+            "start": start * hop,
+            "end": min(len(audio_data), (end - 1) * hop + frame),
+        })
+    return chunks
+
+
+def transcribe_chunk(model, samples: np.ndarray) -> Dict:
+    """Transcribe one chunk and summarise Whisper's per-segment confidence."""
+    result = model.transcribe(samples, language="en")
+    segments = result.get("segments", [])
+    if segments:
+        avg_logprob = float(np.mean([s.get("avg_logprob", 0.0) for s in segments]))
+        no_speech_prob = float(np.mean([s.get("no_speech_prob", 0.0) for s in segments]))
+    else:
+        avg_logprob, no_speech_prob = 0.0, 1.0
+    return {
+        "text": result.get("text", "").strip(),
+        "avg_logprob": avg_logprob,
+        "no_speech_prob": no_speech_prob,
+        "segments": [
+            {
+                "text": s.get("text", "").strip(),
+                "start": float(s.get("start", 0.0)),
+                "end": float(s.get("end", 0.0)),
+                "avg_logprob": float(s.get("avg_logprob", 0.0)),
+                "no_speech_prob": float(s.get("no_speech_prob", 0.0)),
+                "compression_ratio": float(s.get("compression_ratio", 0.0)),
+            }
+            for s in segments
+        ],
+    }
+
+
+def _transcribe_in_process(model, samples: np.ndarray) -> Dict:
+    with heavy_stage("transcription"):
+        return transcribe_chunk(model, samples)
+
+
+def _run_chunk(chunk: Dict, model, model_name: str) -> None:
+    chunk.update(_transcribe_in_process(model, chunk["samples"]))
+    chunk["model"] = model_name
+
+
+def is_low_confidence(chunk: Dict) -> bool:
+    return (chunk.get("avg_logprob", 0.0) < LOGPROB_THRESHOLD
+            or chunk.get("no_speech_prob", 0.0) > NO_SPEECH_THRESHOLD)
+
+
+def _init_pool_worker(model_name: str, threads: int) -> None:
+    global _worker_model
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+    _worker_model = load_whisper_model(model_name)
+
+
+def _pool_transcribe(samples: np.ndarray) -> Dict:
+    return transcribe_chunk(_worker_model, samples)
+
+
+def get_transcription_pool(model_name: str, workers: int, threads: int) -> ProcessPoolExecutor:
+    """Return a warm worker pool for this model/split, creating it on first use."""
+    key = (model_name, workers, threads)
+    if key not in _pools:
+        print(f"🧵 Starting {workers} Whisper workers ({threads} threads each) for '{model_name}'")
+        # spawn rather than fork: torch thread pools do not survive fork reliably
+        _pools[key] = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_pool_worker,
+            initargs=(model_name, threads),
+        )
+    return _pools[key]
+
+
+def shutdown_transcription_pools() -> None:
+    for pool in _pools.values():
+        pool.shutdown(cancel_futures=True)
+    _pools.clear()
+
+
+def _iter_parallel(chunks: List[Dict], model_name: str, workers: int, threads: int) -> Iterator[Dict]:
+    """Spread chunks over the pool and yield results back in chunk order."""
+    pool = get_transcription_pool(model_name, workers, threads)
+    # The pool takes one CPU slot: its workers split the stage's threads between them
+    with heavy_stage("transcription"):
+        futures = [pool.submit(_pool_transcribe, chunk["samples"]) for chunk in chunks]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            # Early stop: drop chunks nobody will read
+            for future in futures:
+                future.cancel()
+
+
+def iter_chunks(path: str, model_name: str = ACCURATE_MODEL,
+                workers: int = WHISPER_WORKERS, threads: int = WHISPER_THREADS_PER_WORKER) -> Iterator[Dict]:
+    """
+    Transcribe non-silent chunks, yielding each in order as soon as it is ready.
+
+    With workers > 1 the chunks are transcribed concurrently in a process pool.
+    Each yielded chunk keeps its samples so a later pass can re-transcribe it.
+    Stopping iteration early stops transcription.
+    """
+    audio_data, sample_rate = load_audio(path)
+    chunks = split_chunks(audio_data, sample_rate)
+    for chunk in chunks:
+        chunk["samples"] = audio_data[chunk["start"]:chunk["end"]]
+
+    parallel = workers > 1 and len(chunks) > 1
+    if parallel:
+        results = _iter_parallel(chunks, model_name, workers, threads)
+    else:
+        model = load_whisper_model(model_name)
+        results = (_transcribe_in_process(model, chunk["samples"]) for chunk in chunks)
+
+    transcribed_any = False
+    try:
+        for chunk, result in zip(chunks, results):
+            print(f"Chunk {chunk['label']}: {round(len(chunk['samples']) / sample_rate, 2)} seconds ({model_name})")
+            chunk.update(result)
+            chunk["model"] = model_name
+            transcribed_any = transcribed_any or bool(chunk["text"])
+            yield chunk
+    finally:
+        # zip stops before asking for another result (and the caller may stop
+        # early): close the pool iterator so it gives back its CPU slot
+        results.close()
 
-    non_silent_intervals = librosa.effects.split(audio_data, top_db=15)
-
-    model = whisper.load_model("small.en")
-    text_fragments = []
-    with tempfile.TemporaryDirectory() as folder_name:
-        for i, (start, end) in enumerate(non_silent_intervals):
-            duration = (end - start) / sample_rate
-            if duration < MIN_CHUNK_SEC:
-                continue
-            chunk_starts = np.arange(start, end, int(MAX_CHUNK_SEC * sample_rate))
-            for j, chunk_start in enumerate(chunk_starts):
-                chunk_end = min(chunk_start + int(MAX_CHUNK_SEC * sample_rate), end)
-                chunk_file = os.path.join(folder_name, f"chunk{i}_{j}.wav")
-                sf.write(chunk_file, audio_data[chunk_start:chunk_end], sample_rate)
-                print(f"Chunk {i}_{j}: {round((chunk_end-chunk_start)/sample_rate, 2)} seconds")
-                result = model.transcribe(chunk_file, language="en")
-                text = result.get("text", "").strip()
-                if text:
-                    text_fragments.append(text.capitalize() + ".")
     # Fallback if nothing was transcribed
-    if not text_fragments:
+    if not transcribed_any:
         print("No lyrics detected in chunks, trying whole file (first 30 seconds)...")
-        result = model.transcribe(file_name, duration=30, language="en")
-        text = result.get("text", "").strip()
-        if text:
-            text_fragments.append(text.capitalize() + ".")
-    return " ".join(text_fragments)
+        fallback = {"label": "full", "start": 0, "end": min(len(audio_data), 30 * sample_rate)}
+        fallback["samples"] = audio_data[fallback["start"]:fallback["end"]]
+        if parallel:
+            # On the pool too, so the request process never loads its own copy of the model
+            with heavy_stage("transcription"):
+                pool = get_transcription_pool(model_name, workers, threads)
+                fallback.update(pool.submit(_pool_transcribe, fallback["samples"]).result())
+            fallback["model"] = model_name
+        else:
+            _run_chunk(fallback, load_whisper_model(model_name), model_name)
+        yield fallback
+
+
+def transcribe_chunks(path: str, model_name: str = ACCURATE_MODEL,
+                      workers: int = WHISPER_WORKERS, threads: int = WHISPER_THREADS_PER_WORKER) -> List[Dict]:
+    """Transcribe every non-silent chunk of the file with one model."""
+    return list(iter_chunks(path, model_name, workers, threads))
+
+
+def refine_low_confidence(chunks: List[Dict], model_name: str = ACCURATE_MODEL) -> int:
+    """
+    Re-transcribe only the low-confidence chunks with the accurate model.
+
+    Chunks are updated in place. Returns how many chunks were re-transcribed.
+    """
+    pending = [c for c in chunks if c.get("model") != model_name and is_low_confidence(c)]
+    if not pending:
+        return 0
+    model = load_whisper_model(model_name)
+    print(f"🔁 Refining {len(pending)}/{len(chunks)} low-confidence chunks with '{model_name}'")
+    for chunk in pending:
+        _run_chunk(chunk, model, model_name)
+    return len(pending)
+
+
+def chunk_segments(chunks: List[Dict]) -> List[Dict]:
+    """Flatten chunk results into segments with timestamps relative to the whole file."""
+    segments = []
+    for chunk in chunks:
+        offset = chunk["start"] / SAMPLE_RATE
+        for segment in chunk.get("segments", []):
+            segments.append(dict(segment, start=segment["start"] + offset, end=segment["end"] + offset))
+    return segments
+
+
+def extract_segments(path: str, model_name: str = ACCURATE_MODEL) -> List[Dict]:
+    """Transcribe the file and return segments with text, timestamps and confidence fields."""
+    return chunk_segments(transcribe_chunks(path, model_name))
+
+
+def join_transcript(chunks: List[Dict]) -> str:
+    return " ".join(c["text"].capitalize() + "." for c in chunks if c.get("text"))
+
+
+def stream_text(path: str, model_name: str = ACCURATE_MODEL) -> Iterator[str]:
+    """Yield chunk transcripts in order as soon as each one is ready."""
+    for chunk in iter_chunks(path, model_name):
+        if chunk["text"]:
+            yield chunk["text"].capitalize() + "."
+
+
+def extract_text(path: str) -> str:
+    return " ".join(stream_text(path, ACCURATE_MODEL))
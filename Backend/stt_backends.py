@@ -0,0 +1,219 @@
+"""
+Speech-to-text backend registry.
+
+Every engine exposes the same `extract_text(path) -> str` function. This
+module registers them by name, tracks per-backend latency/error statistics
+and adds failover (STT_FAILOVER) and hedged transcription (STT_HEDGE) on top.
+"""
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+from request_budget import check_budget, propagate, cancellable, BudgetExhausted, CallCancelled
+from metrics import upstream_call
+
+STT_BACKEND = os.getenv("STT_BACKEND", "deepgram")
+# Failover: backends tried in order after STT_BACKEND fails or returns no
+# text, e.g. "assemblyai,google". Empty disables failover.
+STT_FAILOVER = [name.strip() for name in os.getenv("STT_FAILOVER", "").split(",") if name.strip()]
+# Hedged mode: start STT_HEDGE_PRIMARY, and if it has not answered after
+# STT_HEDGE_DELAY_SEC also start STT_HEDGE_SECONDARY; first usable text wins
+STT_HEDGE = os.getenv("STT_HEDGE", "false").lower() in ("1", "true", "yes")
+STT_HEDGE_PRIMARY = os.getenv("STT_HEDGE_PRIMARY", "whisper")
+STT_HEDGE_SECONDARY = os.getenv("STT_HEDGE_SECONDARY", "deepgram")
+STT_HEDGE_DELAY_SEC = float(os.getenv("STT_HEDGE_DELAY_SEC", "10"))
+
+
+class BackendStats:
+    """Rolling latency and error statistics for one backend."""
+
+    def __init__(self, window: int = 100):
+        self.calls = 0
+        self.errors = 0
+        self.empty = 0
+        self.cancelled = 0
+        self.last_error: Optional[str] = None
+        self.latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, error: Optional[Exception] = None, empty: bool = False,
+               cancelled: bool = False):
+        with self._lock:
+            self.calls += 1
+            if cancelled:
+                # Stopped by the caller: neither an error nor a meaningful latency
+                self.cancelled += 1
+                return
+            self.latencies.append(latency)
+            if error is not None:
+                self.errors += 1
+                self.last_error = str(error)
+            elif empty:
+                self.empty += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "empty": self.empty,
+            "cancelled": self.cancelled,
+            "error_rate": round(self.errors / self.calls, 3) if self.calls else 0.0,
+            "latency_p50": pct(0.5),
+            "latency_p95": pct(0.95),
+            "last_error": self.last_error,
+        }
+
+
+class STTBackend:
+    def __init__(self, name: str, loader: Callable[[], Callable[[str], str]]):
+        self.name = name
+        self._loader = loader
+        self._fn = None
+        self.stats = BackendStats()
+
+    def extract_text(self, path: str) -> str:
+        # Engines are imported on first use so a missing SDK only disables that engine
+        if self._fn is None:
+            self._fn = self._loader()
+        # Do not start an engine once the request deadline has passed
+        check_budget()
+        start = time.perf_counter()
+        try:
+            with upstream_call(f"stt_{self.name}") as call:
+                text = (self._fn(path) or "").strip()
+                call.outcome = "hit" if text else "miss"
+        except CallCancelled:
+            self.stats.record(time.perf_counter() - start, cancelled=True)
+            raise
+        except Exception as e:
+            self.stats.record(time.perf_counter() - start, error=e)
+            raise
+        self.stats.record(time.perf_counter() - start, empty=not text)
+        return text
+
+
+_backends: Dict[str, STTBackend] = {}
+
+
+def register_backend(name: str, loader: Callable[[], Callable[[str], str]]) -> None:
+    """Register an engine. `loader` returns its extract_text function when first needed."""
+    _backends[name] = STTBackend(name, loader)
+
+
+def get_backend(name: str) -> STTBackend:
+    if name not in _backends:
+        raise ValueError(f"Unknown STT backend '{name}'. Available: {', '.join(_backends)}")
+    return _backends[name]
+
+
+def backend_stats() -> Dict[str, Dict]:
+    return {name: backend.stats.snapshot() for name, backend in _backends.items()}
+
+
+def _load_whisper():
+    from speech_to_text_whisper import extract_text
+    return extract_text
+
+def _load_deepgram():
+    from speech_to_text import extract_text
+    return extract_text
+
+def _load_google():
+    from speech_to_text_google import extract_text
+    return extract_text
+
+def _load_assemblyai():
+    from speech_to_text_assembyAI import extract_text
+    return extract_text
+
+
+register_backend("whisper", _load_whisper)
+register_backend("deepgram", _load_deepgram)
+register_backend("google", _load_google)
+register_backend("assemblyai", _load_assemblyai)
+
+
+def transcribe_with_failover(path: str, order: List[str]) -> str:
+    """Try backends in order, returning the first non-empty transcription."""
+    last_error = None
+    for name in order:
+        try:
+            text = get_backend(name).extract_text(path)
+            if text:
+                return text
+            print(f"⚠️ STT backend '{name}' returned no text, trying next")
+        except BudgetExhausted:
+            raise
+        except Exception as e:
+            print(f"⚠️ STT backend '{name}' failed: {e}")
+            last_error = e
+    if last_error is not None:
+        raise RuntimeError(f"All STT backends failed, last error: {last_error}")
+    return ""
+
+
+def transcribe_hedged(path: str, primary: str = STT_HEDGE_PRIMARY,
+                      secondary: str = STT_HEDGE_SECONDARY,
+                      delay: float = STT_HEDGE_DELAY_SEC) -> str:
+    """
+    Start `primary`; if it has not produced usable text after `delay` seconds
+    (or fails/returns nothing earlier), start `secondary` too. Return whichever
+    produces usable text first; the other one is cancelled.
+    """
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="stt-hedge")
+    cancelled = threading.Event()
+
+    def submit(name: str):
+        return executor.submit(propagate(cancellable(get_backend(name).extract_text, cancelled)), path)
+
+    try:
+        futures = {submit(primary): primary}
+        done, _ = wait(futures, timeout=delay)
+        if not done or not _usable(next(iter(done))):
+            print(f"⏱️ Hedging STT: starting '{secondary}' alongside '{primary}'")
+            futures[submit(secondary)] = secondary
+
+        pending = set(futures)
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _usable(future):
+                    print(f"🏁 STT winner: '{futures[future]}'")
+                    return future.result()
+                if future.exception() is not None:
+                    last_error = future.exception()
+        if last_error is not None:
+            raise RuntimeError(f"Hedged STT failed: {last_error}")
+        return ""
+    finally:
+        # Do not wait for the losing engine: stop its upload if it can be
+        # interrupted (async HTTP backends), otherwise drop its result
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _usable(future) -> bool:
+    return future.exception() is None and bool(future.result())
+
+
+def failover_order(primary: Optional[str] = None, failover: Optional[List[str]] = None) -> List[str]:
+    """`primary` (default STT_BACKEND) followed by the failover backends, without repeats."""
+    primary = primary or STT_BACKEND
+    failover = STT_FAILOVER if failover is None else failover
+    return list(dict.fromkeys([primary] + list(failover)))
+
+
+def extract_text(path: str) -> str:
+    """Transcribe with the configured backend, hedged across two backends or with failover."""
+    if STT_HEDGE:
+        return transcribe_hedged(path)
+    if STT_FAILOVER:
+        return transcribe_with_failover(path, failover_order())
+    return get_backend(STT_BACKEND).extract_text(path)
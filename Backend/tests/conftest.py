@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the Backend modules the same way api.py and main.py do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,87 @@
+import struct
+
+import pytest
+
+import admission
+from admission import AudioRejected, check_audio
+from audio_probe import probe_audio
+
+
+def id3_tag(padding=200):
+    size = bytes((padding >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + size + b"\x00" * padding
+
+
+def flac(seconds=3, sample_rate=44100, channels=2):
+    streaminfo = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    streaminfo += ((sample_rate << 44) | ((channels - 1) << 41) | (15 << 36) | seconds * sample_rate).to_bytes(8, "big")
+    return b"fLaC" + b"\x80\x00\x00\x22" + streaminfo + b"\x00" * 16
+
+
+def mp3(frames=100):
+    # MPEG1 Layer III, 128 kbps, 44.1 kHz, stereo: 417-byte frames
+    return (b"\xff\xfb\x90\x00" + b"\x00" * 413) * frames
+
+
+def adts(frames=50):
+    # MPEG-4 AAC LC, 44.1 kHz, stereo
+    return (b"\xff\xf1\x50\x80\x00\x1f\xfc" + b"\x00" * 100) * frames
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture
+def no_ffprobe(monkeypatch):
+    def missing(path):
+        raise FileNotFoundError("ffprobe")
+    monkeypatch.setattr(admission, "probe_decoded", missing)
+
+
+def test_flac_behind_an_id3_tag(tmp_path):
+    info = probe_audio(write(tmp_path, "song.flac", id3_tag() + flac(seconds=3)))
+    assert (info["format"], info["sample_rate"], info["channels"]) == ("flac", 44100, 2)
+    assert info["duration_sec"] == pytest.approx(3.0)
+
+
+def test_mp3_behind_an_id3_tag(tmp_path):
+    info = probe_audio(write(tmp_path, "song.mp3", id3_tag() + mp3(frames=100)))
+    assert (info["format"], info["sample_rate"], info["channels"]) == ("mp3", 44100, 2)
+    assert info["duration_sec"] == pytest.approx(100 * 417 * 8 / 128000)
+
+
+def test_adts_is_not_mistaken_for_mp3(tmp_path):
+    info = probe_audio(write(tmp_path, "song.aac", adts()))
+    assert (info["format"], info["sample_rate"], info["channels"]) == ("aac", 44100, 2)
+
+
+def test_mismatched_upload_is_left_to_ffprobe(tmp_path, monkeypatch):
+    decoded = {"format": "aac", "duration_sec": 200.0, "sample_rate": 44100, "channels": 2, "size_bytes": 5350}
+    monkeypatch.setattr(admission, "probe_decoded", lambda path: decoded)
+    assert check_audio(write(tmp_path, "song.mp3", adts()), "song.mp3") == decoded
+
+
+def test_mismatched_upload_is_accepted_without_ffprobe(tmp_path, no_ffprobe):
+    info = check_audio(write(tmp_path, "song.mp3", adts()), "song.mp3")
+    assert info["format"] == "aac"
+    assert info["duration_sec"] is None
+
+
+def test_unrecognised_upload_is_accepted_without_ffprobe(tmp_path, no_ffprobe):
+    info = check_audio(write(tmp_path, "song.m4a", b"\x00" * 4096), "song.m4a")
+    assert info["format"] == "unknown"
+
+
+def test_upload_without_audio_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, "probe_decoded", lambda path: None)
+    with pytest.raises(AudioRejected):
+        check_audio(write(tmp_path, "notes.mp3", b"not audio at all" * 100), "notes.mp3")
+
+
+def test_overlong_audio_is_rejected_after_ffprobe(tmp_path, monkeypatch):
+    monkeypatch.setattr(admission, "probe_decoded", lambda path: {"format": "aac", "duration_sec": 3600.0})
+    with pytest.raises(AudioRejected, match="minutes long"):
+        check_audio(write(tmp_path, "song.mp3", adts()), "song.mp3")
@@ -0,0 +1,48 @@
+import os
+import signal
+
+import pytest
+
+import cpu_scheduler
+
+
+@pytest.fixture
+def fresh_plan(monkeypatch):
+    monkeypatch.setattr(cpu_scheduler, "HEAVY_STAGE_SLOTS", 2)
+    monkeypatch.setattr(cpu_scheduler, "_plan", None)
+    monkeypatch.setattr(cpu_scheduler, "_slots", None)
+    monkeypatch.setattr(cpu_scheduler, "_held", None)
+    monkeypatch.setattr(cpu_scheduler, "_worker_index", None)
+    cpu_scheduler.configure_process(2)
+
+
+def free_slots():
+    count = 0
+    while cpu_scheduler._slots.acquire(block=False):
+        count += 1
+    for _ in range(count):
+        cpu_scheduler._slots.release()
+    return count
+
+
+def test_slot_is_released_after_the_stage(fresh_plan):
+    with cpu_scheduler.heavy_stage("embedding"):
+        assert free_slots() == 1
+        assert cpu_scheduler._held[0] == 1
+    assert free_slots() == 2
+    assert cpu_scheduler._held[0] == 0
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_master_reclaims_slots_of_a_killed_worker(fresh_plan):
+    pid = os.fork()
+    if pid == 0:
+        cpu_scheduler._worker_index = 1
+        with cpu_scheduler.heavy_stage("transcription"):
+            os.kill(os.getpid(), signal.SIGKILL)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert free_slots() == 1
+    assert cpu_scheduler.reclaim_worker_slots(1) == 1
+    assert free_slots() == 2
+    assert cpu_scheduler.reclaim_worker_slots(1) == 0
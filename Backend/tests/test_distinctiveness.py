@@ -0,0 +1,54 @@
+import math
+
+import pytest
+
+import distinctiveness
+
+GENERIC = "i love you baby tonight"
+RARE = "scaramouche will you do the fandango"
+
+
+@pytest.fixture
+def fresh_table(monkeypatch):
+    monkeypatch.setattr(distinctiveness, "_table", None)
+    monkeypatch.setattr(distinctiveness, "_table_checked", False)
+
+
+def write_corpus(directory):
+    # Every song says "i love you baby"; only one mentions the fandango
+    for i in range(20):
+        (directory / f"song{i:02d}.txt").write_text(f"i love you baby\nsong number {i} tonight\n")
+    nested = directory / "queen"
+    nested.mkdir()
+    (nested / "bohemian.txt").write_text(f"{RARE}\ni love you baby\n")
+
+
+def test_built_table_ranks_rare_lines_first(fresh_table, tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    write_corpus(corpus)
+    table_path = str(tmp_path / "data" / "ngram_df.npy")
+
+    assert distinctiveness.build_df_table(distinctiveness._read_corpus(str(corpus)), table_path) == 21
+    table = distinctiveness.load_df_table(table_path)
+    assert int(table[0]) == 21
+
+    # "love you" is in every document, "fandango" in one, "bicycle" in none
+    assert distinctiveness.idf("love you") == pytest.approx(math.log(22 / 22) + 1.0)
+    assert distinctiveness.idf("fandango") == pytest.approx(math.log(22 / 2) + 1.0)
+    assert distinctiveness.idf("bicycle") == pytest.approx(math.log(22 / 1) + 1.0)
+    assert distinctiveness.most_distinctive_lines([GENERIC, RARE], max_lines=1) == [RARE]
+
+
+def test_missing_table_falls_back_to_stopwords(fresh_table, tmp_path, monkeypatch):
+    lookups = []
+    exists = distinctiveness.os.path.exists
+    monkeypatch.setattr(distinctiveness.os.path, "exists", lambda path: lookups.append(path) or exists(path))
+
+    assert distinctiveness.load_df_table(str(tmp_path / "missing.npy")) is None
+    assert distinctiveness.idf("you the") == 0.5
+    assert distinctiveness.idf("fandango") == 3.0
+    assert distinctiveness.idf("love fandango") == 2.0
+    assert distinctiveness.most_distinctive_lines([GENERIC, RARE], max_lines=1) == [RARE]
+    # The miss is remembered instead of being looked up again on every idf()
+    assert len(lookups) == 1
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from benchmark import HTML_FIXTURES_DIR
+from html_extract import (
+    extract_lyrics, lyrics_containers_text, lyrics_containers_text_bs4, clean_lyrics_text,
+    google_result_links, google_result_links_bs4
+)
+
+UNCLOSED = '<div data-lyrics-container="true">A<p>B<p>C</div><div>outside text</div>'
+
+
+def fixture_pages():
+    return sorted(f for f in os.listdir(HTML_FIXTURES_DIR) if f.endswith(".html"))
+
+
+def read_page(name):
+    with open(os.path.join(HTML_FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_unclosed_inner_tags_do_not_leak_past_the_container():
+    assert lyrics_containers_text(UNCLOSED) == ["A\nB\nC"]
+
+
+def test_nested_container_tags_are_balanced():
+    html = '<div data-lyrics-container="true">A<div>B</div>C</div><div>outside text</div>'
+    assert lyrics_containers_text(html) == ["A\nB\nC"]
+
+
+def test_script_inside_container_is_skipped():
+    html = '<div data-lyrics-container="true">A<script>var x = 1;</script>B</div>'
+    assert lyrics_containers_text(html) == ["A\nB"]
+
+
+def test_fixture_pages_are_committed():
+    names = fixture_pages()
+    assert any(name.startswith("google") for name in names)
+    assert any(not name.startswith("google") for name in names)
+
+
+@pytest.mark.parametrize("name", fixture_pages())
+def test_fast_path_matches_bs4(name):
+    pytest.importorskip("bs4")
+    html = read_page(name)
+    if name.startswith("google"):
+        assert google_result_links(html) == google_result_links_bs4(html)
+    else:
+        expected = clean_lyrics_text(lyrics_containers_text_bs4(html))
+        assert expected
+        assert extract_lyrics(html) == expected
+
+
+def test_short_containers_fall_through_to_next_selectors():
+    pytest.importorskip("bs4")
+    lyrics = extract_lyrics(read_page("genius_short_containers.html"))
+    assert lyrics.startswith("These lyrics sit in the old layout")
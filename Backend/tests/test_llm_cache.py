@@ -0,0 +1,145 @@
+"""
+LLM cleaning cache and pinned Ollama client against a stand-in Ollama server.
+
+The stand-in answers POST /api/chat like Ollama does (non-streaming) and
+keeps the request bodies so the payload can be checked. `delay` makes it a
+slow model.
+"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_cleaner
+
+
+class OllamaStandIn:
+    def __init__(self, delay=0.0):
+        self.bodies = []
+        self.delay = delay
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                stand_in.bodies.append(body)
+                time.sleep(stand_in.delay)
+                payload = json.dumps({
+                    "model": body["model"],
+                    "created_at": "2026-01-01T00:00:00Z",
+                    "message": {"role": "assistant", "content": f"cleaned #{len(stand_in.bodies)}"},
+                    "done": True,
+                    "prompt_eval_count": 42,
+                    "eval_count": 7,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def ollama(monkeypatch, tmp_path):
+    stand_in = OllamaStandIn()
+    monkeypatch.setattr(llm_cleaner, "OLLAMA_HOST", stand_in.host)
+    monkeypatch.setattr(llm_cleaner, "_client", None)
+    monkeypatch.setattr(llm_cleaner, "_transport", None)
+    monkeypatch.setattr(llm_cleaner, "LLM_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(llm_cleaner, "_stats", dict.fromkeys(llm_cleaner._stats, 0))
+    yield stand_in
+    stand_in.close()
+
+
+def cache_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+
+
+def test_cache_hit_skips_the_model_call(ollama):
+    first = llm_cleaner.clean_with_model("Is this the real life", "stand-in-model")
+    # Whitespace and case differences hit the same entry
+    second = llm_cleaner.clean_with_model("  is this the   REAL life ", "stand-in-model")
+    assert first == second == "cleaned #1"
+    assert len(ollama.bodies) == 1
+    stats = llm_cleaner.llm_stats()
+    assert (stats["cache_hits"], stats["cache_misses"]) == (1, 1)
+    assert (stats["prompt_tokens"], stats["completion_tokens"]) == (42, 7)
+
+
+def test_each_model_has_its_own_entry(ollama):
+    llm_cleaner.clean_with_model("Is this just fantasy", "small")
+    llm_cleaner.clean_with_model("Is this just fantasy", "large")
+    assert [body["model"] for body in ollama.bodies] == ["small", "large"]
+
+
+def test_chat_payload_pins_the_model_session(ollama):
+    llm_cleaner.clean_with_model("Caught in a landslide", "stand-in-model")
+    body = ollama.bodies[0]
+    assert body["model"] == "stand-in-model"
+    assert body["keep_alive"] == llm_cleaner.OLLAMA_KEEP_ALIVE
+    assert body["options"] == {"num_ctx": llm_cleaner.OLLAMA_NUM_CTX, "temperature": 0}
+    assert body["stream"] is False
+    assert "Caught in a landslide" in body["messages"][0]["content"]
+
+
+def test_one_connection_pool_serves_every_request(ollama):
+    llm_cleaner.clean_with_model("No escape from reality", "stand-in-model")
+    client = llm_cleaner.get_client()
+    llm_cleaner.clean_with_model("Open your eyes", "stand-in-model", timeout=5)
+    assert llm_cleaner.get_client() is client
+    assert llm_cleaner.get_client(5)._client._transport is client._client._transport
+
+
+def test_slow_model_is_abandoned_at_the_budget(ollama, monkeypatch):
+    ollama.delay = 2.0
+    monkeypatch.setattr(llm_cleaner, "LLM_SMALL_MODEL", "small")
+    monkeypatch.setattr(llm_cleaner, "LLM_MODEL", "large")
+    monkeypatch.setattr(llm_cleaner, "CLEAN_QUALITY_THRESHOLD", 1.1)
+
+    start = time.monotonic()
+    cleaned = llm_cleaner.clean_lyrics_with_llama3("Thunderbolt and lightning", budget_sec=0.3)
+    assert time.monotonic() - start < 1.5
+    assert cleaned != "cleaned #1"
+    # The small model's call timed out; the large one was never started
+    assert [body["model"] for body in ollama.bodies] == ["small"]
+    assert llm_cleaner.llm_stats()["budget_exhausted"] == 1
+
+
+def test_timeout_raises_and_caches_nothing(ollama, tmp_path):
+    ollama.delay = 2.0
+    with pytest.raises(TimeoutError):
+        llm_cleaner.clean_with_model("Very very frightening", "stand-in-model", timeout=0.2)
+    assert cache_files(tmp_path) == []
+
+
+def test_least_recently_used_entry_is_evicted(ollama, monkeypatch, tmp_path):
+    monkeypatch.setattr(llm_cleaner, "LLM_CACHE_MAX_ENTRIES", 2)
+    llm_cleaner.clean_with_model("first line", "m")
+    llm_cleaner.clean_with_model("second line", "m")
+    first, second = (os.path.join(tmp_path, f"{llm_cleaner._cache_key(text, 'm')}.json")
+                     for text in ("first line", "second line"))
+    now = time.time()
+    os.utime(first, (now - 200, now - 200))
+    os.utime(second, (now - 100, now - 100))
+
+    # A hit refreshes the first entry, so adding a third evicts the second
+    assert llm_cleaner.clean_with_model("first line", "m") == "cleaned #1"
+    llm_cleaner.clean_with_model("third line", "m")
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+    assert len(cache_files(tmp_path)) == 2
+    assert len(ollama.bodies) == 3
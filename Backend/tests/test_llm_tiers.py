@@ -0,0 +1,41 @@
+import pytest
+
+import llm_cleaner
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    monkeypatch.setattr(llm_cleaner, "_stats", {name: 0 for name in llm_cleaner._stats})
+    monkeypatch.setattr(llm_cleaner, "LLM_SMALL_MODEL", "small")
+    monkeypatch.setattr(llm_cleaner, "LLM_MODEL", "large")
+    monkeypatch.setattr(llm_cleaner, "CLEAN_QUALITY_THRESHOLD", 0.9)
+    return llm_cleaner._stats
+
+
+def use_scores(monkeypatch, scores, outputs):
+    monkeypatch.setattr(llm_cleaner, "rule_based_clean", lambda text: "rules")
+    monkeypatch.setattr(llm_cleaner, "quality_score", lambda text: scores[text])
+    monkeypatch.setattr(llm_cleaner, "clean_with_model", lambda text, model, timeout=None: outputs[model])
+
+
+def test_passing_tier_is_counted(stats, monkeypatch):
+    use_scores(monkeypatch, {"rules": 0.5, "small text": 0.95}, {"small": "small text"})
+    assert llm_cleaner.clean_lyrics_with_llama3("raw") == "small text"
+    assert (stats["tier_rules"], stats["tier_small"], stats["tier_large"]) == (0, 1, 0)
+    assert stats["below_threshold"] == 0
+
+
+def test_tier_used_is_counted_when_none_passes(stats, monkeypatch):
+    use_scores(monkeypatch, {"rules": 0.5, "small text": 0.7, "large text": 0.6},
+               {"small": "small text", "large": "large text"})
+    assert llm_cleaner.clean_lyrics_with_llama3("raw") == "small text"
+    assert (stats["tier_rules"], stats["tier_small"], stats["tier_large"]) == (0, 1, 0)
+    assert stats["below_threshold"] == 1
+
+
+def test_rules_are_counted_when_every_model_is_worse(stats, monkeypatch):
+    use_scores(monkeypatch, {"rules": 0.5, "small text": 0.2, "large text": 0.3},
+               {"small": "small text", "large": "large text"})
+    assert llm_cleaner.clean_lyrics_with_llama3("raw") == "rules"
+    assert stats["tier_rules"] == 1
+    assert stats["below_threshold"] == 1
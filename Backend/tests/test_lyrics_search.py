@@ -0,0 +1,36 @@
+import lyrics_search
+from candidate_tracker import CandidateTracker
+
+LYRICS = "Is this the real life\nIs this just fantasy\nCaught in a landslide\nNo escape from reality"
+
+
+class FakeGenius:
+    """Answers every search with the same full page of songs."""
+
+    def __init__(self, songs):
+        self.songs = songs
+        self.queries = []
+
+    def search_songs(self, term, per_page=10):
+        self.queries.append(term)
+        return {"hits": [
+            {"highlights": [], "result": {
+                "_type": "song", "title": title, "url": f"https://genius.com/{title.replace(' ', '-')}-lyrics",
+                "primary_artist": {"name": "Queen"},
+            }}
+            for title in self.songs[:per_page]
+        ]}
+
+
+def test_tracker_scores_the_page_that_fills_the_results(monkeypatch):
+    genius = FakeGenius(["Bohemian Rhapsody", "Somebody to Love", "We Are the Champions"])
+    monkeypatch.setattr(lyrics_search, "get_genius", lambda: genius)
+    tracker = CandidateTracker(LYRICS)
+
+    results = lyrics_search.search_by_lyrics_api_enhanced(LYRICS, max_results=3, tracker=tracker)
+
+    # The first term fills the results, so it is the only search
+    assert len(genius.queries) == 1
+    assert len(results) == 3
+    assert set(tracker.scores) == {r["genius_url"] for r in results}
+    assert all(tracker.hits[r["genius_url"]] == 1 for r in results)
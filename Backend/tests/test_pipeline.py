@@ -0,0 +1,51 @@
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def build(clean_delay: float, spec_delay: float, similarity: int) -> Pipeline:
+    def clean(raw):
+        time.sleep(clean_delay)
+        return raw.upper()
+
+    def spec(raw):
+        time.sleep(spec_delay)
+        return [{"similarity": similarity}]
+
+    return Pipeline([
+        Stage("transcribe", lambda audio: "hello there", inputs=("audio",), outputs={"raw": str}),
+        Stage("clean", clean, inputs=("raw",), outputs={"cleaned": str}),
+        Stage("spec", spec, inputs=("raw",), outputs={"spec_results": list},
+              shortcut_if=lambda o: o["spec_results"][0]["similarity"] >= 80,
+              shortcut={"results": "spec_results", "cleaned": "raw"}),
+        Stage("rank", lambda cleaned: [{"similarity": 50, "text": cleaned}], inputs=("cleaned",),
+              outputs={"results": list}, after=("spec",)),
+    ], inputs={"audio": str}, targets=("results", "cleaned"))
+
+
+def run(pipeline):
+    events = []
+    values = pipeline.run({"audio": "clip.wav"}, events.append)
+    return values, events
+
+
+def test_shortcut_keeps_cleaned_text_when_clean_finished_first():
+    values, events = run(build(clean_delay=0, spec_delay=0.2, similarity=90))
+    assert values["cleaned"] == "HELLO THERE"
+    assert values["results"] == [{"similarity": 90}]
+    shortcut = next(e for e in events if e["status"] == "shortcut")
+    assert shortcut["provides"] == ["results"]
+
+
+def test_shortcut_provides_cleaned_when_clean_is_still_running():
+    values, events = run(build(clean_delay=0.3, spec_delay=0, similarity=90))
+    assert values["results"] == [{"similarity": 90}]
+    shortcut = next(e for e in events if e["status"] == "shortcut")
+    assert "cleaned" in shortcut["provides"]
+    assert values["cleaned"] in ("hello there", "HELLO THERE")
+
+
+def test_no_shortcut_runs_the_full_graph():
+    values, events = run(build(clean_delay=0, spec_delay=0, similarity=50))
+    assert values["results"] == [{"similarity": 50, "text": "HELLO THERE"}]
+    assert not any(e["status"] == "shortcut" for e in events)
@@ -0,0 +1,217 @@
+"""
+STT failover and hedging against stand-in HTTP servers.
+
+Each stand-in answers POST requests with a fixed status and JSON body, the
+way the remote engines do, optionally after a delay. Most tests register
+small backends that call the stand-ins with urllib; the Deepgram tests
+drive speech_to_text and its pooled httpx client.
+"""
+import json
+import time
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import stt_backends
+
+
+class StandIn:
+    """Local HTTP server that answers every POST with `status` and `body`."""
+
+    def __init__(self, status=200, body=None, delay=0.0):
+        self.status = status
+        self.body = body if body is not None else {}
+        self.delay = delay
+        self.requests = 0
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stand_in.requests += 1
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                time.sleep(stand_in.delay)
+                payload = json.dumps(stand_in.body).encode()
+                self.send_response(stand_in.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/listen"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_ins():
+    servers = []
+
+    def start(status=200, body=None, delay=0.0):
+        server = StandIn(status, body, delay)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def register_http_backend(name, url):
+    def loader():
+        def extract_text(path):
+            request = urllib.request.Request(url, data=b"\0" * 32, method="POST")
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return json.load(response)["transcript"]
+        return extract_text
+    stt_backends.register_backend(name, loader)
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    before = dict(stt_backends._backends)
+    yield
+    stt_backends._backends.clear()
+    stt_backends._backends.update(before)
+
+
+def test_failover_skips_failing_and_empty_backends(stand_ins, monkeypatch):
+    down = stand_ins(503, {"error": "unavailable"})
+    empty = stand_ins(200, {"transcript": ""})
+    working = stand_ins(200, {"transcript": "started out with a kiss"})
+    register_http_backend("test_down", down.url)
+    register_http_backend("test_empty", empty.url)
+    register_http_backend("test_working", working.url)
+    monkeypatch.setattr(stt_backends, "STT_HEDGE", False)
+    monkeypatch.setattr(stt_backends, "STT_BACKEND", "test_down")
+    monkeypatch.setattr(stt_backends, "STT_FAILOVER", ["test_empty", "test_working"])
+
+    assert stt_backends.extract_text("song.wav") == "started out with a kiss"
+    assert (down.requests, empty.requests, working.requests) == (1, 1, 1)
+    stats = stt_backends.backend_stats()
+    assert stats["test_down"]["errors"] == 1
+    assert stats["test_empty"]["empty"] == 1
+
+
+def test_failover_raises_when_every_backend_fails(stand_ins):
+    register_http_backend("test_down_a", stand_ins(500).url)
+    register_http_backend("test_down_b", stand_ins(502).url)
+    with pytest.raises(RuntimeError, match="All STT backends failed"):
+        stt_backends.transcribe_with_failover("song.wav", ["test_down_a", "test_down_b"])
+
+
+def test_without_failover_only_the_primary_is_called(stand_ins, monkeypatch):
+    primary = stand_ins(503)
+    spare = stand_ins(200, {"transcript": "never used"})
+    register_http_backend("test_primary", primary.url)
+    register_http_backend("test_spare", spare.url)
+    monkeypatch.setattr(stt_backends, "STT_HEDGE", False)
+    monkeypatch.setattr(stt_backends, "STT_BACKEND", "test_primary")
+    monkeypatch.setattr(stt_backends, "STT_FAILOVER", [])
+    with pytest.raises(Exception):
+        stt_backends.extract_text("song.wav")
+    assert spare.requests == 0
+
+
+def test_failover_order_puts_the_primary_first_once():
+    assert stt_backends.failover_order("deepgram", ["assemblyai", "deepgram", "google"]) == [
+        "deepgram", "assemblyai", "google"]
+
+
+
+def deepgram_body(transcript):
+    return {"results": {"channels": [{"alternatives": [{"transcript": transcript}]}]}}
+
+
+@pytest.fixture
+def deepgram(monkeypatch):
+    """speech_to_text pointed at a stand-in, with decoding replaced by silence."""
+    import speech_to_text
+
+    def point_at(stand_in):
+        monkeypatch.setattr(speech_to_text, "DEEPGRAM_URL", stand_in.url)
+    monkeypatch.setattr(speech_to_text, "decode_pcm16", lambda path, rate: b"\0" * 3200)
+    monkeypatch.setattr(speech_to_text, "DEEPGRAM_API_KEY", "stand-in-key")
+    return point_at
+
+
+def test_deepgram_backend_fails_over_to_the_next_engine(stand_ins, deepgram):
+    down = stand_ins(503, {"err_msg": "overloaded"})
+    working = stand_ins(200, {"transcript": "how did it end up like this"})
+    deepgram(down)
+    register_http_backend("test_working", working.url)
+
+    text = stt_backends.transcribe_with_failover("song.wav", ["deepgram", "test_working"])
+    assert text == "how did it end up like this"
+    assert down.requests == 1
+
+
+def test_hedge_secondary_wins_when_primary_is_slow(stand_ins):
+    slow = stand_ins(200, {"transcript": "too late"}, delay=2.0)
+    fast = stand_ins(200, {"transcript": "coming out of my cage"})
+    register_http_backend("test_slow", slow.url)
+    register_http_backend("test_fast", fast.url)
+
+    start = time.monotonic()
+    text = stt_backends.transcribe_hedged("song.wav", "test_slow", "test_fast", delay=0.2)
+    elapsed = time.monotonic() - start
+    assert text == "coming out of my cage"
+    assert 0.2 <= elapsed < 1.5
+    assert (slow.requests, fast.requests) == (1, 1)
+
+
+def test_hedge_starts_secondary_at_once_when_primary_fails(stand_ins):
+    register_http_backend("test_down", stand_ins(503).url)
+    register_http_backend("test_fast", stand_ins(200, {"transcript": "and I've been doing just fine"}).url)
+
+    start = time.monotonic()
+    text = stt_backends.transcribe_hedged("song.wav", "test_down", "test_fast", delay=5.0)
+    assert text == "and I've been doing just fine"
+    assert time.monotonic() - start < 2.0
+
+
+def test_hedge_does_not_start_secondary_when_primary_answers_in_time(stand_ins):
+    primary = stand_ins(200, {"transcript": "gotta gotta be down"})
+    secondary = stand_ins(200, {"transcript": "never used"})
+    register_http_backend("test_primary", primary.url)
+    register_http_backend("test_secondary", secondary.url)
+
+    text = stt_backends.transcribe_hedged("song.wav", "test_primary", "test_secondary", delay=1.0)
+    assert text == "gotta gotta be down"
+    assert secondary.requests == 0
+
+
+def test_hedge_raises_when_both_engines_fail(stand_ins):
+    register_http_backend("test_down_a", stand_ins(500).url)
+    register_http_backend("test_down_b", stand_ins(502).url)
+    with pytest.raises(RuntimeError, match="Hedged STT failed"):
+        stt_backends.transcribe_hedged("song.wav", "test_down_a", "test_down_b", delay=5.0)
+
+
+def test_hedge_cancels_the_losing_deepgram_upload(stand_ins, deepgram):
+    slow = stand_ins(200, deepgram_body("too late"), delay=3.0)
+    fast = stand_ins(200, {"transcript": "because I want it all"})
+    deepgram(slow)
+    register_http_backend("test_fast", fast.url)
+    before = stt_backends.backend_stats()["deepgram"]
+
+    start = time.monotonic()
+    text = stt_backends.transcribe_hedged("song.wav", "deepgram", "test_fast", delay=0.2)
+    assert text == "because I want it all"
+    assert time.monotonic() - start < 1.5
+    # The loser notices the cancellation within one poll interval
+    for _ in range(40):
+        if stt_backends.backend_stats()["deepgram"]["cancelled"] > before["cancelled"]:
+            break
+        time.sleep(0.05)
+    stats = stt_backends.backend_stats()["deepgram"]
+    assert stats["cancelled"] == before["cancelled"] + 1
+    assert stats["errors"] == before["errors"]
@@ -0,0 +1,16 @@
+import tracing
+
+
+def test_debug_is_denied_without_a_configured_token(monkeypatch):
+    monkeypatch.setattr(tracing, "DEBUG_TOKEN", "")
+    assert not tracing.debug_allowed(None)
+    assert not tracing.debug_allowed("")
+    assert not tracing.debug_allowed("anything")
+
+
+def test_debug_requires_the_matching_token(monkeypatch):
+    monkeypatch.setattr(tracing, "DEBUG_TOKEN", "s3cret")
+    assert tracing.debug_allowed("s3cret")
+    assert not tracing.debug_allowed("wrong")
+    assert not tracing.debug_allowed("sécret")
+    assert not tracing.debug_allowed(None)
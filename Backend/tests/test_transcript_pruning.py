@@ -0,0 +1,38 @@
+from transcript_pruning import prune_segments, pruned_transcript
+
+
+def segment(text, avg_logprob=-0.2, no_speech_prob=0.1, compression_ratio=1.2):
+    return {"text": text, "avg_logprob": avg_logprob, "no_speech_prob": no_speech_prob,
+            "compression_ratio": compression_ratio, "start": 0.0, "end": 1.0}
+
+
+def test_unreliable_segments_are_dropped():
+    segments = [segment("Started out with a kiss"), segment("thank you for watching", avg_logprob=-1.6)]
+    text, report = pruned_transcript(segments, "unused")
+    assert text == "Started out with a kiss"
+    assert report["segments_after"] == 1
+    assert report["dropped"] == {"low_logprob": 1}
+    assert not report["fallback"]
+
+
+def test_repeats_beyond_the_limit_are_dropped():
+    kept, report = prune_segments([segment("la la la")] * 5)
+    assert len(kept) == 2
+    assert report["dropped"] == {"repeated": 3}
+
+
+def test_falls_back_to_the_unpruned_text_when_nothing_is_kept():
+    segments = [segment("how did it end up like this", avg_logprob=-1.4),
+                segment("it was only a kiss", no_speech_prob=0.9, avg_logprob=-1.2)]
+    text, report = pruned_transcript(segments, "How did it end up like this. It was only a kiss.")
+    assert text == "How did it end up like this. It was only a kiss."
+    assert report["fallback"]
+    # Nothing was actually removed from the transcription
+    assert report["segments_after"] == report["segments_before"]
+    assert report["tokens_saved"] == 0
+
+
+def test_no_fallback_for_genuinely_empty_audio():
+    text, report = pruned_transcript([segment("   ")], "")
+    assert text == ""
+    assert not report["fallback"]
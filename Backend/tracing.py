@@ -0,0 +1,329 @@
+"""
+Per-request tracing and on-demand profiling.
+
+Every identification gets a trace. Pipeline stages and outbound calls open
+nested spans (metrics.stage_timer and metrics.upstream_call do it, as do the
+functions decorated with @traced), each carrying its duration, the RSS and
+peak-RSS change while it ran, the thread it ran on and free-form attributes.
+The current span is kept in a ContextVar, so work handed to executors
+through request_budget.propagate is attached to the right parent.
+
+A request sent with `X-Debug-Profile: 1` (or `?profile=1`) is also profiled:
+a sampler thread records the Python stacks of the threads working inside the
+trace every PROFILE_INTERVAL_MS, and tracemalloc reports the lines that
+allocated the most. Only one request is profiled at a time. The last
+TRACE_BUFFER_SIZE traces are kept per worker and served as JSON from
+/debug/traces/{id}. Profiling and the debug endpoints require an
+`X-Debug-Token` header matching DEBUG_TOKEN, and stay off while it is unset.
+"""
+import os
+import sys
+import hmac
+import time
+import uuid
+import resource
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "200"))
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "2000"))
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "true").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
+# Token for profiling and /debug/traces (empty = both disabled)
+DEBUG_TOKEN = os.getenv("DEBUG_TOKEN", "")
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("span", default=None)
+_traces = OrderedDict()
+_traces_lock = threading.Lock()
+_profile_lock = threading.Lock()
+
+
+def _rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return 0
+
+
+def _max_rss_kb() -> int:
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "thread", "start", "end", "attrs",
+                 "rss_start", "max_rss_start", "rss_delta_kb", "peak_rss_delta_kb", "error")
+
+    def __init__(self, name: str, parent_id: Optional[int], span_id: int, attrs: Dict):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.name = name
+        self.thread = threading.current_thread().name
+        self.attrs = attrs
+        self.error = None
+        self.end = None
+        self.rss_delta_kb = self.peak_rss_delta_kb = None
+        self.rss_start = _rss_kb()
+        self.max_rss_start = _max_rss_kb()
+        self.start = time.perf_counter()
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def finish(self) -> None:
+        self.end = time.perf_counter()
+        self.rss_delta_kb = _rss_kb() - self.rss_start
+        self.peak_rss_delta_kb = _max_rss_kb() - self.max_rss_start
+
+
+class Trace:
+    def __init__(self, name: str, profile: bool = False):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans: List[Span] = []
+        self.dropped_spans = 0
+        self.active_threads = Counter()  # thread ident -> open spans of this trace
+        self.profile: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._sampler = None
+        self._started_tracemalloc = False
+        if profile:
+            self._start_profile()
+
+    def open_span(self, name: str, parent: Optional[Span], attrs: Dict) -> Optional[Span]:
+        with self._lock:
+            if len(self.spans) >= TRACE_MAX_SPANS:
+                self.dropped_spans += 1
+                return None
+            self._next_id += 1
+            span = Span(name, parent.span_id if parent else None, self._next_id, attrs)
+            self.spans.append(span)
+            self.active_threads[threading.get_ident()] += 1
+        return span
+
+    def close_span(self, span: Span) -> None:
+        span.finish()
+        with self._lock:
+            ident = threading.get_ident()
+            self.active_threads[ident] -= 1
+            if self.active_threads[ident] <= 0:
+                del self.active_threads[ident]
+
+    def _start_profile(self) -> None:
+        if not PROFILING_ENABLED:
+            self.profile = {"skipped": "profiling is disabled (PROFILING_ENABLED=false)"}
+            return
+        if not _profile_lock.acquire(blocking=False):
+            self.profile = {"skipped": "another request is being profiled"}
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            self._started_tracemalloc = True
+        self._sampler = _StackSampler(self)
+        self._sampler.start()
+
+    def _finish_profile(self) -> None:
+        if self._sampler is None:
+            return
+        self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        _profile_lock.release()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        self.profile = {
+            "cpu": self._sampler.report(),
+            "memory": {
+                "traced_current_kb": current // 1024,
+                "traced_peak_kb": peak // 1024,
+                "top_allocations": [
+                    {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                     "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:PROFILE_TOP]
+                ],
+            },
+        }
+        self._sampler = None
+
+    def finish(self) -> None:
+        self.end = time.perf_counter()
+        self._finish_profile()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            spans = list(self.spans)
+        now = time.perf_counter()
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "in_progress": self.end is None,
+            "duration_ms": round(((self.end or now) - self.start) * 1000, 1),
+            "dropped_spans": self.dropped_spans,
+            "spans": [
+                {
+                    "id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "name": span.name,
+                    "thread": span.thread,
+                    "start_ms": round((span.start - self.start) * 1000, 1),
+                    "duration_ms": round(((span.end or now) - span.start) * 1000, 1),
+                    "in_progress": span.end is None,
+                    "rss_delta_kb": span.rss_delta_kb,
+                    "peak_rss_delta_kb": span.peak_rss_delta_kb,
+                    "error": span.error,
+                    "attrs": span.attrs,
+                }
+                for span in spans
+            ],
+            "profile": self.profile,
+        }
+
+
+class _StackSampler(threading.Thread):
+    """Samples the Python stacks of the threads that have a span of `trace` open."""
+
+    def __init__(self, trace: Trace):
+        super().__init__(name="trace-profiler", daemon=True)
+        self.trace = trace
+        self.interval = PROFILE_INTERVAL_MS / 1000
+        self.samples = 0
+        self.stacks = Counter()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            with self.trace._lock:
+                threads = list(self.trace.active_threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples += 1
+                self.stacks[";".join(stack)] += 1
+                self.self_counts[stack[-1]] += 1
+                for function in set(stack):
+                    self.total_counts[function] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def report(self) -> Dict:
+        return {
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "samples": self.samples,
+            "top_self": [{"function": f, "samples": n} for f, n in self.self_counts.most_common(PROFILE_TOP)],
+            "top_total": [{"function": f, "samples": n} for f, n in self.total_counts.most_common(PROFILE_TOP)],
+            # Collapsed stacks, as consumed by flamegraph.pl / speedscope
+            "folded": dict(self.stacks.most_common(PROFILE_TOP * 10)),
+        }
+
+
+def start_trace(name: str, profile: bool = False):
+    """Open a trace for the current request. Returns (trace, token) for finish_trace, or (None, None)."""
+    if not TRACE_ENABLED:
+        return None, None
+    trace = Trace(name, profile)
+    with _traces_lock:
+        _traces[trace.trace_id] = trace
+        while len(_traces) > TRACE_BUFFER_SIZE:
+            _traces.popitem(last=False)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace: Optional[Trace], token) -> None:
+    if trace is None:
+        return
+    trace.finish()
+    _current_trace.reset(token)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a nested span of the current trace; yields the Span (or None outside a trace)."""
+    trace = _current_trace.get()
+    opened = trace.open_span(name, _current_span.get(), attrs) if trace is not None else None
+    if opened is None:
+        yield None
+        return
+    token = _current_span.set(opened)
+    try:
+        yield opened
+    except BaseException as e:
+        opened.error = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        _current_span.reset(token)
+        trace.close_span(opened)
+
+
+def traced(name: str):
+    """Decorator that runs the function in a span and records the size of its result."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as current:
+                result = fn(*args, **kwargs)
+                if current is not None and hasattr(result, "__len__"):
+                    current.set(result_size=len(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def set_attributes(**attrs) -> None:
+    """Attach attributes to the innermost open span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attrs)
+
+
+def get_trace(trace_id: str) -> Optional[Dict]:
+    with _traces_lock:
+        trace = _traces.get(trace_id)
+    return trace.to_dict() if trace else None
+
+
+def recent_traces(limit: int = 50) -> List[Dict]:
+    with _traces_lock:
+        traces = list(_traces.values())[-limit:]
+    now = time.perf_counter()
+    return [
+        {"trace_id": t.trace_id, "name": t.name, "started_at": t.started_at, "in_progress": t.end is None,
+         "duration_ms": round(((t.end or now) - t.start) * 1000, 1), "spans": len(t.spans),
+         "profiled": bool(t.profile and "skipped" not in t.profile) or t._sampler is not None}
+        for t in reversed(traces)
+    ]
+
+
+def debug_allowed(token: Optional[str]) -> bool:
+    # Deny by default: traces hold filenames, stacks and timings of every request
+    return bool(DEBUG_TOKEN) and token is not None and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
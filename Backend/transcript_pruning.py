@@ -0,0 +1,90 @@
+import os
+import re
+from typing import List, Dict, Tuple
+
+# Drop thresholds, in line with Whisper's own decoding heuristics
+PRUNE_LOGPROB = float(os.getenv("PRUNE_LOGPROB", "-1.0"))
+PRUNE_NO_SPEECH = float(os.getenv("PRUNE_NO_SPEECH", "0.6"))
+PRUNE_COMPRESSION_RATIO = float(os.getenv("PRUNE_COMPRESSION_RATIO", "2.4"))
+# How many times the same line may appear before further copies are dropped
+PRUNE_MAX_REPEATS = int(os.getenv("PRUNE_MAX_REPEATS", "2"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count (~4 characters per token for English)."""
+    return (len(text) + 3) // 4
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'[^a-z0-9 ]', '', text.lower()).strip()
+
+
+def drop_reason(segment: Dict) -> str:
+    """Why a segment should be dropped, or '' to keep it."""
+    if not _normalize(segment.get("text", "")):
+        return "empty"
+    if segment.get("no_speech_prob", 0.0) > PRUNE_NO_SPEECH and segment.get("avg_logprob", 0.0) < PRUNE_LOGPROB:
+        return "no_speech"
+    if segment.get("avg_logprob", 0.0) < PRUNE_LOGPROB:
+        return "low_logprob"
+    if segment.get("compression_ratio", 0.0) > PRUNE_COMPRESSION_RATIO:
+        return "repetitive"
+    return ""
+
+
+def prune_segments(segments: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """
+    Drop low-confidence, hallucinated and repeated segments.
+
+    Returns (kept_segments, report) where the report counts drops by reason
+    and the estimated LLM tokens saved.
+    """
+    kept = []
+    seen = {}
+    dropped = {}
+    for segment in segments:
+        reason = drop_reason(segment)
+        if not reason:
+            key = _normalize(segment["text"])
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > PRUNE_MAX_REPEATS:
+                reason = "repeated"
+        if reason:
+            dropped[reason] = dropped.get(reason, 0) + 1
+        else:
+            kept.append(segment)
+
+    tokens_before = sum(estimate_tokens(s.get("text", "")) for s in segments)
+    tokens_after = sum(estimate_tokens(s["text"]) for s in kept)
+    report = {
+        "segments_before": len(segments),
+        "segments_after": len(kept),
+        "dropped": dropped,
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+    }
+    return kept, report
+
+
+def join_segments(segments: List[Dict]) -> str:
+    """One segment per line, so downstream line-based search strategies see real lyric lines."""
+    return "\n".join(s["text"] for s in segments)
+
+
+def pruned_transcript(segments: List[Dict], unpruned_text: str) -> Tuple[str, Dict]:
+    """
+    Pruned transcription and its report. If pruning would drop every
+    segment, `unpruned_text` is returned instead (report["fallback"] is
+    True): a doubtful transcription still gives search something to work
+    with, an empty one fails the request.
+    """
+    kept, report = prune_segments(segments)
+    text = join_segments(kept).strip()
+    report["fallback"] = not text and bool(unpruned_text.strip())
+    if report["fallback"]:
+        text = unpruned_text.strip()
+        report["segments_after"] = report["segments_before"]
+        report["tokens_after"] = report["tokens_before"]
+        report["tokens_saved"] = 0
+    return text, report
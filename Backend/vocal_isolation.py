@@ -1,8 +1,24 @@
 import os
-import shutil
-from spleeter.separator import Separator
+import threading
+from cpu_scheduler import heavy_stage, configure_tensorflow
+from metrics import timed_stage
 
+_separator = None
+_separator_lock = threading.Lock()
 
+
+def get_separator():
+    """Spleeter 2-stem separator, created (and TensorFlow imported) on first use."""
+    global _separator
+    with _separator_lock:
+        if _separator is None:
+            configure_tensorflow()
+            from spleeter.separator import Separator
+            _separator = Separator('spleeter:2stems')
+    return _separator
+
+
+@timed_stage("isolation")
 def isolate_vocals(input_path: str, output_folder: str = "separated_audio") -> str:
     """
     Isolate vocals from the input audio using Spleeter (2 stems).
@@ -16,11 +32,12 @@ def isolate_vocals(input_path: str, output_folder: str = "separated_audio") -> s
     """
     print("🎤 Isolating vocals...")
     
-    # Create a Spleeter separator (2 stems: vocals + accompaniment)
-    separator = Separator('spleeter:2stems')
+    # Spleeter separator (2 stems: vocals + accompaniment), shared between calls
+    separator = get_separator()
     
     # Separate the audio file
-    separator.separate_to_file(input_path, output_folder)
+    with heavy_stage("separation"):
+        separator.separate_to_file(input_path, output_folder)
 
     # Get the filename without extension
     file_stem = os.path.splitext(os.path.basename(input_path))[0]
@@ -10,6 +10,7 @@ function App() {
   const [processingStage, setProcessingStage] = useState(null);
   const [progress, setProgress] = useState(0);
   const fileInputRef = useRef(null);
+  const resultsRequestRef = useRef(0);
 
   const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
@@ -80,8 +81,33 @@ function App() {
     return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
   };
 
+  // Streaming links are looked up after the matches are shown
+  const fetchLinks = (matches, requestId) => {
+    matches.forEach((match, index) => {
+      if (match.youtube_url) return;
+      const params = new URLSearchParams({ title: match.title || '', artist: match.artist || '' });
+      fetch(`${API_BASE_URL}/links?${params}`)
+        .then((response) => (response.ok ? response.json() : null))
+        .then((links) => {
+          if (!links || resultsRequestRef.current !== requestId) return;
+          setResults((current) => {
+            if (!current || !current.matches) return current;
+            const updatedMatches = [...current.matches];
+            updatedMatches[index] = {
+              ...updatedMatches[index],
+              youtube_url: links.youtube_url || updatedMatches[index].youtube_url,
+              spotify_url: updatedMatches[index].spotify_url || links.spotify_url,
+            };
+            return { ...current, matches: updatedMatches };
+          });
+        })
+        .catch((err) => console.error('Link lookup error:', err));
+    });
+  };
+
   const processAudio = async () => {
     if (!file) return;
+    const requestId = ++resultsRequestRef.current;
 
     setLoading(true);
     setError(null);
@@ -101,13 +127,18 @@ function App() {
       const data = await response.json();
 
       if (!response.ok) {
-        throw new Error(data.error || 'Failed to process audio');
+        if (response.status === 429 && data.detail) {
+          const retryAfter = response.headers.get('Retry-After') || data.detail.retry_after_sec;
+          throw new Error(`The server is busy (queue position ${data.detail.queue_position}). Please try again in about ${retryAfter} seconds.`);
+        }
+        throw new Error(data.error || (typeof data.detail === 'string' && data.detail) || 'Failed to process audio');
       }
 
       if (data.success) {
         setResults(data);
         setProgress(100);
         setProcessingStage('completed');
+        fetchLinks(data.matches, requestId);
       } else {
         setError('No matches found for this audio');
         setResults(data);
@@ -121,6 +152,7 @@ function App() {
   };
 
   const removeFile = () => {
+    resultsRequestRef.current += 1;
     setFile(null);
     setResults(null);
     setError(null);
@@ -130,6 +162,7 @@ function App() {
   };
 
   const resetApp = () => {
+    resultsRequestRef.current += 1;
     setFile(null);
     setResults(null);
     setError(null);